@@ -1,20 +1,35 @@
+import os
+import time
+import multiprocessing
 import numpy as np
 import pandas as pd
-from matplotlib.ticker import AutoMinorLocator
-from scipy import stats
+#matplotlib and scipy are imported inside the plotting functions, so the parsing and statistics functions
+#(and the worker processes running them) load quickly
 from extractor_pipeline_v6 import *
+from isochrones_v1 import isochrone_tracks
+from instrumentation_v1 import instrumented
 
-#Read in isochrone files from 
+#Names of the four model sets we analyze, keyed by model type
+MODEL_SET_NAMES = {1: 'sp_s_i', 2: 'sp_h_i', 16: 'spubsmi', 17: 'spubhmi'}
 
-log_lum_1,log_temp_1 = np.genfromtxt('Isochr_Z0.0140_Vini0.00_t05.700.dat',unpack=True,usecols=[4,5])
-
-log_lum_2,log_temp_2 = np.genfromtxt('Isochr_Z0.0140_Vini0.00_t06.000.dat',unpack=True,usecols=[4,5])
+def load_model_set(model_type, pars_dir='.', dtype=None, int_codes=False):
+    """
+    Reads the IR and Gaia pars files of one model set with `read_extracted_file`.
 
-log_lum_3,log_temp_3 = np.genfromtxt('Isochr_Z0.0140_Vini0.00_t06.300.dat',unpack=True,usecols=[4,5])
+    Args:
+        model_type (int): Model set identifier (1, 2, 16 or 17).
+        pars_dir (str): Directory containing the pars files, named `pars_XXg04_IR.txt` and `pars_XXg04_Gaia.txt`.
+        dtype, int_codes: Opt-in reduced precision storage, see `read_extracted_file`.
 
-log_lum_4,log_temp_4 = np.genfromtxt('Isochr_Z0.0140_Vini0.00_t06.700.dat',unpack=True,usecols=[4,5])
+    Returns:
+        tuple:
+            ir_df (pandas.DataFrame): Parsed IR-only pars file.
+            gaia_df (pandas.DataFrame): Parsed Gaia pars file.
+    """
+    ir_df = read_extracted_file(os.path.join(pars_dir, 'pars_{:02d}g04_IR.txt'.format(model_type)), dtype, int_codes)
+    gaia_df = read_extracted_file(os.path.join(pars_dir, 'pars_{:02d}g04_Gaia.txt'.format(model_type)), dtype, int_codes)
 
-log_lum_5,log_temp_5 = np.genfromtxt('Isochr_Z0.0140_Vini0.00_t07.500.dat',unpack=True,usecols=[4,5])
+    return ir_df, gaia_df
 
 def merge_funcs(IR_pd, gaia_pd):
     """
@@ -64,7 +79,76 @@ def merge_funcs(IR_pd, gaia_pd):
                                                    'lum_avg_x', 'lum_w_avg_x', 'lum_avg_y', 'lum_w_avg_y']], on='MIR_NAME', how='left')
     return merged_df
     
-def hr_diagram_and_dust_ext_single(model_type, star_index_or_name, star_names_list):
+def compare_ir_gaia(IR_pd, gaia_pd, param_list=('star_temp_arr', 'lum_arr', 'av_arr')):
+    """
+    Pairs the IR and Gaia model-fit results of the stars found in both, without merging them.
+
+    Unlike `merge_funcs`, the two DataFrames are kept as they are and the stars are aligned through integer
+    row indices, so none of the per-star fit arrays are copied. The weighted and unweighted means are computed
+    once per DataFrame with `multi_param_weight_avg`.
+
+    Args:
+        IR_pd (pandas.DataFrame):  
+            IR model-fit results from `read_extracted_file`.  
+
+        gaia_pd (pandas.DataFrame):  
+            Gaia model-fit results of the same model set.  
+
+        param_list (tuple or list of str):  
+            Parameters to average.  
+
+    Returns:
+        dict:  
+            - 'names' (np.ndarray): MIR_NAME of the stars in both, in IR order (the same order as `merge_funcs`).  
+            - 'ir', 'gaia' (pandas.DataFrame): The input DataFrames, not copied.  
+            - 'ir_rows', 'gaia_rows' (np.ndarray of int): Row of each star in `ir` and `gaia`.  
+            - 'ir_means', 'gaia_means' (pandas.DataFrame): Means of every row of `ir` and `gaia`.  
+            - 'params' (list of str): `param_list`.  
+    """
+    ir_names = IR_pd['MIR_NAME'].to_numpy()
+    row_of_name = pd.Series(np.arange(len(gaia_pd)), index=gaia_pd['MIR_NAME'].to_numpy())
+    row_of_name = row_of_name[~row_of_name.index.duplicated()] #Only the first row of a repeated name is used
+
+    gaia_rows = row_of_name.reindex(ir_names).fillna(-1).to_numpy().astype(int)
+    ir_rows = np.flatnonzero(gaia_rows >= 0)
+
+    return {'names': ir_names[ir_rows], 'ir': IR_pd, 'gaia': gaia_pd, 'ir_rows': ir_rows, 'gaia_rows': gaia_rows[ir_rows],
+            'ir_means': multi_param_weight_avg(IR_pd, param_list), 'gaia_means': multi_param_weight_avg(gaia_pd, param_list),
+            'params': list(param_list)}
+
+def comparison_deltas(comparison):
+    """
+    Weighted means of every star from `compare_ir_gaia` with IR only and with Gaia, and their difference
+    (with Gaia minus IR only), e.g. 'star_temp_w_avg_x', 'star_temp_w_avg_y' and 'delta_star_temp'.
+    """
+    deltas = {'MIR_NAME': comparison['names']}
+    for param in comparison['params']:
+        col_name = param.replace('arr', 'w_avg')
+        ir_values = comparison['ir_means'][col_name].to_numpy()[comparison['ir_rows']]
+        gaia_values = comparison['gaia_means'][col_name].to_numpy()[comparison['gaia_rows']]
+        deltas[col_name + '_x'] = ir_values
+        deltas[col_name + '_y'] = gaia_values
+        deltas['delta_' + param[:-4]] = gaia_values - ir_values
+
+    return pd.DataFrame(deltas)
+
+def comparison_star(comparison, k):
+    """
+    All values of the k-th star of `compare_ir_gaia` as a dictionary with the same keys as a row of
+    `merge_funcs` (`_x` for IR, `_y` for Gaia). The fit arrays are referenced, not copied.
+    """
+    star = {'MIR_NAME': comparison['names'][k]}
+    for suffix, fits_df, means_df, row in [('_x', comparison['ir'], comparison['ir_means'], comparison['ir_rows'][k]),
+                                           ('_y', comparison['gaia'], comparison['gaia_means'], comparison['gaia_rows'][k])]:
+        for col_name in fits_df.columns.drop('MIR_NAME'):
+            star[col_name + suffix] = fits_df[col_name].iat[row]
+        for col_name in means_df.columns[3:]:
+            star[col_name + suffix] = means_df[col_name].iat[row]
+
+    return star
+
+@instrumented()
+def hr_diagram_and_dust_ext_single(model_type, star_index_or_name, star_names_list, pars_dir='.'):
     """
     Generate and save plots for a selected star comparing IR-only and IR+Gaia 
     model fits, including HR diagrams and dust extinction diagrams.
@@ -73,7 +157,7 @@ def hr_diagram_and_dust_ext_single(model_type, star_index_or_name, star_names_li
       - Accepts either a star index or star name.  
       - Loads the appropriate model-fit parameter files (IR and Gaia) depending 
         on `model_type`.  
-      - Merges IR and Gaia results with weighted and unweighted averages.  
+      - Aligns IR and Gaia results by row, with weighted and unweighted averages.  
       - Produces a 2×2 panel of plots:  
           (0,0): IR HR diagram  
           (0,1): Gaia HR diagram  
@@ -95,6 +179,9 @@ def hr_diagram_and_dust_ext_single(model_type, star_index_or_name, star_names_li
         star_names_list (pandas.Series):  
             A list or Series of star identifiers used for matching to model results.   
 
+        pars_dir (str):  
+            Directory containing the `pars_XXg04_IR.txt` and `pars_XXg04_Gaia.txt` files.  
+
     Returns:
         None  
             Displays the generated plots and saves them as PNG files in the 
@@ -103,10 +190,11 @@ def hr_diagram_and_dust_ext_single(model_type, star_index_or_name, star_names_li
 
     Notes:
         - Calls `read_extracted_file` to load model parameter files.  
-        - Calls `merge_funcs` to combine IR and Gaia results.  
-        - Isochrones (`log_temp_*`, `log_lum_*`) must be available in the 
-          namespace for plotting.  
+        - Calls `compare_ir_gaia` to align the IR and Gaia results.  
+        - Isochrones are loaded on first use with `isochrone_tracks` 
+          (see `isochrones_v1.py`).  
     """
+    import matplotlib.pyplot as plt
 
     if type(star_index_or_name) == str:
         star_index_data = star_names_list[star_names_list.iloc[:] == star_index_or_name].index
@@ -114,200 +202,196 @@ def hr_diagram_and_dust_ext_single(model_type, star_index_or_name, star_names_li
     else:
         star_index = star_index_or_name
 
-    if model_type == 1:
-        model_name = 'sp_s_i'
-        gaia_df = read_extracted_file('pars_01g04_Gaia.txt')
-        ir_df = read_extracted_file('pars_01g04_IR.txt')
-    elif model_type == 2:
-        model_name = 'sp_h_i'
-        gaia_df = read_extracted_file('pars_02g04_Gaia.txt')
-        ir_df = read_extracted_file('pars_02g04_IR.txt')
-    elif model_type == 16:
-        model_name = 'spubsmi'
-        gaia_df = read_extracted_file('pars_16g04_Gaia.txt')
-        ir_df = read_extracted_file('pars_16g04_IR.txt')
-    elif model_type == 17:
-        model_name = 'spubhmi'
-        gaia_df = read_extracted_file('pars_17g04_Gaia.txt')
-        ir_df = read_extracted_file('pars_17g04_IR.txt')
+    model_name = MODEL_SET_NAMES[model_type]
+    ir_df, gaia_df = load_model_set(model_type, pars_dir)
 
-    #Get merged of IR and Gaia parameters with weighted averages and averages
-    big_data = merge_funcs(ir_df, gaia_df)
+    #Get IR and Gaia parameters of the stars fitted in both, aligned by row, with weighted averages and averages
+    comparison = compare_ir_gaia(ir_df, gaia_df)
     name_to_check = star_names_list.loc[star_index]
-    # Check if the name exists in df_stats
-    exists = name_to_check in big_data['MIR_NAME'].values
-    
+    # Check if the name exists in the comparison
+    matches = np.flatnonzero(comparison['names'] == name_to_check)
+
     #true
-    if exists == 1:
+    if len(matches) > 0:
 
-        #Get index of star in the merged big_data pandas df
-        index_data_star_big_data = big_data[big_data['MIR_NAME'] == name_to_check].index
-        index_star_big_data = index_data_star_big_data[0]
-        
-        print('Working on plots for model set {} for star '.format(model_name) + big_data['MIR_NAME'][index_star_big_data] + ':')
+        #Get position of star in the comparison
+        k = matches[0]
+        star_name = comparison['names'][k]
+
+        print('Working on plots for model set {} for star '.format(model_name) + star_name + ':')
         fig, axs = plt.subplots(2,2,figsize=(20,14))
-        
-        size_avg_mark = 150
-        weights_IR = big_data['chi_2_arr_x'][index_star_big_data]
-        weights_gaia = big_data['chi_2_arr_y'][index_star_big_data]
-        norm_IR = plt.Normalize(vmin=min(weights_IR), vmax=max(weights_IR))
-        norm_gaia = plt.Normalize(vmin=min(weights_gaia), vmax=max(weights_gaia))
-        
-        #First plot (ax[0]) is IR only data HR diagram
-        axs[0, 0].scatter(np.log10(big_data['star_temp_arr' + '_x'][index_star_big_data]),\
-                          np.log10(big_data['lum_arr_x'][index_star_big_data]), \
-                          c=weights_IR, cmap='rainbow', norm=norm_IR, alpha=0.5)
-        
-        axs[0,0].scatter(np.log10(big_data['star_temp_arr'[:-4] + '_w_avg' + '_x'][index_star_big_data]),\
-                       np.log10(big_data['lum_arr'[:-4] + '_w_avg' + '_x'][index_star_big_data]), marker='^',facecolors='none',\
-                       color = 'blue',s=size_avg_mark, linewidths=2, label = 'Weighted Average')
-        
-        axs[0,0].scatter(np.log10(big_data['star_temp_arr'[:-4] + '_avg' + '_x' ][index_star_big_data]),\
-                       np.log10(big_data['lum_arr'[:-4] + '_avg' + '_x'][index_star_big_data]), marker='s',facecolors='none',\
-                       color = 'black',s = size_avg_mark, linewidths=2, label = 'Average')
-        
-        #Plot isochrones on IR plot
-        axs[0, 0].plot(log_temp_1, log_lum_1,'-',color='red',lw=3)
-        axs[0, 0].plot(log_temp_2, log_lum_2,'-',color='red',lw=3)
-        axs[0, 0].plot(log_temp_3, log_lum_3,'-',color='red',lw=3)
-        axs[0, 0].plot(log_temp_4, log_lum_4,'-',color='red',lw=3)
-        axs[0, 0].plot(log_temp_5, log_lum_5,'-',color='red',lw=3)
-        
-        #Second plot (ax[1]) is with Gaia data HR diagram
-        axs[0,1].scatter(np.log10(big_data['star_temp_arr' + '_y'][index_star_big_data]),\
-                         np.log10(big_data['lum_arr_y'][index_star_big_data]),\
-                         c=weights_gaia, cmap='rainbow', norm=norm_gaia, alpha=0.5)
-        
-        axs[0,1].scatter(np.log10(big_data['star_temp_arr'[:-4] + '_w_avg' + '_y'][index_star_big_data]),\
-                       np.log10(big_data['lum_arr'[:-4] + '_w_avg' + '_y'][index_star_big_data]), marker='^', facecolors='none',\
-                       color = 'blue',s = size_avg_mark, linewidths=2, label = 'Weighted Average')
-        
-        axs[0,1].scatter(np.log10(big_data['star_temp_arr'[:-4] + '_avg' + '_y' ][index_star_big_data]),\
-                       np.log10(big_data['lum_arr'[:-4] + '_avg' + '_y'][index_star_big_data]), marker='s',facecolors='none',\
-                       color = 'black',s = size_avg_mark, linewidths=2, label = 'Average')
-        
-        #Plot isochrones on Gaia plot
-        axs[0,1].plot(log_temp_1, log_lum_1,'-',color='red',lw=3, label = '0.5 Myr')
-        axs[0,1].plot(log_temp_2, log_lum_2,'-',color='red',lw=3, label = '1 Myr')
-        axs[0,1].plot(log_temp_3, log_lum_3,'-',color='red',lw=3, label = '2 Myr')
-        axs[0,1].plot(log_temp_4, log_lum_4,'-',color='red',lw=3, label = '5 Myr')
-        axs[0,1].plot(log_temp_5, log_lum_5,'-',color='red',lw=3, label = '31.6 Myr')
-        
-        ###### Plot dust extinction plots now
-        
-        #First plot (axs[1,0]) is IR only data
-        
-        caxs_1 = axs[1,0].scatter(np.log10(big_data['star_temp_arr' + '_x'][index_star_big_data]),\
-                       big_data['av_arr' + '_x'][index_star_big_data], marker='o',\
-                       c=weights_IR, cmap='rainbow', norm=norm_IR, alpha=0.5)
-        
-        axs[1,0].scatter(np.log10(big_data['star_temp_arr'[:-4] + '_w_avg' + '_x'][index_star_big_data]),\
-                       big_data['av_arr'[:-4] + '_w_avg' + '_x'][index_star_big_data], marker='^',facecolors='none',\
-                       color = 'blue',s=size_avg_mark, linewidths=2, label = 'Weighted Average')
-        
-        axs[1,0].scatter(np.log10(big_data['star_temp_arr'[:-4] + '_avg' + '_x' ][index_star_big_data]),\
-                       big_data['av_arr'[:-4] + '_avg' + '_x'][index_star_big_data], marker='s',facecolors='none',\
-                       color = 'black',s = size_avg_mark, linewidths=2, label = 'Average')
-        
-        #Second plot (axs[1,1]) is with Gaia data
-        caxs_2 = axs[1,1].scatter(np.log10(big_data['star_temp_arr' + '_y'][index_star_big_data]), \
-                       big_data['av_arr' + '_y'][index_star_big_data], marker='o',\
-                       c=weights_gaia, cmap='rainbow', norm=norm_gaia, alpha=0.5)
-        
-        axs[1,1].scatter(np.log10(big_data['star_temp_arr'[:-4] + '_w_avg' + '_y'][index_star_big_data]),\
-                       big_data['av_arr'[:-4] + '_w_avg' + '_y'][index_star_big_data], marker='^', facecolors='none',\
-                       color = 'blue',s = size_avg_mark, linewidths=2, label = 'Weighted Average')
-        
-        axs[1,1].scatter(np.log10(big_data['star_temp_arr'[:-4] + '_avg' + '_y' ][index_star_big_data]),\
-                       big_data['av_arr'[:-4] + '_avg' + '_y'][index_star_big_data], marker='s',facecolors='none',\
-                       color = 'black',s = size_avg_mark, linewidths=2, label = 'Average')
-        
-        #Titles
-        if model_type == 1:
-            fig.suptitle('Disk Only YSO Models (sp-s-i) ' + '- ' + big_data['MIR_NAME'][index_star_big_data])
-        elif model_type == 2:
-            fig.suptitle('Disk Only YSO Models (sp-h-i)' + '- ' + big_data['MIR_NAME'][index_star_big_data])
-        elif model_type == 16:
-            fig.suptitle('Disk + Envelope YSO Models (spubsmi)' + '- ' + big_data['MIR_NAME'][index_star_big_data])
-        elif model_type == 17:
-            fig.suptitle('Disk + Envelope YSO Models (spubhmi)' + '- ' + big_data['MIR_NAME'][index_star_big_data])
-            
-        #PLot titles
-        axs[0,0].set_title('IR Only')
-        axs[0,1].set_title('With Gaia')
-        fig.supxlabel(r'log$(T_{eff})$ (K)')
-        
-        #HR plot graphics
-        axs[0,0].set_ylabel(r'log$(L/L_{\odot})$', fontsize = 12) 
-        
-        ##Tick mark stuff
-        axs[0,0].xaxis.set_minor_locator(AutoMinorLocator())
-        axs[0,0].yaxis.set_minor_locator(AutoMinorLocator())
-        axs[0,0].tick_params(axis="x", which = "both", direction="in")
-        axs[0,0].tick_params(axis="y",which = "both", direction="in")
-        
-        axs[0,1].xaxis.set_minor_locator(AutoMinorLocator())
-        axs[0,1].yaxis.set_minor_locator(AutoMinorLocator())
-        axs[0,1].tick_params(axis="x", which = "both", direction="in")
-        axs[0,1].tick_params(axis="y",which = "both", direction="in")
-        
-        axs[0,0].set_xlim(4.3,3.5)
-        axs[0,0].set_ylim(-0.5, 4)
-        axs[0,1].set_xlim(4.3,3.5)
-        axs[0,1].set_ylim(-0.5, 4)
-        # axs[0,0].legend(loc="lower left")
-        axs[0,1].legend(loc="upper right")
-        
-        ##Accounting of YSOs in data sets
-        num_stars_ir = big_data['n_fits_x'][index_star_big_data]
-        num_stars_gaia = big_data["n_fits_y"][index_star_big_data]
-        axs[0,0].text(4.25, -0.2,'YSOs in Sample = {}'.format(num_stars_ir), \
-                    bbox = dict(facecolor = 'none', edgecolor='black'), fontsize = 6.6);
-        axs[0,1].text(4.25, -0.2,'YSOs in Sample = {}'.format(num_stars_gaia), \
-                    bbox = dict(facecolor = 'none', edgecolor='black'), fontsize = 6.6);
-        
-        #Dust extinction
-        axs[1,0].set_ylabel('Dust Extinction', fontsize = 12)
-        
-        ##Tick mark stuff
-        axs[1,0].xaxis.set_minor_locator(AutoMinorLocator())
-        axs[1,0].yaxis.set_minor_locator(AutoMinorLocator())
-        axs[1,0].tick_params(axis="x", which = "both", direction="in")
-        axs[1,0].tick_params(axis="y",which = "both", direction="in")
-        
-        axs[1,1].xaxis.set_minor_locator(AutoMinorLocator())
-        axs[1,1].yaxis.set_minor_locator(AutoMinorLocator())
-        axs[1,1].tick_params(axis="x", which = "both", direction="in")
-        axs[1,1].tick_params(axis="y",which = "both", direction="in")
-        
-        axs[1,0].set_xlim(4.3,3.5)
-        axs[1,0].set_ylim(-0.5, 20)
-        
-        axs[1,1].set_xlim(4.3,3.5)
-        axs[1,1].set_ylim(-0.5, 20)
-        
-        axs[1,0].legend(loc="upper left")
-        axs[1,1].legend(loc="upper left")
-        
-        fig.colorbar(caxs_1, ax=axs[1,0], orientation="horizontal")
-        fig.colorbar(caxs_2, ax=axs[1,1], orientation="horizontal")
-        
-        #Accounting of YSOs in data sets
-        axs[1,0].text(0.72 , 0.92, 'Number of Valid Models = {}'.format(num_stars_ir), \
-                    bbox = dict(facecolor = 'white', edgecolor='black', alpha = 0.6), \
-                    fontsize = 6.5, ha='left', va='top', transform=axs[1,0].transAxes);
-        axs[1,1].text(0.72 , 0.92,'Number of Valid Models = {}'.format(num_stars_gaia), \
-                    bbox = dict(facecolor = 'white', edgecolor='black', alpha = 0.6), \
-                    fontsize = 6.5, ha='left', va='top', transform=axs[1,1].transAxes);
-        
+
+        _draw_single_star(fig, axs, comparison_star(comparison, k), model_type)
+
         fig.tight_layout()
-        filename = big_data['MIR_NAME'][index_star_big_data] + '_' + model_name + '.png'
+        filename = star_name + '_' + model_name + '.png'
         plt.savefig(filename, bbox_inches='tight', dpi=300)
         plt.show();
     else:
         print(f"'{name_to_check}' does not have {model_name} model available")
         print('--------------------------------------------------------------')
 
+def _draw_single_star(fig, axs, star, model_type):
+    """
+    Draws the 2×2 panel of single-star plots (IR/Gaia HR diagrams and dust extinction) on an existing figure.
+    Used by `hr_diagram_and_dust_ext_single` and `render_all_single_star_plots`, so it must not call
+    pyplot directly.
+
+    Args:
+        fig (matplotlib.figure.Figure): Figure to draw on.
+        axs (np.ndarray): 2×2 array of axes from `fig.subplots(2,2)`.
+        star (dict): IR (`_x`) and Gaia (`_y`) values of the star from `comparison_star` (or a row of `merge_funcs`).
+        model_type (int): Model set identifier (1, 2, 16 or 17).
+    """
+    from matplotlib.colors import Normalize
+    from matplotlib.ticker import AutoMinorLocator
+    size_avg_mark = 150
+    weights_IR = star['chi_2_arr_x']
+    weights_gaia = star['chi_2_arr_y']
+    norm_IR = Normalize(vmin=min(weights_IR), vmax=max(weights_IR))
+    norm_gaia = Normalize(vmin=min(weights_gaia), vmax=max(weights_gaia))
+    
+    #First plot (ax[0]) is IR only data HR diagram
+    axs[0, 0].scatter(np.log10(star['star_temp_arr' + '_x']),\
+                      np.log10(star['lum_arr_x']), \
+                      c=weights_IR, cmap='rainbow', norm=norm_IR, alpha=0.5)
+    
+    axs[0,0].scatter(np.log10(star['star_temp_arr'[:-4] + '_w_avg' + '_x']),\
+                   np.log10(star['lum_arr'[:-4] + '_w_avg' + '_x']), marker='^',facecolors='none',\
+                   color = 'blue',s=size_avg_mark, linewidths=2, label = 'Weighted Average')
+    
+    axs[0,0].scatter(np.log10(star['star_temp_arr'[:-4] + '_avg' + '_x' ]),\
+                   np.log10(star['lum_arr'[:-4] + '_avg' + '_x']), marker='s',facecolors='none',\
+                   color = 'black',s = size_avg_mark, linewidths=2, label = 'Average')
+    
+    #Plot isochrones on IR plot
+    for log_temp, log_lum, age_label in isochrone_tracks():
+        axs[0, 0].plot(log_temp, log_lum,'-',color='red',lw=3)
+    
+    #Second plot (ax[1]) is with Gaia data HR diagram
+    axs[0,1].scatter(np.log10(star['star_temp_arr' + '_y']),\
+                     np.log10(star['lum_arr_y']),\
+                     c=weights_gaia, cmap='rainbow', norm=norm_gaia, alpha=0.5)
+    
+    axs[0,1].scatter(np.log10(star['star_temp_arr'[:-4] + '_w_avg' + '_y']),\
+                   np.log10(star['lum_arr'[:-4] + '_w_avg' + '_y']), marker='^', facecolors='none',\
+                   color = 'blue',s = size_avg_mark, linewidths=2, label = 'Weighted Average')
+    
+    axs[0,1].scatter(np.log10(star['star_temp_arr'[:-4] + '_avg' + '_y' ]),\
+                   np.log10(star['lum_arr'[:-4] + '_avg' + '_y']), marker='s',facecolors='none',\
+                   color = 'black',s = size_avg_mark, linewidths=2, label = 'Average')
+    
+    #Plot isochrones on Gaia plot
+    for log_temp, log_lum, age_label in isochrone_tracks():
+        axs[0,1].plot(log_temp, log_lum,'-',color='red',lw=3, label = age_label)
+    
+    ###### Plot dust extinction plots now
+    
+    #First plot (axs[1,0]) is IR only data
+    
+    caxs_1 = axs[1,0].scatter(np.log10(star['star_temp_arr' + '_x']),\
+                   star['av_arr' + '_x'], marker='o',\
+                   c=weights_IR, cmap='rainbow', norm=norm_IR, alpha=0.5)
+    
+    axs[1,0].scatter(np.log10(star['star_temp_arr'[:-4] + '_w_avg' + '_x']),\
+                   star['av_arr'[:-4] + '_w_avg' + '_x'], marker='^',facecolors='none',\
+                   color = 'blue',s=size_avg_mark, linewidths=2, label = 'Weighted Average')
+    
+    axs[1,0].scatter(np.log10(star['star_temp_arr'[:-4] + '_avg' + '_x' ]),\
+                   star['av_arr'[:-4] + '_avg' + '_x'], marker='s',facecolors='none',\
+                   color = 'black',s = size_avg_mark, linewidths=2, label = 'Average')
+    
+    #Second plot (axs[1,1]) is with Gaia data
+    caxs_2 = axs[1,1].scatter(np.log10(star['star_temp_arr' + '_y']), \
+                   star['av_arr' + '_y'], marker='o',\
+                   c=weights_gaia, cmap='rainbow', norm=norm_gaia, alpha=0.5)
+    
+    axs[1,1].scatter(np.log10(star['star_temp_arr'[:-4] + '_w_avg' + '_y']),\
+                   star['av_arr'[:-4] + '_w_avg' + '_y'], marker='^', facecolors='none',\
+                   color = 'blue',s = size_avg_mark, linewidths=2, label = 'Weighted Average')
+    
+    axs[1,1].scatter(np.log10(star['star_temp_arr'[:-4] + '_avg' + '_y' ]),\
+                   star['av_arr'[:-4] + '_avg' + '_y'], marker='s',facecolors='none',\
+                   color = 'black',s = size_avg_mark, linewidths=2, label = 'Average')
+    
+    #Titles
+    if model_type == 1:
+        fig.suptitle('Disk Only YSO Models (sp-s-i) ' + '- ' + star['MIR_NAME'])
+    elif model_type == 2:
+        fig.suptitle('Disk Only YSO Models (sp-h-i)' + '- ' + star['MIR_NAME'])
+    elif model_type == 16:
+        fig.suptitle('Disk + Envelope YSO Models (spubsmi)' + '- ' + star['MIR_NAME'])
+    elif model_type == 17:
+        fig.suptitle('Disk + Envelope YSO Models (spubhmi)' + '- ' + star['MIR_NAME'])
+        
+    #PLot titles
+    axs[0,0].set_title('IR Only')
+    axs[0,1].set_title('With Gaia')
+    fig.supxlabel(r'log$(T_{eff})$ (K)')
+    
+    #HR plot graphics
+    axs[0,0].set_ylabel(r'log$(L/L_{\odot})$', fontsize = 12) 
+    
+    ##Tick mark stuff
+    axs[0,0].xaxis.set_minor_locator(AutoMinorLocator())
+    axs[0,0].yaxis.set_minor_locator(AutoMinorLocator())
+    axs[0,0].tick_params(axis="x", which = "both", direction="in")
+    axs[0,0].tick_params(axis="y",which = "both", direction="in")
+    
+    axs[0,1].xaxis.set_minor_locator(AutoMinorLocator())
+    axs[0,1].yaxis.set_minor_locator(AutoMinorLocator())
+    axs[0,1].tick_params(axis="x", which = "both", direction="in")
+    axs[0,1].tick_params(axis="y",which = "both", direction="in")
+    
+    axs[0,0].set_xlim(4.3,3.5)
+    axs[0,0].set_ylim(-0.5, 4)
+    axs[0,1].set_xlim(4.3,3.5)
+    axs[0,1].set_ylim(-0.5, 4)
+    # axs[0,0].legend(loc="lower left")
+    axs[0,1].legend(loc="upper right")
+    
+    ##Accounting of YSOs in data sets
+    num_stars_ir = star['n_fits_x']
+    num_stars_gaia = star["n_fits_y"]
+    axs[0,0].text(4.25, -0.2,'YSOs in Sample = {}'.format(num_stars_ir), \
+                bbox = dict(facecolor = 'none', edgecolor='black'), fontsize = 6.6);
+    axs[0,1].text(4.25, -0.2,'YSOs in Sample = {}'.format(num_stars_gaia), \
+                bbox = dict(facecolor = 'none', edgecolor='black'), fontsize = 6.6);
+    
+    #Dust extinction
+    axs[1,0].set_ylabel('Dust Extinction', fontsize = 12)
+    
+    ##Tick mark stuff
+    axs[1,0].xaxis.set_minor_locator(AutoMinorLocator())
+    axs[1,0].yaxis.set_minor_locator(AutoMinorLocator())
+    axs[1,0].tick_params(axis="x", which = "both", direction="in")
+    axs[1,0].tick_params(axis="y",which = "both", direction="in")
+    
+    axs[1,1].xaxis.set_minor_locator(AutoMinorLocator())
+    axs[1,1].yaxis.set_minor_locator(AutoMinorLocator())
+    axs[1,1].tick_params(axis="x", which = "both", direction="in")
+    axs[1,1].tick_params(axis="y",which = "both", direction="in")
+    
+    axs[1,0].set_xlim(4.3,3.5)
+    axs[1,0].set_ylim(-0.5, 20)
+    
+    axs[1,1].set_xlim(4.3,3.5)
+    axs[1,1].set_ylim(-0.5, 20)
+    
+    axs[1,0].legend(loc="upper left")
+    axs[1,1].legend(loc="upper left")
+    
+    fig.colorbar(caxs_1, ax=axs[1,0], orientation="horizontal")
+    fig.colorbar(caxs_2, ax=axs[1,1], orientation="horizontal")
+    
+    #Accounting of YSOs in data sets
+    axs[1,0].text(0.72 , 0.92, 'Number of Valid Models = {}'.format(num_stars_ir), \
+                bbox = dict(facecolor = 'white', edgecolor='black', alpha = 0.6), \
+                fontsize = 6.5, ha='left', va='top', transform=axs[1,0].transAxes);
+    axs[1,1].text(0.72 , 0.92,'Number of Valid Models = {}'.format(num_stars_gaia), \
+                bbox = dict(facecolor = 'white', edgecolor='black', alpha = 0.6), \
+                fontsize = 6.5, ha='left', va='top', transform=axs[1,1].transAxes);
+
 def multi_single_hr_diagram_av_plots(star_index_given, star_names_pd):
     """
     Generate multiple HR diagram and dust extinction plots for a single star 
@@ -346,7 +430,157 @@ def multi_single_hr_diagram_av_plots(star_index_given, star_names_pd):
         model_type_i = model_types_arr[i]
         hr_diagram_and_dust_ext_single(model_type = model_type_i, star_index_or_name = star_index_given, star_names_list = star_names_pd)
 
-def hr_diagram_and_dust_ext_region(model_type):
+#IR/Gaia comparison of every model set for the render workers. Set before the pool starts, so forked workers
+#inherit it without pickling; spawned workers receive it once through `_init_render_worker`
+_RENDER_DATA = {}
+
+def _init_render_worker(render_data):
+    _RENDER_DATA.update(render_data)
+
+@instrumented(name='render_single_star', counts=lambda filename: {'files': 1})
+def _render_single_star_task(task):
+    """
+    Draws and saves one single-star figure with the Agg canvas (no pyplot, no display).
+    """
+    from matplotlib.figure import Figure
+    model_type, k, output_dir, dpi = task
+    comparison = _RENDER_DATA[model_type]
+
+    fig = Figure(figsize=(20,14))
+    axs = fig.subplots(2,2)
+    _draw_single_star(fig, axs, comparison_star(comparison, k), model_type)
+    fig.tight_layout()
+
+    filename = os.path.join(output_dir, comparison['names'][k] + '_' + MODEL_SET_NAMES[model_type] + '.png')
+    fig.savefig(filename, bbox_inches='tight', dpi=dpi)
+
+    return filename
+
+@instrumented(counts=lambda filenames: {'files': len(filenames)})
+def render_all_single_star_plots(stars, model_types=(1, 2, 16, 17), workers=None, output_dir='.', pars_dir='.', dpi=300):
+    """
+    Generate the single-star HR diagram and dust extinction plots of many stars at once.
+
+    Unlike calling `multi_single_hr_diagram_av_plots` per star, each model set is parsed and merged
+    only once, and the figures are rendered in parallel worker processes with the non-interactive
+    Agg canvas. Figures are only saved (`plt.show` is never called).
+
+    Args:
+        stars (list of str or pandas.Series):  
+            Names of the stars to plot (`MIR_NAME`, without the 'SSTGLMC ' prefix).  
+
+        model_types (tuple of int):  
+            Model sets to plot (any of 1, 2, 16, 17).  
+
+        workers (int or None):  
+            Number of worker processes. None uses every core, 1 renders in this process.  
+
+        output_dir (str):  
+            Directory the PNG files are written to.  
+
+        pars_dir (str):  
+            Directory containing the pars files.  
+
+        dpi (int):  
+            Resolution of the saved figures. Lower values render considerably faster.  
+
+    Returns:
+        list of str  
+            Paths of the written figures, named `<MIR_NAME>_<model_name>.png` as in 
+            `hr_diagram_and_dust_ext_single`.  
+    """
+    stars = list(stars)
+    os.makedirs(output_dir, exist_ok=True)
+
+    render_data = {}
+    tasks = []
+    for model_type in model_types:
+        ir_df, gaia_df = load_model_set(model_type, pars_dir)
+        comparison = compare_ir_gaia(ir_df, gaia_df)
+        render_data[model_type] = comparison
+
+        #Position of every star in the comparison, found with one lookup instead of a scan per star
+        row_of_name = pd.Series(np.arange(len(comparison['names'])), index=comparison['names'])
+        row_of_name = row_of_name[~row_of_name.index.duplicated()]
+        found = [name for name in stars if name in row_of_name.index]
+        if len(found) < len(stars):
+            print('{} of {} stars do not have {} models available'.format(len(stars) - len(found), len(stars), \
+                  MODEL_SET_NAMES[model_type]))
+        tasks += [(model_type, int(row_of_name[name]), output_dir, dpi) for name in found]
+
+    print('Rendering {} figures:'.format(len(tasks)))
+
+    _RENDER_DATA.update(render_data)
+    try:
+        if workers == 1 or len(tasks) <= 1:
+            return [_render_single_star_task(task) for task in tasks]
+
+        if 'fork' in multiprocessing.get_all_start_methods():
+            #Forked workers inherit the parsed tables from this process (copy-on-write)
+            pool = multiprocessing.get_context('fork').Pool(workers)
+        else:
+            pool = multiprocessing.get_context().Pool(workers, initializer=_init_render_worker, initargs=(render_data,))
+
+        with pool:
+            chunksize = max(1, len(tasks) // (4 * (workers or os.cpu_count())))
+            filenames = pool.map(_render_single_star_task, tasks, chunksize=chunksize)
+    finally:
+        _RENDER_DATA.clear()
+
+    return filenames
+
+def _density_layer(ax, x, y, x_range, y_range, weights=None, bins=200, cmap='Blues'):
+    """
+    Draws a set of points as a single 2D histogram image instead of one marker per point, so the drawing time
+    and the file size do not depend on the number of points. Empty bins are left transparent, and the color
+    scale is logarithmic, spanning three decades below the fullest bin.
+
+    Args:
+        ax (matplotlib.axes.Axes): Axes to draw on.
+        x, y (array-like): Point coordinates. Non-finite points are skipped.
+        x_range, y_range (tuple of float): Limits of the histogram, in either order (e.g. the reversed
+                                           (4.3, 3.5) temperature axis).
+        weights (array-like or None): Weight of every point. None counts every point once.
+        bins (int): Number of bins along each axis.
+        cmap (str): Colormap of the image.
+
+    Returns:
+        matplotlib.image.AxesImage: The image, e.g. for a colorbar.
+    """
+    from matplotlib.colors import LogNorm
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    finite = np.isfinite(x) & np.isfinite(y)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float)[finite]
+
+    counts, x_edges, y_edges = np.histogram2d(x[finite], y[finite], bins=bins,
+                                              range=[sorted(x_range), sorted(y_range)], weights=weights)
+    counts = np.ma.masked_less_equal(counts, 0)
+
+    #Chi-squared weights can be vanishingly small, so the color scale only spans three decades below the peak
+    norm = None
+    if counts.count() > 0:
+        norm = LogNorm(vmin=counts.max() * 1e-3, vmax=counts.max(), clip=True)
+
+    return ax.imshow(counts.T, origin='lower', extent=(x_edges[0], x_edges[-1], y_edges[0], y_edges[-1]),
+                     aspect='auto', interpolation='nearest', cmap=cmap, norm=norm)
+
+def _density_points(fits_df, means_df, weighted):
+    """
+    Returns the log(T_eff), log(L/L_sun), A_V and weights to bin for a density plot. These are the weighted
+    means of every star (`means_df`), or with `weighted` every fit of every star (`fits_df`) with its
+    normalized chi-squared weight, so that each star still adds up to one.
+    """
+    if weighted:
+        star_index, flat = flat_fit_table(fits_df, ['chi_2_arr', 'star_temp_arr', 'lum_arr', 'av_arr'])
+        weights = chi2_weights(flat['chi_2_arr'], star_index, len(fits_df))
+        return np.log10(flat['star_temp_arr']), np.log10(flat['lum_arr']), flat['av_arr'], weights
+
+    return np.log10(means_df['star_temp_w_avg']), np.log10(means_df['lum_w_avg']), means_df['av_w_avg'], None
+
+@instrumented()
+def hr_diagram_and_dust_ext_region(model_type, density=False, weighted=False, bins=200, pars_dir='.'):
     """
     Create HR diagram and dust extinction plots for an entire YSO model set.
 
@@ -369,6 +603,18 @@ def hr_diagram_and_dust_ext_region(model_type):
         - 2  -> sp_h_i
         - 16 -> spubsmi
         - 17 -> spubhmi
+    density : bool
+        If True, the points are binned into a 2D histogram drawn as one image
+        per panel instead of a scatter plot. Use this for large regions, since
+        the drawing time and file size no longer depend on the number of stars.
+    weighted : bool
+        Only used with `density`. If True, every model fit of every star is
+        binned with its normalized chi-squared weight instead of only the
+        weighted mean of each star.
+    bins : int
+        Number of histogram bins along each axis when `density` is True.
+    pars_dir : str
+        Directory containing the pars files.
 
     Returns
     -------
@@ -378,26 +624,13 @@ def hr_diagram_and_dust_ext_region(model_type):
     Notes
     -----
     - Relies on `multi_param_weight_avg()` to compute weighted averages.
-    - Isochrone arrays (`log_temp_*`, `log_lum_*`) must be available in scope.
+    - Isochrones are loaded on first use with `isochrone_tracks()`.
     - HR diagram x-axes are reversed (hotter stars to the left).
     """
+    import matplotlib.pyplot as plt
 
-    if model_type == 1:
-        model_name = 'sp_s_i'
-        gaia_df = read_extracted_file('pars_01g04_Gaia.txt')
-        ir_df = read_extracted_file('pars_01g04_IR.txt')
-    elif model_type == 2:
-        model_name = 'sp_h_i'
-        gaia_df = read_extracted_file('pars_02g04_Gaia.txt')
-        ir_df = read_extracted_file('pars_02g04_IR.txt')
-    elif model_type == 16:
-        model_name = 'spubsmi'
-        gaia_df = read_extracted_file('pars_16g04_Gaia.txt')
-        ir_df = read_extracted_file('pars_16g04_IR.txt')
-    elif model_type == 17:
-        model_name = 'spubhmi'
-        gaia_df = read_extracted_file('pars_17g04_Gaia.txt')
-        ir_df = read_extracted_file('pars_17g04_IR.txt')
+    model_name = MODEL_SET_NAMES[model_type]
+    ir_df, gaia_df = load_model_set(model_type, pars_dir)
 
     print('Working on HR diagram for model set {}:'.format(model_name))
     
@@ -405,38 +638,64 @@ def hr_diagram_and_dust_ext_region(model_type):
     df_gaia_pars = multi_param_weight_avg(gaia_df, ['star_temp_arr', 'lum_arr', 'av_arr'])
 
     fig, axs = plt.subplots(2,2,figsize=(20,14))
+    draw_region(fig, axs, model_type, ir_df, gaia_df, df_IR_pars, df_gaia_pars, density, weighted, bins)
     
-    #First plot (ax[0]) is IR only data HR diagram
-    axs[0, 0].scatter(np.log10(df_IR_pars['star_temp_w_avg']),\
-                      np.log10(df_IR_pars['lum_w_avg']), alpha=0.5)
+    fig.tight_layout()
+    filename = model_name + '_region' + '.png'
+    plt.savefig(filename, bbox_inches='tight', dpi=300)
+    plt.show();
+
+    # return None
+
+def draw_region(fig, axs, model_type, ir_df, gaia_df, df_IR_pars, df_gaia_pars, density=False, weighted=False, bins=200):
+    """
+    Draws the 2×2 panel of region plots (IR/Gaia HR diagrams and dust extinction) on an existing figure.
+    Used by `hr_diagram_and_dust_ext_region` and `render_region_plots`, so it must not call pyplot directly.
+
+    Args:
+        fig (matplotlib.figure.Figure): Figure to draw on.
+        axs (np.ndarray): 2×2 array of axes from `fig.subplots(2,2)`.
+        model_type (int): Model set identifier (1, 2, 16 or 17).
+        ir_df, gaia_df (pandas.DataFrame or None): Parsed pars files. Only used for `weighted` density plots.
+        df_IR_pars, df_gaia_pars (pandas.DataFrame): Means from `multi_param_weight_avg`.
+        density, weighted, bins: See `hr_diagram_and_dust_ext_region`.
+    """
+    from matplotlib.ticker import AutoMinorLocator
     
-    #Plot isochrones on IR plot
-    axs[0, 0].plot(log_temp_1, log_lum_1,'-',color='red',lw=2)
-    axs[0, 0].plot(log_temp_2, log_lum_2,'-',color='red',lw=2)
-    axs[0, 0].plot(log_temp_3, log_lum_3,'-',color='red',lw=2)
-    axs[0, 0].plot(log_temp_4, log_lum_4,'-',color='red',lw=2)
-    axs[0, 0].plot(log_temp_5, log_lum_5,'-',color='red',lw=2)
+    if density:
+        #One image per panel, with the same axis limits as the scatter plots below
+        for j, (fits_df, means_df) in enumerate([(ir_df, df_IR_pars), (gaia_df, df_gaia_pars)]):
+            log_temp, log_lum, av, weights = _density_points(fits_df, means_df, weighted)
+            image_hr = _density_layer(axs[0,j], log_temp, log_lum, (4.3,3.5), (-0.5,4), weights, bins)
+            image_av = _density_layer(axs[1,j], log_temp, av, (4.3,3.5), (-0.5,20), weights, bins)
+            fig.colorbar(image_hr, ax=axs[0,j], label='YSOs per bin')
+            fig.colorbar(image_av, ax=axs[1,j], label='YSOs per bin')
+    else:
+        #First plot (ax[0]) is IR only data HR diagram
+        axs[0, 0].scatter(np.log10(df_IR_pars['star_temp_w_avg']),\
+                          np.log10(df_IR_pars['lum_w_avg']), alpha=0.5)
+        
+        #Second plot (ax[1]) is with Gaia data HR diagram
+        axs[0,1].scatter(np.log10(df_gaia_pars['star_temp_w_avg']), \
+                         np.log10(df_gaia_pars['lum_w_avg']), alpha=0.5)
+        
+        ###### Plot dust extinction plots now
+        
+        #First plot (axs[1,0]) is IR only data
+        caxs_1 = axs[1,0].scatter(np.log10(df_IR_pars['star_temp_w_avg']), \
+                                  df_IR_pars['av_w_avg'], alpha=0.5)
+        
+        #Second plot (axs[1,1]) is with Gaia data
+        caxs_2 = axs[1,1].scatter(np.log10(df_gaia_pars['star_temp_w_avg']), \
+                                  df_gaia_pars['av_w_avg'], alpha=0.5)
     
-    #Second plot (ax[1]) is with Gaia data HR diagram
-    axs[0,1].scatter(np.log10(df_gaia_pars['star_temp_w_avg']), \
-                     np.log10(df_gaia_pars['lum_w_avg']), alpha=0.5)
+    #Plot isochrones on IR plot
+    for log_temp, log_lum, age_label in isochrone_tracks():
+        axs[0, 0].plot(log_temp, log_lum,'-',color='red',lw=2)
     
     #Plot isochrones on Gaia plot
-    axs[0,1].plot(log_temp_1, log_lum_1,'-',color='red',lw=2, label = '0.5 Myr')
-    axs[0,1].plot(log_temp_2, log_lum_2,'-',color='red',lw=2, label = '1 Myr')
-    axs[0,1].plot(log_temp_3, log_lum_3,'-',color='red',lw=2, label = '2 Myr')
-    axs[0,1].plot(log_temp_4, log_lum_4,'-',color='red',lw=2, label = '5 Myr')
-    axs[0,1].plot(log_temp_5, log_lum_5,'-',color='red',lw=2, label = '31.6 Myr')
-    
-    ###### Plot dust extinction plots now
-    
-    #First plot (axs[1,0]) is IR only data
-    caxs_1 = axs[1,0].scatter(np.log10(df_IR_pars['star_temp_w_avg']), \
-                              df_IR_pars['av_w_avg'], alpha=0.5)
-    
-    #Second plot (axs[1,1]) is with Gaia data
-    caxs_2 = axs[1,1].scatter(np.log10(df_gaia_pars['star_temp_w_avg']), \
-                              df_gaia_pars['av_w_avg'], alpha=0.5)
+    for log_temp, log_lum, age_label in isochrone_tracks():
+        axs[0,1].plot(log_temp, log_lum,'-',color='red',lw=2, label = age_label)
     
     #Titles
     if model_type == 1:
@@ -502,13 +761,6 @@ def hr_diagram_and_dust_ext_region(model_type):
     
     axs[1,1].set_xlim(4.3,3.5)
     axs[1,1].set_ylim(-0.5, 20)
-    
-    fig.tight_layout()
-    filename = model_name + '_region' + '.png'
-    plt.savefig(filename, bbox_inches='tight', dpi=300)
-    plt.show();
-
-    # return None
 
 def multi_region_hr_diagram_av_plots():
     """
@@ -530,6 +782,161 @@ def multi_region_hr_diagram_av_plots():
         model_type_i = model_types_arr[i]
         hr_diagram_and_dust_ext_region(model_type = model_type_i)
 
+#Parameters averaged for the region plots, and the columns of the pars files the weighted density plots need
+REGION_PARAMS = ['star_temp_arr', 'lum_arr', 'av_arr']
+_REGION_FIT_COLUMNS = ['MIR_NAME', 'chi_2_arr'] + REGION_PARAMS
+
+def _load_region_task(task):
+    """
+    Parses one pars file and computes its means for `render_region_plots`. Only the fit columns needed for
+    weighted density plots are sent back, to keep what is pickled between processes small.
+    """
+    model_type, data_type, pars_dir, keep_fits = task
+
+    start = time.perf_counter()
+    df = read_extracted_file(os.path.join(pars_dir, 'pars_{:02d}g04_{}.txt'.format(model_type, data_type)))
+    parsed = time.perf_counter()
+    df_pars = multi_param_weight_avg(df, REGION_PARAMS)
+    reduced = time.perf_counter()
+
+    fits_df = df[_REGION_FIT_COLUMNS] if keep_fits else None
+    return fits_df, df_pars, parsed - start, reduced - parsed
+
+@instrumented(name='render_region', counts=lambda result: {'files': 1})
+def _render_region_task(task):
+    """
+    Draws and saves one region figure with the Agg canvas (no pyplot, no display).
+    """
+    model_type, output_dir, dpi, density, weighted, bins = task
+
+    start = time.perf_counter()
+    filename = save_region_figure(model_type, *_RENDER_DATA[model_type], output_dir, dpi, density, weighted, bins)
+
+    return filename, time.perf_counter() - start
+
+def save_region_figure(model_type, ir_df, gaia_df, df_IR_pars, df_gaia_pars, output_dir, dpi, density, weighted, bins):
+    """
+    Draws one region figure with the Agg canvas and saves it as `<model_name>_region.png` in `output_dir`.
+    """
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=(20,14))
+    axs = fig.subplots(2,2)
+    draw_region(fig, axs, model_type, ir_df, gaia_df, df_IR_pars, df_gaia_pars, density, weighted, bins)
+    fig.tight_layout()
+
+    filename = os.path.join(output_dir, MODEL_SET_NAMES[model_type] + '_region' + '.png')
+    fig.savefig(filename, bbox_inches='tight', dpi=dpi)
+    return filename
+
+@instrumented(name='render_region', counts=lambda result: {'files': 1})
+def render_region_figure(model_type, ir_df, gaia_df, output_dir='.', dpi=300, density=False, weighted=False, bins=200):
+    """
+    Saves the region figure of one model set from pars files that are already parsed, e.g. tables cached by
+    `pipeline_dag_v1.py`, without reading the pars files again. Same figure as `render_region_plots`.
+
+    Args:
+        model_type (int): Model set identifier (1, 2, 16 or 17).
+        ir_df, gaia_df (pandas.DataFrame): IR and Gaia pars files from `read_extracted_file`.
+        output_dir, dpi, density, weighted, bins: See `render_region_plots`.
+
+    Returns:
+        str: Path of the written figure.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    df_IR_pars = multi_param_weight_avg(ir_df, REGION_PARAMS)
+    df_gaia_pars = multi_param_weight_avg(gaia_df, REGION_PARAMS)
+    return save_region_figure(model_type, ir_df, gaia_df, df_IR_pars, df_gaia_pars, output_dir, dpi, density,
+                              weighted, bins)
+
+def _task_pool(workers, render_data=None):
+    """
+    Process pool for the region jobs. Forked workers inherit `_RENDER_DATA` from this process, spawned ones
+    receive `render_data` once through `_init_render_worker`.
+    """
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork').Pool(workers)
+    return multiprocessing.get_context().Pool(workers, initializer=_init_render_worker, initargs=(render_data or {},))
+
+@instrumented(counts=lambda result: {'files': len(result[0])})
+def render_region_plots(model_types=(1, 2, 16, 17), workers=None, output_dir='.', pars_dir='.', dpi=300,
+                        density=False, weighted=False, bins=200):
+    """
+    Generate the region HR diagram and dust extinction plots of several model sets in parallel.
+
+    This does the same as `multi_region_hr_diagram_av_plots`, in two parallel steps: all the IR and Gaia
+    pars files (eight for the four model sets) are parsed and averaged at the same time in worker processes,
+    and then the figures are rendered in worker processes with the non-interactive Agg canvas. Figures are 
+    only saved (`plt.show` is never called).
+
+    Args:
+        model_types (tuple of int):  
+            Model sets to plot (any of 1, 2, 16, 17).  
+
+        workers (int or None):  
+            Number of worker processes. None uses every core, 1 runs everything in this process.  
+
+        output_dir (str):  
+            Directory the PNG files are written to.  
+
+        pars_dir (str):  
+            Directory containing the pars files.  
+
+        dpi (int):  
+            Resolution of the saved figures.  
+
+        density, weighted, bins:  
+            Density plot options, see `hr_diagram_and_dust_ext_region`.  
+
+    Returns:
+        tuple:  
+            filenames (list of str): Paths of the written figures, named `<model_name>_region.png` as in 
+            `hr_diagram_and_dust_ext_region`.  
+            timings (pandas.DataFrame): One row per figure with the model set and the seconds spent parsing 
+            the two pars files ('parse_s'), averaging them ('reduce_s') and drawing and saving ('render_s').  
+    """
+    model_types = list(model_types)
+    os.makedirs(output_dir, exist_ok=True)
+
+    keep_fits = density and weighted
+    load_tasks = [(model_type, data_type, pars_dir, keep_fits) for model_type in model_types for data_type in ['IR', 'Gaia']]
+
+    print('Loading {} pars files:'.format(len(load_tasks)))
+    if workers == 1:
+        loaded = [_load_region_task(task) for task in load_tasks]
+    else:
+        with _task_pool(workers) as pool:
+            loaded = pool.map(_load_region_task, load_tasks, chunksize=1)
+
+    render_data = {}
+    timings = []
+    for k, model_type in enumerate(model_types):
+        ir_fits, ir_pars, ir_parse, ir_reduce = loaded[2*k]
+        gaia_fits, gaia_pars, gaia_parse, gaia_reduce = loaded[2*k + 1]
+        render_data[model_type] = (ir_fits, gaia_fits, ir_pars, gaia_pars)
+        timings.append({'model_set': MODEL_SET_NAMES[model_type], 'parse_s': ir_parse + gaia_parse, \
+                        'reduce_s': ir_reduce + gaia_reduce})
+
+    isochrone_tracks() #Loaded once here so forked workers inherit them
+    render_tasks = [(model_type, output_dir, dpi, density, weighted, bins) for model_type in model_types]
+
+    print('Rendering {} figures:'.format(len(render_tasks)))
+    _RENDER_DATA.update(render_data)
+    try:
+        if workers == 1 or len(render_tasks) <= 1:
+            rendered = [_render_region_task(task) for task in render_tasks]
+        else:
+            with _task_pool(workers, render_data) as pool:
+                rendered = pool.map(_render_region_task, render_tasks, chunksize=1)
+    finally:
+        _RENDER_DATA.clear()
+
+    filenames = [filename for filename, render_time in rendered]
+    for timing, (filename, render_time) in zip(timings, rendered):
+        timing['render_s'] = render_time
+
+    return filenames, pd.DataFrame(timings)
+
+@instrumented()
 def lum_freq_distribution_plot(model_combo_type):
     """
     Compare cumulative luminosity distributions between disk-only and 
@@ -555,6 +962,8 @@ def lum_freq_distribution_plot(model_combo_type):
         - Left: IR-only models
         - Right: Gaia-constrained models
     """
+    import matplotlib.pyplot as plt
+    from scipy import stats
 
     if model_combo_type == 1_16:
         #First, only disk models
@@ -0,0 +1,210 @@
+import io
+import os
+import sys
+import time
+import asyncio
+import argparse
+import traceback
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import pandas as pd
+from extractor_pipeline_v6 import read_extracted_file, multi_param_weight_avg
+from analysis_functions_v2 import REGION_PARAMS, save_region_figure
+from model_selection_v1 import calc_p_dm_df, model_tree, read_master_list, prioritize_gaia
+from region_export_v1 import write_ds9_regions, write_moc
+from pipeline_cli_v1 import DEFAULT_SETTINGS, load_config, write_final_models_csv
+
+#Stages of every region, in order: file reads (threads), parsing and reductions (processes), figure rendering
+#(processes) and output writes (threads)
+ASYNC_STAGES = ('read', 'reduce', 'render', 'write')
+
+#Number of regions that can be in each stage at once. With one region per stage, region k+1 is read while
+#region k is reduced and region k-1 is rendered
+DEFAULT_STAGE_LIMITS = {'read': 1, 'reduce': 1, 'render': 1, 'write': 2}
+
+def _read_text(file_name):
+    with open(file_name, 'r') as text_file:
+        return text_file.read()
+
+def _reduce_pars_task(text, model_type, cdp):
+    """
+    Parses the text of one pars file and computes the weighted means of the region figures and, when `cdp`
+    is given, the `calc_p_dm_df` table of the model selection.
+    """
+    df = read_extracted_file(io.StringIO(text))
+    df_pdm = None
+    if cdp is not None:
+        df_pdm = calc_p_dm_df(df, cdp, model_type)
+        df_pdm['Model_Flag'] = model_type
+    return df, multi_param_weight_avg(df, REGION_PARAMS), df_pdm
+
+def _select_task(pdm_IR, pdm_gaia, master_df_IR, master_df_gaia):
+    """
+    Final model selection from the `calc_p_dm_df` tables of the four model sets, as in `final_model_select`.
+    """
+    return prioritize_gaia(model_tree(*pdm_IR, master_df_IR), model_tree(*pdm_gaia, master_df_gaia), master_df_IR)
+
+def _write_outputs(final_df, region_dir, moc_format, moc_order):
+    write_final_models_csv(final_df, os.path.join(region_dir, 'final_models.csv'))
+    n_regions = write_ds9_regions(final_df, os.path.join(region_dir, 'whole_region_circles.reg'))
+    extension = '.json' if moc_format == 'json' else '.fits'
+    write_moc(final_df, os.path.join(region_dir, 'coverage_moc' + extension), order=moc_order)
+    return n_regions
+
+async def _read_stage(job, loop, threads):
+    region = job['region']
+    file_names = [os.path.join(region['pars_dir'], 'pars_{:02d}g04_{}.txt'.format(*key)) for key in job['keys']]
+    texts = await asyncio.gather(*[loop.run_in_executor(threads, _read_text, name) for name in file_names])
+    job['texts'] = dict(zip(job['keys'], texts))
+
+    if job['selection']:
+        job['master_df_IR'], job['master_df_gaia'] = await asyncio.gather(
+            loop.run_in_executor(threads, read_master_list, region['master_list_IR']),
+            loop.run_in_executor(threads, read_master_list, region['master_list_gaia']))
+    return '{} pars files, {:.1f} MB'.format(len(texts), sum(len(text) for text in texts) / 1e6)
+
+async def _reduce_stage(job, loop, processes):
+    cdp = job['region']['cdp'] if job['selection'] else None
+    texts = job.pop('texts') #Released as soon as they are parsed
+    results = await asyncio.gather(*[loop.run_in_executor(processes, _reduce_pars_task, text, key[0], cdp)
+                                     for key, text in texts.items()])
+    del texts
+    job['tables'] = {key: result[:2] for key, result in zip(job['keys'], results)}
+
+    if not job['selection']:
+        return '{} pars files'.format(len(results))
+    pdm = {key: result[2] for key, result in zip(job['keys'], results)}
+    model_types = [1, 2, 16, 17]
+    job['final_df'] = await loop.run_in_executor(processes, _select_task, [pdm[(m, 'IR')] for m in model_types],
+                                                 [pdm[(m, 'Gaia')] for m in model_types], job.pop('master_df_IR'),
+                                                 job.pop('master_df_gaia'))
+    return '{} pars files, {} sources'.format(len(results), len(job['final_df']))
+
+async def _render_stage(job, loop, processes):
+    settings = job['settings']
+    tables = job.pop('tables')
+    figures = await asyncio.gather(*[loop.run_in_executor(processes, save_region_figure, model_type,
+                                                         tables[(model_type, 'IR')][0], tables[(model_type, 'Gaia')][0],
+                                                         tables[(model_type, 'IR')][1], tables[(model_type, 'Gaia')][1],
+                                                         job['region_dir'], settings['dpi'], settings['density'],
+                                                         settings['weighted'], settings['bins'])
+                                     for model_type in settings['model_types']])
+    return '{} figures'.format(len(figures))
+
+async def _write_stage(job, loop, threads):
+    if 'final_df' not in job:
+        return None
+    settings = job['settings']
+    n_regions = await loop.run_in_executor(threads, _write_outputs, job.pop('final_df'), job['region_dir'],
+                                           settings['moc_format'], settings['moc_order'])
+    return 'final_models.csv, {} DS9 regions and a MOC'.format(n_regions)
+
+async def _run_region_async(region, settings, limits, in_flight, executors, records, start_time):
+    """
+    Runs the stages of one region, each one once a slot of its stage is free. The region holds a slot of
+    `in_flight` from its first read until its outputs are written, which caps the number of regions in memory.
+    """
+    loop = asyncio.get_running_loop()
+    region_settings = dict(settings)
+    region_settings.update({key: region[key] for key in DEFAULT_SETTINGS if key in region})
+    job = {'region': region, 'settings': region_settings,
+           'region_dir': os.path.join(region_settings['output_dir'], region['name']),
+           'keys': [(model_type, data_type) for model_type in region_settings['model_types'] for data_type in ['IR', 'Gaia']],
+           'selection': bool(region.get('master_list_IR') and region.get('master_list_gaia') and region.get('cdp') is not None
+                             and sorted(region_settings['model_types']) == [1, 2, 16, 17])}
+    os.makedirs(job['region_dir'], exist_ok=True)
+    stage_functions = {'read': (_read_stage, 'threads'), 'reduce': (_reduce_stage, 'processes'),
+                       'render': (_render_stage, 'processes'), 'write': (_write_stage, 'threads')}
+
+    async with in_flight:
+        for stage_name in ASYNC_STAGES:
+            function, executor = stage_functions[stage_name]
+            async with limits[stage_name]:
+                start = time.perf_counter()
+                try:
+                    message = await function(job, loop, executors[executor])
+                    status = 'skipped' if message is None else 'done'
+                except Exception as error:
+                    message = '{}: {}'.format(type(error).__name__, error)
+                    status = 'failed'
+                    traceback.print_exc()
+            records.append({'region': region['name'], 'stage': stage_name, 'status': status,
+                            'started': round(start - start_time, 3), 'seconds': round(time.perf_counter() - start, 3),
+                            'message': message or ''})
+            print('[{}] {}: {} {}'.format(region['name'], stage_name, status, message or ''))
+            if status == 'failed':
+                break #Later stages depend on the earlier ones
+    job.clear()
+
+async def run_pipeline_async(config, workers=None, io_threads=4, stage_limits=None, max_regions=None, regions=None):
+    """
+    Runs the region figures and the model selection of every region of a config from `load_config`, with the
+    regions pipelined through the stages of `ASYNC_STAGES`: file reads are done in a thread pool, parsing,
+    reductions and rendering in a process pool, and writes in the thread pool again, so while one region is
+    parsed the next one is already being read and the previous one rendered.
+
+    Outputs are the same as the 'region_plots', 'model_selection' and 'exports' stages of `pipeline_cli_v1.py`.
+
+    Args:
+        config (dict): Config from `load_config`.
+        workers (int or None): Number of worker processes. None uses the config setting, or every core.
+        io_threads (int): Number of threads for file reads and writes.
+        stage_limits (dict or None): Maximum number of regions in each stage at once, see `DEFAULT_STAGE_LIMITS`.
+        max_regions (int or None): Maximum number of regions between their first read and their last write,
+                                   which bounds the memory used. None allows one region per read, reduce and
+                                   render slot.
+        regions (list of str or None): Names of the regions to run. None runs every region.
+
+    Returns:
+        pd.DataFrame: One row per region and stage with 'region', 'stage', 'status', 'started' (seconds since
+                      the start of the run), 'seconds' and 'message'. Also written to `run_summary.csv` in the
+                      output directory.
+    """
+    settings = config['settings']
+    workers = workers or settings['workers'] or os.cpu_count()
+    region_list = [region for region in config['regions'] if regions is None or region['name'] in regions]
+    os.makedirs(settings['output_dir'], exist_ok=True)
+
+    stage_limits = dict(DEFAULT_STAGE_LIMITS, **(stage_limits or {}))
+    limits = {stage_name: asyncio.Semaphore(limit) for stage_name, limit in stage_limits.items()}
+    max_regions = max_regions or stage_limits['read'] + stage_limits['reduce'] + stage_limits['render']
+    in_flight = asyncio.Semaphore(max_regions)
+
+    #The worker processes are not forked from this process, which runs the I/O threads
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    records = []
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(io_threads) as threads, ProcessPoolExecutor(workers, mp_context=context) as processes:
+        executors = {'threads': threads, 'processes': processes}
+        await asyncio.gather(*[_run_region_async(region, settings, limits, in_flight, executors, records, start_time)
+                               for region in region_list])
+
+    summary = pd.DataFrame(records, columns=['region', 'stage', 'status', 'started', 'seconds', 'message'])
+    summary.to_csv(os.path.join(settings['output_dir'], 'run_summary.csv'), index=False)
+    return summary
+
+def main(argv=None):
+    """
+    Command line entry point: `python async_pipeline_v1.py config.toml [--workers N] [--max-regions N]`, with
+    the config file of `pipeline_cli_v1.py`. Returns the exit status (1 if any stage failed).
+    """
+    parser = argparse.ArgumentParser(description='Run the region figures and model selection of the regions of a '
+                                                 'config file, overlapping the file reads, parsing and rendering of '
+                                                 'different regions.')
+    parser.add_argument('config', help='TOML, YAML or JSON config file')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: config setting, or every core)')
+    parser.add_argument('--io-threads', type=int, default=4, help='number of threads for file reads and writes')
+    parser.add_argument('--max-regions', type=int, default=None, help='maximum number of regions held in memory at once')
+    parser.add_argument('--regions', default=None, help='comma separated names of the regions to run')
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    regions = args.regions.split(',') if args.regions else None
+    summary = asyncio.run(run_pipeline_async(config, workers=args.workers, io_threads=args.io_threads,
+                                             max_regions=args.max_regions, regions=regions))
+    print(summary.to_string(index=False))
+    return int((summary['status'] == 'failed').any())
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,306 @@
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+import tracemalloc
+import numpy as np
+import pandas as pd
+from extractor_pipeline_v6 import read_extracted_file, weight_mean, multi_param_weight_avg, reduce_precision, fit_table_nbytes
+from model_selection_v1 import calc_p_dm_df, model_tree
+from synthetic_pars_v1 import synthetic_star_names, write_synthetic_pars
+
+#Pipeline stages that are timed, in the order they run
+BENCHMARK_STAGES = ('read_extracted_file', 'weight_mean', 'multi_param_weight_avg', 'calc_p_dm_df', 'model_tree')
+
+#Modules timed by `cold_import_times`: the parser, used by every worker process, and the modules built on it
+IMPORT_MODULES = ('extractor_pipeline_v6', 'data_pipeline_v3', 'analysis_functions_v2', 'model_selection_v1', 'ecdf_stats_v1')
+
+#Rough factor by which memory tracing slows the stages down, used to decide if a traced run fits in the time limit
+_TRACING_SLOWDOWN = 20
+
+#Stages that need the parsed pars files
+_PARSED_STAGES = ('weight_mean', 'multi_param_weight_avg', 'calc_p_dm_df', 'model_tree')
+
+def _git_commit():
+    """
+    Commit of the scripts being benchmarked, or None outside of a git checkout.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def cold_import_times(modules=IMPORT_MODULES, repeats=5):
+    """
+    Time it takes a new Python process to import each module, which every spawned worker process pays before
+    doing any work. Each import is run `repeats` times in a fresh interpreter and the fastest run is kept, so
+    the numbers do not depend on what this process has already imported.
+
+    Returns:
+        pandas.DataFrame: One row per module with 'module' and 'seconds'.
+    """
+    code = 'import time; start = time.perf_counter(); import {}; print(time.perf_counter() - start)'
+    scripts_dir = os.path.dirname(os.path.abspath(__file__))
+    rows = []
+    for module in modules:
+        seconds = [float(subprocess.run([sys.executable, '-c', code.format(module)], cwd=scripts_dir, capture_output=True,
+                                        text=True, check=True).stdout) for i in range(repeats)]
+        rows.append({'module': module, 'seconds': min(seconds)})
+    return pd.DataFrame(rows)
+
+def _measure(function, memory_limit_seconds=None):
+    """
+    Runs `function()` and returns (result, seconds, peak MB). The time is measured without tracing. The peak
+    (the largest amount of memory allocated through Python while it ran) is measured in a second, traced run,
+    which is much slower, so it is only done if the untraced run took less than `memory_limit_seconds`.
+    Otherwise, or if `memory_limit_seconds` is None, the peak is None.
+    """
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+
+    peak_mb = None
+    if memory_limit_seconds is not None and seconds * _TRACING_SLOWDOWN < memory_limit_seconds:
+        del result
+        tracemalloc.start()
+        try:
+            result = function()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+        finally:
+            tracemalloc.stop()
+
+    return result, seconds, peak_mb
+
+def _predicted_seconds(history, n_stars):
+    """
+    Run time of a stage at `n_stars` extrapolated from its last two sizes (or linearly from one), so that
+    sizes which would take far too long can be skipped.
+    """
+    if len(history) == 0:
+        return 0.
+    n_last, seconds_last = history[-1]
+    exponent = 1.
+    if len(history) > 1:
+        n_prev, seconds_prev = history[-2]
+        if seconds_prev > 0 and seconds_last > 0:
+            exponent = max(1., np.log(seconds_last / seconds_prev) / np.log(n_last / n_prev))
+    return seconds_last * (n_stars / n_last)**exponent
+
+def run_benchmarks(sizes=(100, 1000, 10000, 100000), stages=BENCHMARK_STAGES, output_file=None, work_dir='benchmark_data',
+                   model_types=(1, 2, 16, 17), fits_per_star=20, fits_spread=0.5, dropped_fraction=0.05, cdp=2.,
+                   memory=True, max_stage_seconds=600., seed=0, imports=True):
+    """
+    Times and memory-profiles the pipeline stages on synthetic pars files of increasing size.
+
+    For every size, the IR pars files of every model set are written with `write_synthetic_pars` and each
+    stage is run once on them: `read_extracted_file` and `calc_p_dm_df` once per model set, `weight_mean`
+    (luminosity) and `multi_param_weight_avg` (temperature, luminosity and A_V) on the first model set, and
+    `model_tree` on all of them. A stage is skipped at a size when its time, extrapolated from the smaller
+    sizes, would exceed `max_stage_seconds`. Stages that need the parsed files are also skipped when
+    `read_extracted_file` was.
+
+    Args:
+        sizes (tuple of int): Numbers of stars, e.g. 10^2 to 10^5.
+        stages (tuple of str): Stages to run, from `BENCHMARK_STAGES`.
+        output_file (str or None): JSON file the results are written to. None uses
+                                   'benchmark_<date>_<time>.json' in the current directory.
+        work_dir (str): Directory for the synthetic pars files, one subdirectory per size. Files already
+                        written with the same settings are reused.
+        model_types (tuple of int): Model sets to generate and process.
+        fits_per_star, fits_spread, dropped_fraction: Shape of the synthetic files, see `write_synthetic_pars`.
+        cdp (float): Critical delta chi-squared used for `calc_p_dm_df`.
+        memory (bool): Whether to also record the peak memory of every stage with `tracemalloc`. It is
+                       measured in a second, traced run, skipped when it would exceed `max_stage_seconds`.
+        max_stage_seconds (float): Time limit per stage and size.
+        seed (int): Seed of the synthetic files.
+        imports (bool): Whether to also time the cold import of `IMPORT_MODULES` with `cold_import_times`,
+                        recorded as stages 'import <module>' with n_stars 0.
+
+    Returns:
+        dict: The saved results, with 'metadata' (versions, git commit, machine and settings) and 'results'
+              (one record per stage, size and model set with 'stage', 'n_stars', 'model_type', 'seconds',
+              'peak_mb' and 'skipped').
+    """
+    settings = {'sizes': list(sizes), 'stages': list(stages), 'model_types': list(model_types),
+                'fits_per_star': fits_per_star, 'fits_spread': fits_spread, 'dropped_fraction': dropped_fraction,
+                'cdp': cdp, 'memory': memory, 'max_stage_seconds': max_stage_seconds, 'seed': seed, 'imports': imports}
+    metadata = {'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'git_commit': _git_commit(),
+                'python': sys.version.split()[0], 'numpy': np.__version__, 'pandas': pd.__version__,
+                'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'settings': settings}
+
+    results = []
+    history = {stage: [] for stage in stages}
+
+    def record(stage, n_stars, model_type, seconds=None, peak_mb=None, skipped=False):
+        results.append({'stage': stage, 'n_stars': n_stars, 'model_type': model_type, 'seconds': seconds,
+                        'peak_mb': peak_mb, 'skipped': skipped})
+
+    for n_stars in sorted(sizes):
+        size_dir = os.path.join(work_dir, 'n{}'.format(n_stars))
+        os.makedirs(size_dir, exist_ok=True)
+        names = synthetic_star_names(n_stars, seed)
+        master_df = pd.DataFrame({'Spitzer': names})
+
+        #Synthetic files are only written again when the settings change
+        file_names = {}
+        settings_file = os.path.join(size_dir, 'settings.json')
+        file_settings = {key: settings[key] for key in ('fits_per_star', 'fits_spread', 'dropped_fraction', 'seed')}
+        reuse = False
+        if os.path.exists(settings_file):
+            with open(settings_file) as json_file:
+                reuse = json.load(json_file) == file_settings
+        for model_type in model_types:
+            file_names[model_type] = os.path.join(size_dir, 'pars_{:02d}g04_IR.txt'.format(model_type))
+            if not (reuse and os.path.exists(file_names[model_type])):
+                write_synthetic_pars(file_names[model_type], model_type, names, fits_per_star=fits_per_star,
+                                     fits_spread=fits_spread, dropped_fraction=dropped_fraction, seed=seed + model_type)
+        with open(settings_file, 'w') as json_file:
+            json.dump(file_settings, json_file)
+
+        print('Benchmarking {} stars:'.format(n_stars))
+        parsed = {}
+        p_dm = {}
+        for stage in stages:
+            skip = _predicted_seconds(history[stage], n_stars) > max_stage_seconds
+            if stage in _PARSED_STAGES and len(parsed) < len(model_types):
+                skip = True
+
+            if stage in ('read_extracted_file', 'calc_p_dm_df'):
+                runs = [(model_type, model_type) for model_type in model_types]
+            elif stage == 'model_tree':
+                runs = [(None, tuple(model_types))]
+            else:
+                runs = [(model_types[0], model_types[0])]
+
+            if stage == 'model_tree' and (len(model_types) != 4 or len(p_dm) < 4):
+                skip = True
+
+            total = 0.
+            for model_type, arg in runs:
+                if skip:
+                    record(stage, n_stars, model_type, skipped=True)
+                    continue
+
+                if stage == 'read_extracted_file':
+                    function = lambda: read_extracted_file(file_names[arg])
+                elif stage == 'weight_mean':
+                    function = lambda: weight_mean(parsed[arg], 'lum_arr')
+                elif stage == 'multi_param_weight_avg':
+                    function = lambda: multi_param_weight_avg(parsed[arg], ['star_temp_arr', 'lum_arr', 'av_arr'])
+                elif stage == 'calc_p_dm_df':
+                    function = lambda: calc_p_dm_df(parsed[arg], cdp, arg)
+                elif stage == 'model_tree':
+                    function = lambda: model_tree(*[p_dm[model_type] for model_type in arg], master_df)
+
+                result, seconds, peak_mb = _measure(function, max_stage_seconds if memory else None)
+                if stage == 'read_extracted_file':
+                    parsed[arg] = result
+                elif stage == 'calc_p_dm_df':
+                    p_dm[arg] = result
+                record(stage, n_stars, model_type, seconds, peak_mb)
+                total += seconds
+
+            if not skip:
+                history[stage].append((n_stars, total))
+                print('    {}: {:.3f} s'.format(stage, total))
+            else:
+                print('    {}: skipped'.format(stage))
+
+    if imports:
+        print('Cold imports:')
+        for row in cold_import_times().itertuples():
+            record('import ' + row.module, 0, None, row.seconds)
+            print('    {}: {:.3f} s'.format(row.module, row.seconds))
+
+    benchmark = {'metadata': metadata, 'results': results}
+    if output_file is None:
+        output_file = 'benchmark_{}.json'.format(time.strftime('%Y%m%d_%H%M%S'))
+    with open(str(output_file), 'w') as json_file:
+        json.dump(benchmark, json_file, indent=1)
+
+    return benchmark
+
+def load_benchmark(file_name):
+    """
+    Reads the results of `run_benchmarks` as a DataFrame, one row per stage, size and model set, with the
+    git commit and date of the run added as columns.
+    """
+    with open(str(file_name)) as json_file:
+        benchmark = json.load(json_file)
+
+    df = pd.DataFrame(benchmark['results'])
+    df['git_commit'] = benchmark['metadata']['git_commit']
+    df['date'] = benchmark['metadata']['date']
+    return df
+
+def compare_benchmarks(old_file_name, new_file_name):
+    """
+    Compares two benchmark runs (e.g. before and after a change) stage by stage and size by size.
+
+    Returns:
+        pd.DataFrame: One row per stage and size run in both, with the total 'seconds_old', 'seconds_new',
+                      'peak_mb_old' and 'peak_mb_new' over the model sets, and 'speedup' (old / new time).
+                      Values above 1 are improvements, below 1 regressions.
+    """
+    totals = []
+    for file_name in [old_file_name, new_file_name]:
+        df = load_benchmark(file_name)
+        df = df[~df['skipped']]
+        totals.append(df.groupby(['stage', 'n_stars'])[['seconds', 'peak_mb']].sum(min_count=1))
+
+    comparison = totals[0].join(totals[1], how='inner', lsuffix='_old', rsuffix='_new').reset_index()
+    comparison['speedup'] = comparison['seconds_old'] / comparison['seconds_new']
+    return comparison
+
+def precision_report(pars_file_name, dtype=np.float32, int_codes=True, param_list=None, cdp=None):
+    """
+    Quantifies the effect of the reduced precision mode of `read_extracted_file` on one pars file: the
+    memory of the parsed table and the differences between the means of `multi_param_weight_avg` computed
+    from the float64 table and from the reduced one.
+
+    Args:
+        pars_file_name (str): Pars file, e.g. 'pars_17g04_IR.txt'.
+        dtype (numpy dtype): Float type of the reduced table.
+        int_codes (bool): Whether the reduced table also has integer coded inclinations and scattering flags.
+        param_list (list of str or None): Parameters to compare. None compares every per-fit column but 'chi_2_arr'.
+        cdp (float or None): If given, also counts the stars whose number of good fits from `calc_p_dm_df`
+                             changes with the reduced table.
+
+    Returns:
+        dict:
+            'means' (pandas.DataFrame): One row per mean ('<param>_avg' and '<param>_w_avg') with the
+                                        'max_abs_diff', 'max_rel_diff' and 'median_rel_diff' over the stars.
+            'float64_mb', 'reduced_mb' (float): Memory of the two tables (see `fit_table_nbytes`).
+            'memory_ratio' (float): reduced_mb / float64_mb.
+            'n_stars' (int): Number of stars.
+            'n_good_changed' (int): Stars whose `calc_p_dm_df` selection changed (only with `cdp`).
+    """
+    full_df = read_extracted_file(pars_file_name)
+    reduced_df = reduce_precision(full_df, dtype, int_codes)
+    if param_list is None:
+        param_list = [col for col in full_df.columns if col != 'chi_2_arr' and full_df[col].dtype == object
+                      and isinstance(full_df[col].iloc[0], np.ndarray)]
+
+    full_means = multi_param_weight_avg(full_df, param_list)
+    reduced_means = multi_param_weight_avg(reduced_df, param_list)
+    rows = []
+    for col_name in param_list:
+        for suffix in ['avg', 'w_avg']:
+            mean_name = col_name.replace('arr', suffix)
+            full = full_means[mean_name].to_numpy(dtype=float)
+            abs_diff = np.abs(reduced_means[mean_name].to_numpy(dtype=float) - full)
+            rel_diff = abs_diff / np.where(full != 0, np.abs(full), 1.)
+            rows.append({'mean': mean_name, 'max_abs_diff': abs_diff.max(initial=0.), 'max_rel_diff': rel_diff.max(initial=0.),
+                         'median_rel_diff': np.median(rel_diff) if len(rel_diff) > 0 else 0.})
+
+    report = {'means': pd.DataFrame(rows), 'float64_mb': fit_table_nbytes(full_df) / 1e6,
+              'reduced_mb': fit_table_nbytes(reduced_df) / 1e6, 'n_stars': len(full_df)}
+    report['memory_ratio'] = report['reduced_mb'] / report['float64_mb']
+    if cdp is not None:
+        model_type = int(os.path.basename(pars_file_name)[5:7])
+        n_good = [calc_p_dm_df(df, cdp, model_type)['n_good'].to_numpy() for df in [full_df, reduced_df]]
+        report['n_good_changed'] = int(np.sum(n_good[0] != n_good[1]))
+    return report
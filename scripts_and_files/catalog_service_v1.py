@@ -0,0 +1,131 @@
+import os
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from crossmatch_pipeline_v1 import read_catalog_table, lb_to_unit_vectors, arcsec_to_chord
+
+#Table headers kept from the SPICY catalog in recipe 1. Query results are returned with these columns, in this
+#order, so they can be written straight to the csv file `read_file_and_flux_calc_IR` reads
+SPICY_CSV_COLUMNS = ['l', 'b', 'Spitzer', 'mag3_6', 'e_mag3_6', 'mag4_5', 'e_mag4_5', 'mag5_8', 'e_mag5_8',
+                     'mag8_0', 'e_mag8_0', 'j_synth', 'h_synth', 'k_synth']
+
+#File names used inside the index directory
+CATALOG_FILE = 'spicy_catalog.npz'
+
+def build_catalog_index(catalog_file_name, index_dir, columns=SPICY_CSV_COLUMNS):
+    """
+    Builds and saves a spatial index over a local copy of the SPICY catalog so that region cutouts can be
+    made without TOPCAT or an online query.
+
+    The catalog rows are sorted by galactic longitude and saved as one array per column. A KD-tree of the
+    (l, b) unit vectors is built from them whenever the index is loaded, for `cone_search`.
+
+    Args:
+        catalog_file_name (str): Path to the local SPICY catalog (FITS, Parquet or CSV).
+        index_dir (str): Directory where the index files are written. Created if it does not exist.
+        columns (list of str): Catalog columns to keep. Defaults to the recipe 1 table headers. Extra
+                               columns (e.g. 'GAIADR2') can be added for the Gaia match.
+
+    Returns:
+        index (dict): The loaded index, same as returned by `load_catalog_index`.
+    """
+    df = read_catalog_table(catalog_file_name, columns=list(columns))
+    missing = [col for col in columns if col not in df.columns]
+    if missing:
+        raise KeyError('Columns missing from the catalog: {}'.format(missing))
+
+    #Sorting by l lets box searches grab a contiguous slice of rows
+    df = df[list(columns)].sort_values('l', kind='stable').reset_index(drop=True)
+
+    os.makedirs(index_dir, exist_ok=True)
+
+    arrays = {}
+    for col in columns:
+        values = df[col].to_numpy()
+        if values.dtype == object:
+            values = values.astype(str) #Fixed width strings so the file loads without pickle
+        arrays[col] = values
+    np.savez(os.path.join(index_dir, CATALOG_FILE), **arrays)
+
+    return {'columns': list(columns), 'data': arrays, 'tree': cKDTree(lb_to_unit_vectors(arrays['l'], arrays['b']))}
+
+def load_catalog_index(index_dir):
+    """
+    Loads an index written by `build_catalog_index`.
+
+    Args:
+        index_dir (str): Directory containing the index files.
+
+    Returns:
+        index (dict): Dictionary with the keys
+            - 'columns' (list of str): Column names in output order.
+            - 'data' (dict of np.ndarray): One array per column, sorted by l.
+            - 'tree' (scipy.spatial.cKDTree): KD-tree of the unit vectors of every row.
+    """
+    with np.load(os.path.join(index_dir, CATALOG_FILE)) as npz_file:
+        arrays = {col: npz_file[col] for col in npz_file.files}
+
+    #The tree is rebuilt rather than saved: it only takes a moment, and a pickled tree depends on the scipy version
+    tree = cKDTree(lb_to_unit_vectors(arrays['l'], arrays['b']))
+
+    return {'columns': list(arrays), 'data': arrays, 'tree': tree}
+
+def _rows_to_csv_df(index, rows, csv_name):
+    """
+    Builds the output DataFrame for a set of row numbers and optionally writes it as a csv file.
+    """
+    rows = np.sort(rows)
+    df = pd.DataFrame({col: index['data'][col][rows] for col in index['columns']})
+
+    if csv_name is not None:
+        df.to_csv(str(csv_name), index=False)
+
+    return df
+
+def box_search(index, l_min, l_max, b_min, b_max, csv_name=None):
+    """
+    Returns the catalog rows inside a galactic box, the same cut as the TOPCAT subset in recipe 1:
+    `l<l_max && l>l_min && b<b_max && b>b_min`. If `l_min` is larger than `l_max` the box is taken to
+    wrap through l = 0.
+
+    Args:
+        index (dict): Index from `build_catalog_index` or `load_catalog_index`.
+        l_min, l_max (float): Galactic longitude limits in degrees.
+        b_min, b_max (float): Galactic latitude limits in degrees.
+        csv_name (str or None): If given, the rows are also written to this csv file.
+
+    Returns:
+        df (pd.DataFrame): Rows inside the box, sorted by l, with the index columns.
+    """
+    l_sorted = index['data']['l']
+
+    if l_min <= l_max:
+        rows = np.arange(np.searchsorted(l_sorted, l_min, side='right'),
+                         np.searchsorted(l_sorted, l_max, side='left'))
+    else:
+        #Box wraps around l = 360/0, so take both ends of the sorted array
+        rows = np.concatenate((np.arange(np.searchsorted(l_sorted, l_min, side='right'), len(l_sorted)),
+                               np.arange(0, np.searchsorted(l_sorted, l_max, side='left'))))
+
+    b_values = index['data']['b'][rows]
+    rows = rows[(b_values > b_min) & (b_values < b_max)]
+
+    return _rows_to_csv_df(index, rows, csv_name)
+
+def cone_search(index, l, b, radius_deg, csv_name=None):
+    """
+    Returns the catalog rows within `radius_deg` of the position (l, b).
+
+    Args:
+        index (dict): Index from `build_catalog_index` or `load_catalog_index`.
+        l, b (float): Galactic coordinates of the cone center in degrees.
+        radius_deg (float): Cone radius in degrees.
+        csv_name (str or None): If given, the rows are also written to this csv file.
+
+    Returns:
+        df (pd.DataFrame): Rows inside the cone, sorted by l, with the index columns.
+    """
+    center = lb_to_unit_vectors([l], [b])[0]
+    rows = np.array(index['tree'].query_ball_point(center, arcsec_to_chord(radius_deg * 3600.)), dtype=int)
+
+    return _rows_to_csv_df(index, rows, csv_name)
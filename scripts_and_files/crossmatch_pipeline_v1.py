@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+#Columns saved from the Gaia archive extract. These are the same columns recipe 1 keeps from the TOPCAT match,
+#and the ones `flag_txt_file_Gaia` reads from `spicy_gaia_match_csv_name`
+GAIA_MATCH_COLUMNS = ['phot_bp_mean_flux_over_error', 'phot_bp_mean_mag',
+                      'phot_rp_mean_flux_over_error', 'phot_rp_mean_mag']
+
+def read_catalog_table(file_name, columns=None):
+    """
+    Reads a local catalog extract into a pandas DataFrame, keeping only the requested columns.
+    CSV, FITS and Parquet files are supported, based on the file extension.
+
+    Args:
+        file_name (str): Path to the catalog file (.csv, .fits/.fit/.fits.gz or .parquet).
+        columns (list of str or None): Columns to keep. None keeps every column in the file.
+
+    Returns:
+        pd.DataFrame: Catalog rows with the requested columns.
+    """
+    lower_name = str(file_name).lower()
+
+    if lower_name.endswith(('.fits', '.fit', '.fits.gz', '.fts')):
+        #Astropy is only needed for FITS extracts, so it is imported here
+        from astropy.table import Table
+        table = Table.read(file_name, hdu=1, memmap=True)
+        if columns is not None:
+            table = table[[col for col in columns if col in table.colnames]]
+        df = table.to_pandas()
+    elif lower_name.endswith(('.parquet', '.pq')):
+        if columns is not None:
+            #Only request the columns the file has, as for the other formats
+            import pyarrow.parquet
+            wanted = set(columns)
+            columns = [col for col in pyarrow.parquet.read_schema(file_name).names if col.strip() in wanted]
+        df = pd.read_parquet(file_name, columns=columns)
+    else:
+        if columns is None:
+            df = pd.read_csv(file_name)
+        else:
+            #Only parse the columns we need, which matters for extracts with millions of rows
+            wanted = set(columns)
+            df = pd.read_csv(file_name, usecols=lambda col: col.strip() in wanted)
+
+    df.columns = df.columns.str.strip() #Gets rid of unnecessary spaces in header names
+    return df
+
+def lb_to_unit_vectors(l, b):
+    """
+    Converts galactic longitudes and latitudes (in degrees) into Cartesian unit vectors,
+    so that angular separations on the sky become chord lengths in a KD-tree.
+
+    Args:
+        l (array-like): Galactic longitudes in degrees.
+        b (array-like): Galactic latitudes in degrees.
+
+    Returns:
+        np.ndarray: Array of shape (N, 3) with the unit vectors.
+    """
+    l_rad = np.radians(np.asarray(l, dtype=float))
+    b_rad = np.radians(np.asarray(b, dtype=float))
+    cos_b = np.cos(b_rad)
+
+    return np.column_stack((cos_b * np.cos(l_rad), cos_b * np.sin(l_rad), np.sin(b_rad)))
+
+def arcsec_to_chord(radius_arcsec):
+    """
+    Converts an angular radius in arcseconds to the chord length between two unit vectors.
+    """
+    return 2 * np.sin(np.radians(radius_arcsec / 3600.) / 2)
+
+def chord_to_arcsec(chord):
+    """
+    Converts chord lengths between unit vectors back to angular separations in arcseconds.
+    """
+    return np.degrees(2 * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))) * 3600.
+
+def _galactic_coordinates(df):
+    """
+    Returns the galactic l and b columns of a catalog, converting from ra/dec if the extract has no l/b.
+    """
+    if 'l' in df.columns and 'b' in df.columns:
+        return df['l'].to_numpy(dtype=float), df['b'].to_numpy(dtype=float)
+
+    #Gaia extracts normally carry l and b, but fall back to ra/dec for trimmed downloads
+    from astropy.coordinates import SkyCoord
+    import astropy.units as u
+    coords = SkyCoord(ra=df['ra'].to_numpy(dtype=float) * u.deg, dec=df['dec'].to_numpy(dtype=float) * u.deg,
+                      frame='icrs').galactic
+    return coords.l.deg, coords.b.deg
+
+def crossmatch_spicy_gaia(spicy_csv_name, gaia_file_name, match_csv_name=None, radius_arcsec=1.0, unique=True):
+    """
+    Matches SPICY sources to a local Gaia extract on sky position and writes the matched Gaia photometry in the
+    format `flag_txt_file_Gaia` expects for `spicy_gaia_match_csv_name`. This replaces the TOPCAT/online
+    match in recipe 1.
+
+    The Gaia positions are placed in a KD-tree of unit vectors (`scipy.spatial.cKDTree`), and every SPICY
+    source is matched to its nearest Gaia source within `radius_arcsec`. If `unique` is True, a Gaia source
+    claimed by more than one SPICY source is only kept for the closest one.
+
+    Args:
+        spicy_csv_name (str): Path to the SPICY cutout CSV from recipe 1. Must include 'Spitzer', 'l' and 'b'.
+        gaia_file_name (str): Path to the local Gaia extract (CSV, FITS or Parquet). Must include the
+                              four columns in `GAIA_MATCH_COLUMNS` and either 'l'/'b' or 'ra'/'dec'.
+        match_csv_name (str or None): Path of the matched CSV to write. If None, nothing is written.
+        radius_arcsec (float): Matching radius in arcseconds. Recipe 1 uses 1 arcsecond or less.
+        unique (bool): If True, each Gaia source is matched to at most one SPICY source.
+
+    Returns:
+        matched_df (pd.DataFrame): One row per matched SPICY source with the 'Spitzer' column, the Gaia columns
+                                   in `GAIA_MATCH_COLUMNS`, the Gaia 'source_id' (if available) and
+                                   'match_sep_arcsec', the separation of the match in arcseconds.
+    """
+    df_spicy = read_catalog_table(spicy_csv_name, columns=['Spitzer', 'l', 'b'])
+    df_gaia = read_catalog_table(gaia_file_name, columns=['source_id', 'l', 'b', 'ra', 'dec'] + GAIA_MATCH_COLUMNS)
+
+    gaia_l, gaia_b = _galactic_coordinates(df_gaia)
+
+    #Tree is built on the (larger) Gaia extract and queried once with all the SPICY positions
+    gaia_tree = cKDTree(lb_to_unit_vectors(gaia_l, gaia_b))
+    dist, gaia_index = gaia_tree.query(lb_to_unit_vectors(df_spicy['l'], df_spicy['b']), k=1,
+                                       distance_upper_bound=arcsec_to_chord(radius_arcsec))
+
+    #Unmatched sources come back with an infinite distance and an index equal to the tree size
+    matched = np.isfinite(dist)
+    spicy_index = np.flatnonzero(matched)
+    gaia_index = gaia_index[matched]
+    sep_arcsec = chord_to_arcsec(dist[matched])
+
+    if unique and len(spicy_index) > 0:
+        #Best-match rule: sort by separation and keep the first (closest) claim on every Gaia source
+        order = np.argsort(sep_arcsec, kind='stable')
+        _, first = np.unique(gaia_index[order], return_index=True)
+        keep = np.sort(order[first])
+        spicy_index, gaia_index, sep_arcsec = spicy_index[keep], gaia_index[keep], sep_arcsec[keep]
+
+    gaia_columns = [col for col in ['source_id'] + GAIA_MATCH_COLUMNS if col in df_gaia.columns]
+
+    matched_df = df_gaia[gaia_columns].iloc[gaia_index].reset_index(drop=True)
+    matched_df.insert(0, 'Spitzer', df_spicy['Spitzer'].iloc[spicy_index].to_numpy())
+    matched_df['match_sep_arcsec'] = sep_arcsec
+
+    if match_csv_name is not None:
+        matched_df[['Spitzer'] + GAIA_MATCH_COLUMNS].to_csv(str(match_csv_name), index=False)
+
+    return matched_df
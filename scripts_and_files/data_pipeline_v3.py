@@ -1,7 +1,7 @@
+import os
 import numpy as np
-import matplotlib.pyplot as plt
-import csv
 import pandas as pd
+from instrumentation_v1 import instrumented, table_counts
 
 def read_file_and_flux_calc_IR(file_name):
     """
@@ -77,7 +77,8 @@ def read_file_and_flux_calc_IR(file_name):
 
     return df1, df2, df, columns1, columns2
 
-def flag_txt_file_IR(file_name, data_file_name):
+@instrumented(counts=lambda df: dict(table_counts(df), files=1))
+def flag_txt_file_IR(file_name, data_file_name, incremental=False):
     """
     Reads a CSV file of infrared magnitudes, computes fluxes and flags indicating data availability, 
     and writes a structured text file containing positional data, flags, fluxes, and their uncertainties.
@@ -89,6 +90,9 @@ def flag_txt_file_IR(file_name, data_file_name):
         data_file_name (str): Desired name (without extension) of the output .txt file to be written.
                               The file will contain tabular data for use in Robitaille et al. (2017) 
                               SED fitting routine
+        incremental (bool): If True, only sources whose input row changed since the last run are written to
+                            the delta data file `<data_file_name>_delta`. The full data file is still written
+                            (see `_write_data_file`).
 
     Returns:
         df (pd.DataFrame): DataFrame containing the fluxes, flux errors, and corresponding availability flags
@@ -107,32 +111,22 @@ def flag_txt_file_IR(file_name, data_file_name):
     for j in range(len(Flag)):
         df[Flag[j]] = np.isfinite(df1[columns1[j]]).astype(int)
         
-    # Initialize the string to write to a text file. This format allows for great control over output
-    #Flags are set this way since I wanted it to output a file in the following order:
+    #Lines are written in the following order:
     #2MASS JHK bands, Spitzer/IRAC (I1, I2, I3, I4) bands
-    #Little note: notice for b, we have >8,.5f for the formatting. This is to accound for negative longitudes
-    txt_string = ''
-    
-    for i in range(0,len(df)):
-        txt_string = txt_string + str(df.Spitzer[i]) \
-        + '  ' + str(f"{df.l[i]:.5f}") + '  ' + str(f"{df.b[i]:>8,.5f}") \
-        + '  ' + str(df.Flag5[i]) + '  ' + str(df.Flag6[i]) + '  ' + str(df.Flag7[i]) \
-        + '  ' + str(df.Flag1[i]) + '  ' + str(df.Flag2[i]) + '  ' + str(df.Flag3[i]) + '  ' + str(df.Flag4[i]) \
-        + '  ' + str(f"{df.FluxJ[i]:.4e}") + '  ' + str(f"{df.FluxJerr[i]:.4e}") \
-        + '  ' + str(f"{df.FluxH[i]:.4e}") + '  ' + str(f"{df.FluxHerr[i]:.4e}") \
-        + '  ' + str(f"{df.FluxK[i]:.4e}") + '  ' + str(f"{df.FluxKerr[i]:.4e}") \
-        + '  ' + str(f"{df.Flux36[i]:.4e}") + '  ' + str(f"{df.Flux36err[i]:.4e}") \
-        + '  ' + str(f"{df.Flux45[i]:.4e}") + '  ' + str(f"{df.Flux45err[i]:.4e}") \
-        + '  ' + str(f"{df.Flux58[i]:.4e}") + '  ' + str(f"{df.Flux58err[i]:.4e}") \
-        + '  ' + str(f"{df.Flux80[i]:.4e}") + '  ' + str(f"{df.Flux80err[i]:.4e}") + '\n'
-    
-    data_file = open(str(data_file_name), 'w') #write your file name in the open function
-    n = data_file.write(txt_string)
-    data_file.close()
+    #Little note: `format_data_lines` uses >8,.5f for b. This is to accound for negative longitudes
+    flag_cols = ['Flag5', 'Flag6', 'Flag7', 'Flag1', 'Flag2', 'Flag3', 'Flag4']
+    flux_cols = ['FluxJ', 'FluxH', 'FluxK', 'Flux36', 'Flux45', 'Flux58', 'Flux80']
+
+    lines = format_data_lines(df['Spitzer'].to_numpy(), df['l'].to_numpy(), df['b'].to_numpy(),
+                              df[flag_cols].to_numpy(), df[flux_cols].to_numpy(),
+                              df[[col + 'err' for col in flux_cols]].to_numpy())
+
+    _write_data_file(data_file_name, df['Spitzer'].to_numpy(), lines, df, incremental)
 
     return df
 
-def flag_txt_file_Gaia(ugos_24um_file_name, spicy_gaia_match_csv_name, data_file_name):
+@instrumented(counts=lambda df: dict(table_counts(df), files=1))
+def flag_txt_file_Gaia(ugos_24um_file_name, spicy_gaia_match_csv_name, data_file_name, incremental=False):
     """
     Merges Spitzer-Gaia matched sources with supplemental 24μm data, computes Gaia fluxes and 
     uncertainties, sets flags indicating valid measurements, and writes a structured .txt file 
@@ -147,6 +141,9 @@ def flag_txt_file_Gaia(ugos_24um_file_name, spicy_gaia_match_csv_name, data_file
                                          - 'phot_bp_mean_mag', 'phot_rp_mean_mag'
                                          - 'phot_bp_mean_flux_over_error', 'phot_rp_mean_flux_over_error'
         data_file_name (str): Name of the output text file (no `.txt` extension needed) to be written.
+        incremental (bool): If True, only sources whose input row changed since the last run are written to
+                            the delta data file `<data_file_name>_delta`. The full data file is still written
+                            (see `_write_data_file`).
 
     Returns:
         merged_df (pd.DataFrame): DataFrame containing the merged dataset with Gaia fluxes, 
@@ -199,10 +196,10 @@ def flag_txt_file_Gaia(ugos_24um_file_name, spicy_gaia_match_csv_name, data_file
     merged_df = merged_df.drop(filtered_df.index)
     merged_df = merged_df.reset_index(drop=True)
 
-    txt_string = ''
+    lines = []
 
     for i in range(0,len(merged_df)):
-        txt_string = txt_string + str(merged_df.Spitzer[i]) \
+        lines.append(str(merged_df.Spitzer[i]) \
         + '  ' + str(f"{merged_df[1][i]:.5f}") + '  ' + str(f"{merged_df[2][i]:.5f}") \
         + '  ' + str(merged_df.Flag8[i]) + '  ' + str(merged_df.Flag9[i]) + '  ' + str(merged_df[3][i]) \
         + '  ' + str(merged_df[4][i]) + '  ' + str(merged_df[5][i]) + '  ' + str(merged_df[6][i]) \
@@ -216,10 +213,316 @@ def flag_txt_file_Gaia(ugos_24um_file_name, spicy_gaia_match_csv_name, data_file
         + '  ' + str(f"{merged_df[19][i]:.4e}") + '  ' + str(f"{merged_df[20][i]:.4e}") \
         + '  ' + str(f"{merged_df[21][i]:.4e}") + '  ' + str(f"{merged_df[22][i]:.4e}") \
         + '  ' + str(f"{merged_df[23][i]:.4e}") + '  ' + str(f"{merged_df[24][i]:.4e}") \
-        + '  ' + str(f"{merged_df[25][i]:.4e}") + '  ' + str(f"{merged_df[26][i]:.4e}") + '\n'
-    
-    data_file = open(str(data_file_name), 'w') #write your file name in the open function
-    n = data_file.write(txt_string)
-    data_file.close()
+        + '  ' + str(f"{merged_df[25][i]:.4e}") + '  ' + str(f"{merged_df[26][i]:.4e}") + '\n')
+
+    _write_data_file(data_file_name, merged_df['Spitzer'].to_numpy(), lines, merged_df, incremental)
+
+    return merged_df
+
+def _data_file_sources(data_file_name):
+    """
+    Reads a data file and returns the source names, the raw lines, and the number of valid data points
+    (non-zero flags) per source. The number of bands is inferred from the number of columns.
+    """
+    with open(str(data_file_name), 'r') as data_file:
+        lines = [line for line in data_file.readlines() if line.strip() != '']
+
+    names = []
+    n_valid = []
+    for line in lines:
+        tokens = line.split()
+        n_bands = (len(tokens) - 3) // 3 #name, l, b, then one flag and one flux/error pair per band
+        names.append(tokens[0])
+        n_valid.append(sum(1 for flag in tokens[3:3 + n_bands] if int(flag) != 0))
+
+    return names, lines, np.array(n_valid)
+
+@instrumented(counts=lambda shard_names: {'files': len(shard_names)})
+def split_data_file(data_file_name, n_shards, balance='count', shard_dir=None):
+    """
+    Splits a data file into `n_shards` smaller data files so that each one can be passed to its own
+    `fit_multiyso` call (one per core or node). The shards keep the exact lines of the original file.
+
+    Args:
+        data_file_name (str): Path to the data file written by `flag_txt_file_IR` or `flag_txt_file_Gaia`.
+        n_shards (int): Number of shard files to write. Empty shards are not written.
+        balance (str): How to balance the shards:
+                       - 'count': contiguous blocks with the same number of sources (±1).
+                       - 'cost': sources are spread over the shards so that the total number of valid
+                         data points (a proxy for the fitting time) is as even as possible.
+        shard_dir (str or None): Directory for the shard files. Defaults to the directory of the data file.
+
+    Returns:
+        shard_names (list of str): Paths of the written shard files, named `<data_file_name>_shardNN`.
+    """
+    names, lines, n_valid = _data_file_sources(data_file_name)
+
+    if balance == 'count':
+        shard_rows = np.array_split(np.arange(len(lines)), n_shards)
+    elif balance == 'cost':
+        #Longest processing time first: the most expensive source goes to the currently cheapest shard
+        shard_rows = [[] for i in range(n_shards)]
+        shard_cost = np.zeros(n_shards)
+        for row in np.argsort(-n_valid, kind='stable'):
+            target = np.argmin(shard_cost)
+            shard_rows[target].append(row)
+            shard_cost[target] += n_valid[row]
+        #Keep the original order of the data file inside every shard
+        shard_rows = [np.sort(np.array(rows, dtype=int)) for rows in shard_rows]
+    else:
+        raise ValueError("balance must be 'count' or 'cost'")
+
+    if shard_dir is None:
+        shard_dir = os.path.dirname(str(data_file_name))
+    else:
+        os.makedirs(shard_dir, exist_ok=True)
+    base_name = os.path.basename(str(data_file_name))
+
+    shard_names = []
+    for i_shard in range(len(shard_rows)):
+        if len(shard_rows[i_shard]) == 0:
+            continue
+        shard_name = os.path.join(shard_dir, base_name + '_shard{:02d}'.format(i_shard))
+        shard_file = open(shard_name, 'w')
+        shard_file.write(''.join(lines[row] for row in shard_rows[i_shard]))
+        shard_file.close()
+        shard_names.append(shard_name)
+
+    return shard_names
+
+def read_pars_blocks(pars_file_name):
+    """
+    Reads a pars file and returns its three header lines and a dictionary of the lines for every star
+    (the star line followed by its fit lines), keyed by star name, in file order.
+    """
+    pars_file = open(str(pars_file_name), 'r')
+    all_lines = pars_file.readlines()
+    pars_file.close()
+
+    header = all_lines[:3]
+    blocks = {}
+    current = None
+    for line in all_lines[3:]:
+        #Same rule as read_extracted_file: lines starting with 13 spaces hold the star name
+        if line.startswith('             '):
+            current = line[13:30].strip()
+            blocks[current] = [line]
+        elif current is not None:
+            blocks[current].append(line)
+
+    return header, blocks
+
+@instrumented(counts=lambda n_stars: {'stars': n_stars, 'files': 1})
+def merge_pars_files(pars_file_names, merged_pars_name, data_file_name=None):
+    """
+    Merges several pars files of the same model set (e.g. the `pars_XXg04_*.txt` outputs of the shards from
+    `split_data_file`) back into one pars file, with the three header lines and star blocks intact so
+    `read_extracted_file` reads it exactly like a single run.
+
+    If a star appears in more than one file, the block from the later file replaces the earlier one. This is
+    how partial refits are merged back into an existing pars file.
+
+    Args:
+        pars_file_names (list of str): Paths of the pars files to merge, in order.
+        merged_pars_name (str): Path of the merged pars file to write.
+        data_file_name (str or None): Original (unsplit) data file. If given, the stars are written in the
+                                      order of the data file; otherwise in the order they are first found.
+
+    Returns:
+        n_stars (int): Number of stars written to the merged file.
+    """
+    header = None
+    blocks = {}
+    for pars_file_name in pars_file_names:
+        file_header, file_blocks = read_pars_blocks(pars_file_name)
+        if header is None:
+            header = file_header
+        elif file_header[1] != header[1]:
+            raise ValueError('{} is not from the same model set as {}'.format(pars_file_name, pars_file_names[0]))
+        blocks.update(file_blocks)
+
+    if data_file_name is not None:
+        names, lines, n_valid = _data_file_sources(data_file_name)
+        order = [name for name in names if name in blocks]
+        #Stars missing from the data file (should not happen) are kept at the end
+        in_data_file = set(order)
+        order += [name for name in blocks if name not in in_data_file]
+    else:
+        order = list(blocks)
+
+    merged_file = open(str(merged_pars_name), 'w')
+    merged_file.write(''.join(header))
+    for name in order:
+        merged_file.write(''.join(blocks[name]))
+    merged_file.close()
+
+    return len(order)
+
+def read_data_file(data_file_name):
+    """
+    Reads a data file in the SED fitter format (as written by `flag_txt_file_IR`, `flag_txt_file_Gaia` or
+    `flag_txt_file_24um`) back into arrays.
+
+    Args:
+        data_file_name (str): Path to the data file.
 
-    return merged_df
\ No newline at end of file
+    Returns:
+        tuple:
+            names (np.ndarray of str): Source names.
+            l, b (np.ndarray): Galactic coordinates.
+            flags (np.ndarray of int): Flags, shape (N, n_bands), in file order.
+            fluxes, flux_errs (np.ndarray): Fluxes and flux errors in mJy, shape (N, n_bands).
+    """
+    names, lines, n_valid = _data_file_sources(data_file_name)
+
+    tokens = np.array([line.split()[1:] for line in lines], dtype=float).reshape(len(lines), -1)
+    n_bands = (tokens.shape[1] - 2) // 3
+
+    l = tokens[:, 0]
+    b = tokens[:, 1]
+    flags = tokens[:, 2:2 + n_bands].astype(int)
+    fluxes = tokens[:, 2 + n_bands::2]
+    flux_errs = tokens[:, 3 + n_bands::2]
+
+    return np.array(names), l, b, flags, fluxes, flux_errs
+
+def format_data_lines(names, l, b, flags, fluxes, flux_errs):
+    """
+    Formats data file lines in the same layout as `flag_txt_file_IR`: name, l, b, one flag per band, then a
+    flux and flux error pair per band, separated by two spaces.
+
+    Args:
+        names (array-like of str): Source names.
+        l, b (array-like): Galactic coordinates.
+        flags (array-like of int): Flags, shape (N, n_bands).
+        fluxes, flux_errs (array-like): Fluxes and flux errors in mJy, shape (N, n_bands).
+
+    Returns:
+        lines (list of str): One line (ending in a newline) per source.
+    """
+    flags = np.asarray(flags).astype(int)
+    fluxes = np.asarray(fluxes, dtype=float)
+    flux_errs = np.asarray(flux_errs, dtype=float)
+
+    #Interleave the fluxes and errors so that each band is a flux followed by its error
+    flux_pairs = np.empty((len(fluxes), 2 * fluxes.shape[1]))
+    flux_pairs[:, 0::2] = fluxes
+    flux_pairs[:, 1::2] = flux_errs
+
+    lines = []
+    for i in range(0, len(flags)):
+        lines.append(str(names[i]) + '  ' + f"{l[i]:.5f}" + '  ' + f"{b[i]:>8,.5f}" \
+                     + ''.join('  ' + str(flag) for flag in flags[i]) \
+                     + ''.join('  ' + f"{value:.4e}" for value in flux_pairs[i]) + '\n')
+
+    return lines
+
+def _write_data_file(data_file_name, names, lines, input_df, incremental=False):
+    """
+    Writes the lines of a data file. In incremental mode, a hash of every source's input row is stored in
+    `<data_file_name>.hashes`, and the sources whose hash is new or changed since the last run are also
+    written to `<data_file_name>_delta`. Only the delta file has to be refit; the resulting pars files are
+    merged back with `update_pars_file`.
+
+    Only the delta file is incremental: the full data file is still rewritten whenever any source was added,
+    changed or removed (the lines have different lengths, so they cannot be replaced in place). It is left
+    untouched when the sources and their input rows are the same as in the last run.
+
+    Args:
+        data_file_name (str): Path of the data file.
+        names (array-like of str): Source names, one per line.
+        lines (list of str): Formatted data file lines.
+        input_df (pd.DataFrame): Input rows (one per line) that are hashed in incremental mode.
+        incremental (bool): Whether to write the hash and delta files.
+
+    Returns:
+        changed (list of str): Names of the sources written to the delta file (all sources if not incremental).
+    """
+    if not incremental:
+        data_file = open(str(data_file_name), 'w') #write your file name in the open function
+        data_file.write(''.join(lines))
+        data_file.close()
+        return list(names)
+
+    #One 64-bit hash per input row, computed for the whole table at once
+    row_hashes = pd.util.hash_pandas_object(input_df, index=False).to_numpy()
+    row_hashes = ['{:016x}'.format(row_hash) for row_hash in row_hashes]
+
+    hash_file_name = str(data_file_name) + '.hashes'
+    old_hashes = {}
+    old_names = []
+    if os.path.exists(hash_file_name):
+        with open(hash_file_name, 'r') as hash_file:
+            for line in hash_file:
+                name, row_hash = line.split()
+                old_hashes[name] = row_hash
+                old_names.append(name)
+
+    changed_rows = [i for i in range(0, len(lines)) if old_hashes.get(str(names[i])) != row_hashes[i]]
+
+    #The full data file is only rewritten if a source was added, changed, removed or moved
+    if changed_rows or old_names != [str(name) for name in names] or not os.path.exists(str(data_file_name)):
+        data_file = open(str(data_file_name), 'w')
+        data_file.write(''.join(lines))
+        data_file.close()
+
+    delta_file = open(str(data_file_name) + '_delta', 'w')
+    delta_file.write(''.join(lines[i] for i in changed_rows))
+    delta_file.close()
+
+    with open(hash_file_name, 'w') as hash_file:
+        hash_file.write(''.join(str(names[i]) + ' ' + row_hashes[i] + '\n' for i in range(0, len(lines))))
+
+    n_removed = len(set(old_hashes) - set(str(name) for name in names))
+    print('{} of {} sources changed ({} removed). Delta data file: {}'.format(len(changed_rows), len(lines), \
+          n_removed, str(data_file_name) + '_delta'))
+
+    return [str(names[i]) for i in changed_rows]
+
+@instrumented(counts=lambda n_stars: {'stars': n_stars, 'files': 1})
+def update_pars_file(pars_file_name, partial_pars_names, data_file_name, delta_data_file_name=None):
+    """
+    Merges the pars files from refitting a delta data file (see `flag_txt_file_IR(..., incremental=True)`)
+    back into an existing pars file of the same model set, in place.
+
+    Stars in the delta data file are replaced by their refit blocks (or dropped if the refit no longer
+    returned them), stars no longer in the data file are dropped, and the result is written in the order of
+    the data file.
+
+    Args:
+        pars_file_name (str): Existing pars file to update, e.g. 'pars_01g04_IR.txt'.
+        partial_pars_names (list of str): Pars files from fitting the delta data file.
+        data_file_name (str): The full, updated data file.
+        delta_data_file_name (str or None): The delta data file. Defaults to `<data_file_name>_delta`.
+
+    Returns:
+        n_stars (int): Number of stars in the updated pars file.
+    """
+    if delta_data_file_name is None:
+        delta_data_file_name = str(data_file_name) + '_delta'
+
+    header, blocks = read_pars_blocks(pars_file_name)
+
+    delta_names = set()
+    if os.path.getsize(delta_data_file_name) > 0:
+        delta_names = set(_data_file_sources(delta_data_file_name)[0])
+    names = _data_file_sources(data_file_name)[0]
+    in_data_file = set(names)
+
+    #Drop stale blocks of refit and removed stars before adding the new ones
+    blocks = {name: block for name, block in blocks.items() if name in in_data_file and name not in delta_names}
+    for partial_pars_name in partial_pars_names:
+        partial_header, partial_blocks = read_pars_blocks(partial_pars_name)
+        if partial_header[1] != header[1]:
+            raise ValueError('{} is not from the same model set as {}'.format(partial_pars_name, pars_file_name))
+        blocks.update(partial_blocks)
+
+    order = [name for name in names if name in blocks]
+
+    pars_file = open(str(pars_file_name), 'w')
+    pars_file.write(''.join(header))
+    for name in order:
+        pars_file.write(''.join(blocks[name]))
+    pars_file.close()
+
+    return len(order)
@@ -0,0 +1,148 @@
+import os
+import multiprocessing
+import numpy as np
+import pandas as pd
+from extractor_pipeline_v6 import multi_param_weight_avg
+from analysis_functions_v2 import MODEL_SET_NAMES, load_model_set
+
+#Parameters that can be compared, keyed by short name, with the pars file column whose weighted mean is used
+ECDF_PARAMS = {'lum': 'lum_arr', 'temp': 'star_temp_arr', 'av': 'av_arr', 'disk_mass': 'd_mass_arr'}
+
+#Disk only vs. disk + envelope pairs compared in `lum_freq_distribution_plot`
+DEFAULT_PAIRS = ((1, 16), (2, 17))
+
+def load_samples(model_types=(1, 2, 16, 17), params=tuple(ECDF_PARAMS), pars_dir='.'):
+    """
+    Reads the IR and Gaia pars files of every model set once and returns the sorted weighted means of each
+    parameter, ready for `compare_samples`.
+
+    Args:
+        model_types (tuple of int): Model sets to load (any of 1, 2, 16, 17).
+        params (tuple of str): Short names of the parameters to keep (keys of `ECDF_PARAMS`).
+        pars_dir (str): Directory containing the pars files.
+
+    Returns:
+        dict: Sorted 1D arrays keyed by (model_type, data_type, param), where data_type is 'IR' or 'Gaia'.
+              Stars with a non-finite mean are left out.
+    """
+    samples = {}
+    for model_type in model_types:
+        ir_df, gaia_df = load_model_set(model_type, pars_dir)
+        for data_type, df in [('IR', ir_df), ('Gaia', gaia_df)]:
+            df_pars = multi_param_weight_avg(df, [ECDF_PARAMS[param] for param in params])
+            for param in params:
+                values = df_pars[ECDF_PARAMS[param].replace('arr', 'w_avg')].to_numpy(dtype=float)
+                samples[(model_type, data_type, param)] = np.sort(values[np.isfinite(values)])
+
+    return samples
+
+def ecdf(x_sorted, values):
+    """
+    Evaluates the empirical cumulative distribution of a sorted sample at `values` (fraction <= value).
+    """
+    return np.searchsorted(x_sorted, values, side='right') / len(x_sorted)
+
+def ks_statistic(x_sorted, y_sorted):
+    """
+    Two-sample Kolmogorov-Smirnov statistic D = max|F_x - F_y| of two already sorted samples. Both ECDFs
+    only change at sample values, so they are compared at every value of either sample, with no re-sorting.
+    """
+    values = np.concatenate((x_sorted, y_sorted))
+    return np.max(np.abs(ecdf(x_sorted, values) - ecdf(y_sorted, values)))
+
+def _permutation_ks(task):
+    """
+    KS statistics of random relabelings of a pooled sample, for `compare_samples`. The pooled sample is sorted
+    once, so each permutation only needs a cumulative sum of its labels. Permutations are done in blocks to
+    keep memory bounded.
+    """
+    pooled_sorted, n_x, n_permutations, seed_seq = task
+    rng = np.random.default_rng(seed_seq)
+    n_total = len(pooled_sorted)
+    n_y = n_total - n_x
+
+    #With ties, the ECDFs can only be compared after the last of each run of equal values
+    last_of_value = np.append(pooled_sorted[1:] != pooled_sorted[:-1], True)
+
+    block = max(1, 2**22 // n_total)
+    d_perm = np.empty(n_permutations)
+    for start in range(0, n_permutations, block):
+        n_block = min(block, n_permutations - start)
+        in_x = rng.permuted(np.tile(np.arange(n_total) < n_x, (n_block, 1)), axis=1)
+        count_x = np.cumsum(in_x, axis=1)[:, last_of_value]
+        count_y = np.arange(1, n_total + 1)[last_of_value] - count_x
+        d_perm[start:start + n_block] = np.max(np.abs(count_x / n_x - count_y / n_y), axis=1)
+
+    return d_perm
+
+def compare_samples(samples, pairs=DEFAULT_PAIRS, params=None, data_types=('IR', 'Gaia'), n_permutations=0,
+                    workers=None, seed=0):
+    """
+    Compares the distributions of model sets with two-sample Kolmogorov-Smirnov tests, for every combination
+    of model-set pair, parameter and dataset in one call.
+
+    The statistics are computed from the pre-sorted samples of `load_samples`, and the p-values of all
+    comparisons at once with the same asymptotic formula as `stats.ks_2samp(method='asymp')`. Optionally, a
+    permutation p-value is also computed, with the permutations spread over worker processes.
+
+    Args:
+        samples (dict): Sorted samples from `load_samples`.
+        pairs (tuple of tuple of int): Model-set pairs to compare, e.g. ((1, 16), (2, 17)).
+        params (tuple of str or None): Parameters to compare. None compares every parameter in `samples`.
+        data_types (tuple of str): Datasets to compare, 'IR' and/or 'Gaia'.
+        n_permutations (int): Number of random permutations per comparison. 0 skips the permutation test.
+        workers (int or None): Number of worker processes for the permutations. None uses every core,
+                               1 runs them in this process.
+        seed (int): Seed of the permutations, so results are reproducible.
+
+    Returns:
+        pd.DataFrame: One row per comparison with the columns 'model_set_1', 'model_set_2', 'data_type',
+                      'param', 'n_1', 'n_2', 'ks_stat', 'p_value' and, with permutations, 'perm_p_value'.
+                      Comparisons with a missing or empty sample are skipped.
+    """
+    from scipy import stats #Only needed here, so the permutation workers start quickly
+    if params is None:
+        params = list(dict.fromkeys(key[2] for key in samples))
+
+    rows = []
+    pooled = []
+    for model_1, model_2 in pairs:
+        for data_type in data_types:
+            for param in params:
+                x_sorted = samples.get((model_1, data_type, param))
+                y_sorted = samples.get((model_2, data_type, param))
+                if x_sorted is None or y_sorted is None or len(x_sorted) == 0 or len(y_sorted) == 0:
+                    continue
+                rows.append({'model_set_1': MODEL_SET_NAMES[model_1], 'model_set_2': MODEL_SET_NAMES[model_2],
+                             'data_type': data_type, 'param': param, 'n_1': len(x_sorted), 'n_2': len(y_sorted),
+                             'ks_stat': ks_statistic(x_sorted, y_sorted)})
+                pooled.append(np.sort(np.concatenate((x_sorted, y_sorted))))
+
+    result = pd.DataFrame(rows, columns=['model_set_1', 'model_set_2', 'data_type', 'param', 'n_1', 'n_2', 'ks_stat'])
+
+    #Smirnov's asymptotic p-value, as in stats.ks_2samp(method='asymp'), for every comparison at once
+    n_eff = np.round(result['n_1'] * result['n_2'] / (result['n_1'] + result['n_2']))
+    result['p_value'] = np.clip(stats.kstwo.sf(result['ks_stat'].to_numpy(dtype=float), n_eff.to_numpy(dtype=float)), 0, 1)
+
+    if n_permutations > 0 and len(result) > 0:
+        #Every comparison is split into chunks of permutations so that all workers stay busy
+        n_chunks = max(1, (workers or os.cpu_count()) // len(result))
+        chunk_sizes = np.diff(np.linspace(0, n_permutations, n_chunks + 1).astype(int))
+        seed_seqs = iter(np.random.SeedSequence(seed).spawn(len(result) * n_chunks))
+        tasks = [(pooled[i], result['n_1'][i], size, next(seed_seqs)) for i in range(len(result)) for size in chunk_sizes]
+
+        if workers == 1:
+            d_perms = [_permutation_ks(task) for task in tasks]
+        else:
+            with multiprocessing.Pool(workers) as pool:
+                d_perms = pool.map(_permutation_ks, tasks)
+
+        perm_p_values = []
+        for i in range(len(result)):
+            d_perm = np.concatenate(d_perms[i * n_chunks:(i + 1) * n_chunks])
+            #Small tolerance so that permutations tying with the observed statistic count as extreme
+            n_extreme = np.sum(d_perm >= result['ks_stat'][i] - 1e-12)
+            perm_p_values.append((n_extreme + 1) / (n_permutations + 1))
+        result['perm_p_value'] = perm_p_values
+
+    return result
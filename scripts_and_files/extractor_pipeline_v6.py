@@ -1,10 +1,24 @@
+import sys
 import numpy as np
-import matplotlib.pyplot as plt
-import csv
 import pandas as pd
+from instrumentation_v1 import instrumented, start_stage, end_stage, table_counts
 
+#Integer coded columns of the reduced precision mode (see `reduce_precision`): column -> (integer dtype, scale),
+#with value = code / scale. Inclinations are kept to 0.01 degree and the scattering flags are 0 or 1
+INT_CODED_COLUMNS = {'inclination_arr': (np.int16, 100), 'scattering_arr': (np.int8, 1)}
 
-def read_extracted_file(e_file_name):
+def _object_array(arrays):
+    """
+    Turns a list of arrays into a 1D object array holding one array per entry. Unlike `np.array(arrays, dtype=object)`,
+    it does not become a 2D array when all the arrays have the same length.
+    """
+    object_arr = np.empty(len(arrays), dtype=object)
+    for i, arr in enumerate(arrays):
+        object_arr[i] = arr
+    return object_arr
+
+@instrumented(counts=lambda df: dict(table_counts(df), files=1))
+def read_extracted_file(e_file_name, dtype=None, int_codes=False):
     """
     Reads, parses, and processes the pars files from Robitaille's SED fitter, returning
     a structured pandas DataFrame of stellar and circumstellar parameters. 
@@ -23,7 +37,10 @@ def read_extracted_file(e_file_name):
     6. Returns results in a pandas DataFrame.
 
     Args:
-        e_file_name (str): Path to the extracted model results file.
+        e_file_name (str or file): Path to the extracted model results file, or the file opened in text mode.
+        dtype (numpy dtype or None): Opt-in reduced precision storage of the per-fit arrays, e.g. np.float32,
+                                     which halves their memory (see `reduce_precision`). None keeps float64.
+        int_codes (bool): Also store the inclinations and scattering flags as small integers (`INT_CODED_COLUMNS`).
 
     Returns:
         pd.DataFrame: DataFrame containing merged and filtered model results, with columns:
@@ -57,8 +74,11 @@ def read_extracted_file(e_file_name):
           Haemmerlé et al. (2019).
     """
     
-    #First we open to file
-    init_file = open(e_file_name, 'r')
+    #Stages of the parsing and of each cut are timed when instrumentation is enabled (see `instrumentation_v1.py`)
+    parse_stage = start_stage('read_extracted_file.parse')
+
+    #First we open to file (or use the open text file given, e.g. an io.StringIO of text read elsewhere)
+    init_file = e_file_name if hasattr(e_file_name, 'readlines') else open(e_file_name, 'r')
     
     #Following lines determine the model type in  the file
     test_list = init_file.readlines()[1];
@@ -349,41 +369,41 @@ def read_extracted_file(e_file_name):
             split_amb_den_arr[i] = split_amb_den_arr[i][:-1]
             split_amb_temp_arr[i] = split_amb_temp_arr[i][:-1]
         
-    #Turn the list of arrays in a multidimensional array
-    split_chi2_arr = np.array(split_chi2_arr, dtype=object)
-    split_of_avs = np.array(split_of_avs, dtype=object)
-    split_scale_arr = np.array(split_scale_arr, dtype=object)
-    split_star_rad_arr = np.array(split_star_rad_arr, dtype=object)
-    split_star_temp_arr = np.array(split_star_temp_arr, dtype=object)
-    split_d_mass_arr = np.array(split_d_mass_arr, dtype=object)
-    split_rmax_arr = np.array(split_rmax_arr, dtype=object)
-    split_d_beta_arr = np.array(split_d_beta_arr, dtype=object)
-    split_disk_p_arr = np.array(split_disk_p_arr, dtype=object)
-    split_disk_h100_arr = np.array(split_disk_h100_arr, dtype=object)
+    #Turn the list of arrays in an array of arrays (one entry per star, even when every star has as many fits)
+    split_chi2_arr = _object_array(split_chi2_arr)
+    split_of_avs = _object_array(split_of_avs)
+    split_scale_arr = _object_array(split_scale_arr)
+    split_star_rad_arr = _object_array(split_star_rad_arr)
+    split_star_temp_arr = _object_array(split_star_temp_arr)
+    split_d_mass_arr = _object_array(split_d_mass_arr)
+    split_rmax_arr = _object_array(split_rmax_arr)
+    split_d_beta_arr = _object_array(split_d_beta_arr)
+    split_disk_p_arr = _object_array(split_disk_p_arr)
+    split_disk_h100_arr = _object_array(split_disk_h100_arr)
     
     if model_type == 'sp_h_i_02':
-        split_disk_rmin_arr = np.array(split_disk_rmin_arr, dtype=object)
+        split_disk_rmin_arr = _object_array(split_disk_rmin_arr)
     elif model_type == 'spubsmi_16':
-        split_env_rho_0_arr = np.array(split_env_rho_0_arr, dtype=object)
-        split_env_rc_arr = np.array(split_env_rc_arr, dtype=object)
-        split_cav_power_arr = np.array(split_cav_power_arr, dtype=object)
-        split_cav_theta_0_arr = np.array(split_cav_theta_0_arr, dtype=object)
-        split_cav_rho_0_arr = np.array(split_cav_rho_0_arr, dtype=object)
-        split_amb_den_arr = np.array(split_amb_den_arr, dtype=object)
-        split_amb_temp_arr = np.array(split_amb_temp_arr, dtype=object)
+        split_env_rho_0_arr = _object_array(split_env_rho_0_arr)
+        split_env_rc_arr = _object_array(split_env_rc_arr)
+        split_cav_power_arr = _object_array(split_cav_power_arr)
+        split_cav_theta_0_arr = _object_array(split_cav_theta_0_arr)
+        split_cav_rho_0_arr = _object_array(split_cav_rho_0_arr)
+        split_amb_den_arr = _object_array(split_amb_den_arr)
+        split_amb_temp_arr = _object_array(split_amb_temp_arr)
     elif model_type == 'spubhmi_17':
-        split_env_rho_0_arr = np.array(split_env_rho_0_arr, dtype=object)
-        split_env_rc_arr = np.array(split_env_rc_arr, dtype=object)
-        split_cav_power_arr = np.array(split_cav_power_arr, dtype=object)
-        split_cav_theta_0_arr = np.array(split_cav_theta_0_arr, dtype=object)
-        split_cav_rho_0_arr = np.array(split_cav_rho_0_arr, dtype=object)
-        split_disk_rmin_arr = np.array(split_disk_rmin_arr, dtype=object)
-        split_env_rmin_arr = np.array(split_env_rmin_arr, dtype=object)
-        split_amb_den_arr = np.array(split_amb_den_arr, dtype=object)
-        split_amb_temp_arr = np.array(split_amb_temp_arr, dtype=object)
+        split_env_rho_0_arr = _object_array(split_env_rho_0_arr)
+        split_env_rc_arr = _object_array(split_env_rc_arr)
+        split_cav_power_arr = _object_array(split_cav_power_arr)
+        split_cav_theta_0_arr = _object_array(split_cav_theta_0_arr)
+        split_cav_rho_0_arr = _object_array(split_cav_rho_0_arr)
+        split_disk_rmin_arr = _object_array(split_disk_rmin_arr)
+        split_env_rmin_arr = _object_array(split_env_rmin_arr)
+        split_amb_den_arr = _object_array(split_amb_den_arr)
+        split_amb_temp_arr = _object_array(split_amb_temp_arr)
     
-    split_scattering_arr = np.array(split_scattering_arr, dtype=object)
-    split_inc_arr = np.array(split_inc_arr, dtype=object)
+    split_scattering_arr = _object_array(split_scattering_arr)
+    split_inc_arr = _object_array(split_inc_arr)
         
     #Turn lists into arrays for numpy.delete not to throw an error
     check_line = np.array(check_line)
@@ -393,6 +413,9 @@ def read_extracted_file(e_file_name):
     
     #########################
     
+    end_stage(parse_stage, stars=len(check_line), fits=len(line_list) - len(check_line))
+    temperature_cut_stage = start_stage('read_extracted_file.temperature_cut')
+
     #Here we are removing all the temperatures along with their respective models that call below the cutoff
     for j in range(0, len(check_line)):
         index = np.where(split_star_temp_arr[j] < 10**3.6)
@@ -488,6 +511,9 @@ def read_extracted_file(e_file_name):
             split_amb_den_arr = np.delete(split_amb_den_arr, index_of_emp)
             split_amb_temp_arr = np.delete(split_amb_temp_arr, index_of_emp)
 
+    end_stage(temperature_cut_stage, stars=len(check_line))
+    luminosity_cut_stage = start_stage('read_extracted_file.luminosity_cut')
+
     #Luminosity calculations
     #First initialize luminosity array. We need a luminosity for each individual model.
     lum_array = split_scale_arr.copy()
@@ -602,6 +628,8 @@ def read_extracted_file(e_file_name):
             split_amb_den_arr = np.delete(split_amb_den_arr, index_of_emp_2)
             split_amb_temp_arr = np.delete(split_amb_temp_arr, index_of_emp_2)
 
+    end_stage(luminosity_cut_stage, stars=len(check_line))
+
     #Now to accurately update the number of good fits a star has (num_fits)
     #also keep the initial number of fits
     init_num_fits = num_fits.copy()
@@ -642,13 +670,69 @@ def read_extracted_file(e_file_name):
              "scattering_arr": split_scattering_arr, "inclination_arr": split_inc_arr, "lum_arr": lum_array}
 
     df = pd.DataFrame(d)
+
+    #The cuts above are done in float64, so the reduced precision mode keeps the same models
+    if dtype is not None or int_codes:
+        df = reduce_precision(df, dtype, int_codes)
     
     return df
 
+def reduce_precision(df, dtype=np.float32, int_codes=False):
+    """
+    Stores the per-fit arrays of a table with a smaller float type. The pars files have at most 6-7 significant
+    digits, which float32 keeps, and the means of `multi_param_weight_avg` are still accumulated in float64
+    (see `precision_report` in `benchmark_v1.py` for the effect on the weighted means).
+
+    Args:
+        df (pandas.DataFrame): Table from `read_extracted_file` or `calc_p_dm_df`.
+        dtype (numpy dtype or None): Float type of the per-fit arrays. None leaves them as they are.
+        int_codes (bool): Also store the columns of `INT_CODED_COLUMNS` as integer codes.
+
+    Returns:
+        pandas.DataFrame: New table, the per-star arrays converted.
+    """
+    df = df.copy()
+    for col_name in df.columns:
+        if df[col_name].dtype != object or len(df) == 0 or not isinstance(df[col_name].iloc[0], np.ndarray):
+            continue
+        if int_codes and col_name in INT_CODED_COLUMNS:
+            int_dtype, scale = INT_CODED_COLUMNS[col_name]
+            df[col_name] = _object_array([np.round(np.asarray(arr) * scale).astype(int_dtype) for arr in df[col_name]])
+        elif dtype is not None:
+            df[col_name] = _object_array([np.asarray(arr, dtype=dtype) for arr in df[col_name]])
+    return df
+
+def full_precision(df):
+    """
+    Converts the per-fit arrays of a `reduce_precision` table back to float64, decoding the integer coded columns.
+    """
+    df = df.copy()
+    for col_name in df.columns:
+        if df[col_name].dtype != object or len(df) == 0 or not isinstance(df[col_name].iloc[0], np.ndarray):
+            continue
+        scale = INT_CODED_COLUMNS[col_name][1] if col_name in INT_CODED_COLUMNS else 1
+        df[col_name] = _object_array([np.asarray(arr, dtype=np.float64) / scale if np.asarray(arr).dtype.kind in 'iu'
+                                      else np.asarray(arr, dtype=np.float64) for arr in df[col_name]])
+    return df
+
+def fit_table_nbytes(df):
+    """
+    Memory used by a table of fits, in bytes: the scalar columns plus every per-star array (data and header).
+    """
+    n_bytes = 0
+    for col_name in df.columns:
+        if df[col_name].dtype == object and len(df) > 0 and isinstance(df[col_name].iloc[0], np.ndarray):
+            n_bytes += sum(sys.getsizeof(arr) for arr in df[col_name]) + df[col_name].to_numpy().nbytes
+        else:
+            n_bytes += int(df[col_name].memory_usage(index=False, deep=True))
+    return n_bytes
+
 def weight_mean(df, col_name):
     """
     Compute the simple and weighted mean of a given parameter for each star in the input DataFrame.
     Weights are based on chi-square values, with smaller chi-square values contributing more strongly.
+    The best chi-square of each star is subtracted before the exponential, so stars whose fits all have
+    large chi-square values still get finite weighted means.
 
     Args:
         df (pd.DataFrame): Input DataFrame from 'read_extracted_file' function. 
@@ -677,11 +761,15 @@ def weight_mean(df, col_name):
         star_name = df['MIR_NAME'][i]
         #n_data = df['n_data'][i]
         #n_fit = df['n_fits'][i]
-        chi_sq_arr = df['chi_2_arr'][i]
+        chi_sq_arr = np.asarray(df['chi_2_arr'][i], dtype=np.float64) #Sums in float64 for float32 tables too
+        param_arr = _decoded(np.asarray(df[col_name][i]), col_name).astype(np.float64)
         
-        param_mean = df[col_name][i].mean() #parameter mean for that star
+        param_mean = param_arr.mean() #parameter mean for that star
         
         #weighted means
+        #The best chi-squared is subtracted first, which does not change the normalized weights but
+        #avoids underflow for large chi-squared values (as in `chi2_weights`)
+        chi_sq_arr = chi_sq_arr - chi_sq_arr.min()
         #Here we produce the normalization constants P_n for each star
         p_n = 1 / sum(np.exp((-1*(chi_sq_arr))/2))
         #print(p_n)
@@ -689,7 +777,7 @@ def weight_mean(df, col_name):
         p_i = p_n * np.exp((-1*(chi_sq_arr))/2)
         #print(p_i)
         
-        param_weighted_mean = sum(p_i * df[col_name][i])
+        param_weighted_mean = sum(p_i * param_arr)
         
         # Create a new row and then append it to our rows list
         new_row = {'MIR_NAME': df['MIR_NAME'][i], 'n_data': df['n_data'][i], 'n_fits': df['n_fits'][i], \
@@ -703,9 +791,10 @@ def multi_param_weight_avg(df, param_list):
     """
     Compute weighted and unweighted means for multiple parameters in a DataFrame.
 
-    For each parameter in `param_list`, this function calls `weight_mean` to compute
-    both the simple mean and the chi-squared–weighted mean across model fits for each star.
-    The results are concatenated into a single DataFrame.
+    For each parameter in `param_list`, this function computes both the simple mean and the
+    chi-squared–weighted mean across model fits for each star, with the same weights as `weight_mean`.
+    All parameters are computed together in one pass with `flat_fit_table` and `chi2_weights` rather
+    than one star at a time.
 
     Args:
         df (pandas.DataFrame):  
@@ -731,11 +820,75 @@ def multi_param_weight_avg(df, param_list):
                     - `<param>_avg` (float): Unweighted mean value.  
                     - `<param>_w_avg` (float): Weighted mean value (using chi-squared weights).  
     """
-    for k in range(0, len(param_list)):
-        if k == 0:
-            big_df = weight_mean(df, param_list[k])          
+    #Same means as `weight_mean`, but for every parameter of every star in one vectorized pass
+    star_index, flat = flat_fit_table(df, ['chi_2_arr'] + list(param_list))
+    n_stars = len(df)
+    weights = chi2_weights(flat['chi_2_arr'], star_index, n_stars)
+    n_models = np.bincount(star_index, minlength=n_stars)
+
+    big_df = pd.DataFrame({'MIR_NAME': df['MIR_NAME'].to_numpy(), 'n_data': df['n_data'].to_numpy(), \
+                           'n_fits': df['n_fits'].to_numpy()})
+    for col_name in param_list:
+        big_df[col_name.replace('arr', 'avg')] = np.bincount(star_index, weights=flat[col_name], minlength=n_stars) / n_models
+        big_df[col_name.replace('arr', 'w_avg')] = np.bincount(star_index, weights=weights * flat[col_name], minlength=n_stars)
+
+    return big_df
+
+def _decoded(arr, col_name):
+    """
+    Values of an array of `col_name`, with integer codes (see `reduce_precision`) divided back by their scale.
+    """
+    if arr.dtype.kind in 'iu' and col_name in INT_CODED_COLUMNS:
+        return arr / INT_CODED_COLUMNS[col_name][1]
+    return arr
+
+def flat_fit_table(df, col_names):
+    """
+    Concatenates the per-star arrays of the given columns into flat arrays (one value per model fit), so
+    that calculations over every fit of every star can be done in one vectorized pass.
+
+    Args:
+        df (pd.DataFrame): DataFrame from `read_extracted_file` (or any DataFrame with per-star arrays).
+        col_names (list of str): Columns of arrays to flatten, e.g. ['chi_2_arr', 'star_temp_arr'].
+
+    Returns:
+        tuple:
+            star_index (np.ndarray of int): Row of `df` each fit belongs to.
+            flat (dict of np.ndarray): Flat float arrays, one per column in `col_names`. float32 columns (see
+                                       `reduce_precision`) stay float32, integer coded ones are decoded.
+    """
+    counts = np.array([np.size(arr) for arr in df[col_names[0]]], dtype=int)
+    star_index = np.repeat(np.arange(len(df)), counts)
+
+    flat = {}
+    for col_name in col_names:
+        if len(df) == 0:
+            flat[col_name] = np.zeros(0)
         else:
-            new_df = weight_mean(df, param_list[k])
-            avg_cols = new_df.iloc[:, 3:5]
-            big_df = pd.concat([big_df, avg_cols],axis=1)
-    return big_df
\ No newline at end of file
+            flat[col_name] = _decoded(np.concatenate([np.atleast_1d(arr) for arr in df[col_name]]), col_name)
+            if flat[col_name].dtype != np.float32:
+                flat[col_name] = flat[col_name].astype(float)
+
+    return star_index, flat
+
+def chi2_weights(chi2, star_index, n_stars):
+    """
+    Computes the normalized weights P_i = P_n * exp(-chi2_i / 2) of every fit of every star in one pass
+    (see `weight_mean`). The best chi-squared of each star is subtracted before the exponential, which does
+    not change the normalized weights but avoids underflow for large chi-squared values.
+
+    Args:
+        chi2 (np.ndarray): Flat chi-squared values from `flat_fit_table`.
+        star_index (np.ndarray of int): Star of each fit from `flat_fit_table`.
+        n_stars (int): Number of stars.
+
+    Returns:
+        np.ndarray: Flat weights, summing to 1 for every star.
+    """
+    best_chi2 = np.full(n_stars, np.inf)
+    np.minimum.at(best_chi2, star_index, chi2)
+
+    weights = np.exp(-(chi2 - best_chi2[star_index]) / 2)
+    weights /= np.bincount(star_index, weights=weights, minlength=n_stars)[star_index]
+
+    return weights
@@ -0,0 +1,208 @@
+import os
+import importlib.util
+import numpy as np
+import pandas as pd
+from extractor_pipeline_v6 import read_extracted_file, _object_array
+from instrumentation_v1 import instrumented, table_counts
+
+#pyarrow is optional: it is only imported by the functions of this module that read or write files
+HAVE_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+#File extensions of the two formats: Arrow IPC files can be memory mapped without copying, Parquet files are
+#smaller and read by most tools
+FIT_TABLE_FORMATS = {'arrow': '.arrow', 'parquet': '.parquet'}
+
+def _pyarrow():
+    """
+    Imports pyarrow, with a clear error if it is not installed.
+    """
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Reading and writing fit tables needs pyarrow (pip install pyarrow)')
+    return pyarrow
+
+def array_columns(df):
+    """
+    Columns of a DataFrame holding one array per star (the per-fit values of `read_extracted_file`).
+    """
+    return [col for col in df.columns if df[col].dtype == object and len(df) > 0 and isinstance(df[col].iloc[0], np.ndarray)]
+
+def fit_table_to_arrow(df):
+    """
+    Converts a table of fits (e.g. from `read_extracted_file` or `calc_p_dm_df`) to an Arrow table. Every
+    per-star array column becomes a list column: one contiguous buffer with the values of all fits of all stars,
+    plus the offset of the first fit of every star (0-d arrays are stored as one fit lists). Other columns are
+    stored as they are.
+
+    Returns:
+        pyarrow.Table: The table.
+    """
+    pa = _pyarrow()
+    df = df.reset_index(drop=True)
+    list_cols = array_columns(df)
+
+    arrays = []
+    for col in df.columns:
+        if col in list_cols:
+            values = [np.ravel(value) for value in df[col]] #Stars with one fit left by a cut can hold 0-d arrays
+            offsets = np.zeros(len(values) + 1, dtype=np.int64)
+            np.cumsum([value.size for value in values], out=offsets[1:])
+            flat = np.concatenate(values) if len(values) > 0 else np.zeros(0)
+            arrays.append(pa.LargeListArray.from_arrays(pa.array(offsets), pa.array(flat)))
+        else:
+            arrays.append(pa.array(df[col].to_numpy(), from_pandas=True))
+
+    return pa.Table.from_arrays(arrays, names=[str(col) for col in df.columns])
+
+def _list_column(column):
+    """
+    Flat values and offsets (relative to the values) of a list column, without copying when the column has
+    one chunk, as it does when read from a file.
+    """
+    pa = _pyarrow()
+    chunk = column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column
+    offsets = chunk.offsets.to_numpy()
+    values = chunk.values.to_numpy(zero_copy_only=False)[offsets[0]:offsets[-1]]
+    return values, offsets - offsets[0]
+
+def arrow_to_fit_table(table):
+    """
+    Converts an Arrow table from `fit_table_to_arrow` back to a DataFrame with one array per star. The arrays
+    are views of the Arrow buffers, so no values are copied (and, for memory mapped files, they are read-only).
+    """
+    pa = _pyarrow()
+    d = {}
+    for name, column in zip(table.column_names, table.columns):
+        if pa.types.is_large_list(column.type) or pa.types.is_list(column.type):
+            values, offsets = _list_column(column)
+            d[name] = _object_array(np.split(values, offsets[1:-1])) if len(offsets) > 1 else np.empty(0, dtype=object)
+        else:
+            d[name] = column.to_numpy(zero_copy_only=False)
+    return pd.DataFrame(d)
+
+@instrumented(counts=lambda result: {'files': 1})
+def write_fit_table(df, file_name, compression=None):
+    """
+    Writes a table of fits to an Arrow IPC ('.arrow' or '.feather') or Parquet ('.parquet') file, so it can be
+    loaded again much faster than by parsing the pars file, without pickling, and by other tools (DuckDB,
+    polars, pyarrow).
+
+    Args:
+        df (pandas.DataFrame): Table from `read_extracted_file`, `calc_p_dm_df`, `model_tree`, ...
+        file_name (str): Output file. The format follows the extension.
+        compression (str or None): Compression codec. None writes Arrow files uncompressed (so they can be
+                                   memory mapped without copying) and Parquet files with 'zstd'.
+
+    Returns:
+        str: The file name.
+    """
+    pa = _pyarrow()
+    table = fit_table_to_arrow(df)
+    file_name = str(file_name)
+
+    if file_name.endswith('.parquet'):
+        pa.parquet.write_table(table, file_name, compression=compression or 'zstd')
+    else:
+        options = pa.ipc.IpcWriteOptions(compression=compression)
+        with pa.OSFile(file_name, 'wb') as sink, pa.ipc.new_file(sink, table.schema, options=options) as writer:
+            writer.write_table(table)
+    return file_name
+
+def _read_arrow(file_name, columns=None):
+    """
+    Reads a fit table file as an Arrow table: memory mapped for Arrow files, only the selected columns.
+    """
+    pa = _pyarrow()
+    file_name = str(file_name)
+    if file_name.endswith('.parquet'):
+        return pa.parquet.read_table(file_name, columns=columns, memory_map=True)
+
+    table = pa.ipc.open_file(pa.memory_map(file_name, 'r')).read_all()
+    return table.select(columns) if columns is not None else table
+
+@instrumented(counts=table_counts)
+def read_fit_table(file_name, columns=None):
+    """
+    Reads a file written by `write_fit_table` as a DataFrame like the one it was written from.
+
+    Arrow files are memory mapped, so the per-star arrays are read-only views of the file and only the pages
+    that are used are read from disk. Parquet files are decoded, which is still much faster than parsing the
+    pars file.
+
+    Args:
+        file_name (str): Arrow or Parquet file.
+        columns (list of str or None): Columns to read, e.g. ['MIR_NAME', 'n_data', 'n_fits', 'chi_2_arr',
+                                       'lum_arr']. None reads all of them.
+
+    Returns:
+        pandas.DataFrame: The table.
+    """
+    return arrow_to_fit_table(_read_arrow(file_name, columns))
+
+def read_fit_arrays(file_name, col_names):
+    """
+    Reads list columns of a fit table file straight into flat arrays, in the layout of `flat_fit_table`, so
+    they can be reduced (e.g. with `chi2_weights` and `np.bincount`) without building one array per star.
+
+    Args:
+        file_name (str): Arrow or Parquet file from `write_fit_table`.
+        col_names (list of str): List columns to read, e.g. ['chi_2_arr', 'lum_arr'].
+
+    Returns:
+        tuple:
+            star_index (np.ndarray of int): Row of the star every fit belongs to.
+            flat (dict of np.ndarray): One flat array of every fit's value per column (views of the file for
+                                       Arrow files).
+    """
+    table = _read_arrow(file_name, list(col_names))
+    flat = {}
+    offsets = None
+    for name, column in zip(table.column_names, table.columns):
+        flat[name], offsets = _list_column(column)
+    star_index = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets)) if offsets is not None else np.zeros(0, dtype=int)
+    return star_index, flat
+
+def fit_table_file_name(model_type, data_type, fmt='arrow'):
+    """
+    Name of the fit table file of one pars file, e.g. (1, 'IR') -> 'pars_01g04_IR.arrow'.
+    """
+    return 'pars_{:02d}g04_{}{}'.format(model_type, data_type, FIT_TABLE_FORMATS[fmt])
+
+def export_fit_tables(model_types=(1, 2, 16, 17), output_dir='fit_tables', pars_dir='.', data_types=('IR', 'Gaia'),
+                      fmt='arrow'):
+    """
+    Parses the pars files of a region once and saves them as fit table files (`pars_XXg04_IR.arrow`, ...),
+    so they can be reloaded with `load_fit_tables` instead of parsing them again.
+
+    Args:
+        model_types (tuple of int): Model sets to export.
+        output_dir (str): Directory the files are written to. Created if it does not exist.
+        pars_dir (str): Directory containing the pars files.
+        data_types (tuple of str): 'IR' and/or 'Gaia'.
+        fmt (str): 'arrow' or 'parquet'.
+
+    Returns:
+        list of str: Paths of the written files.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    file_names = []
+    for model_type in model_types:
+        for data_type in data_types:
+            df = read_extracted_file(os.path.join(pars_dir, 'pars_{:02d}g04_{}.txt'.format(model_type, data_type)))
+            file_names.append(write_fit_table(df, os.path.join(output_dir, fit_table_file_name(model_type, data_type, fmt))))
+    return file_names
+
+def load_fit_tables(model_type, tables_dir='fit_tables', fmt='arrow', columns=None):
+    """
+    Same as `load_model_set`, from the files of `export_fit_tables`.
+
+    Returns:
+        tuple:
+            ir_df (pandas.DataFrame): IR-only fit table.
+            gaia_df (pandas.DataFrame): Gaia fit table.
+    """
+    return tuple(read_fit_table(os.path.join(tables_dir, fit_table_file_name(model_type, data_type, fmt)), columns)
+                 for data_type in ['IR', 'Gaia'])
@@ -0,0 +1,166 @@
+import os
+import sys
+import json
+import time
+import uuid
+import functools
+import contextlib
+import pandas as pd
+
+try:
+    import resource #Not available on Windows, where the peak RSS is not recorded
+except ImportError:
+    resource = None
+
+#State of the instrumentation in this process. Disabled by default, so the instrumented functions only pay for
+#one dictionary lookup
+_STATE = {'enabled': False, 'log_file': None, 'run_id': None, 'records': [], 'stack': []}
+
+def enable_instrumentation(log_file=None):
+    """
+    Starts recording the wall time, CPU time, peak RSS and item counts of every instrumented stage.
+
+    Args:
+        log_file (str or None): JSON-lines file every record is appended to as soon as its stage ends, so
+                                stages run in worker processes are logged too. None keeps the records in
+                                memory only.
+
+    Returns:
+        str: Identifier of this run, stored in every record.
+    """
+    _STATE.update({'enabled': True, 'log_file': log_file, 'run_id': uuid.uuid4().hex[:12], 'records': [], 'stack': []})
+    return _STATE['run_id']
+
+def disable_instrumentation(print_summary=False):
+    """
+    Stops recording and returns the records of this process as a DataFrame, optionally printing the
+    summary table of `summarize_stages`.
+    """
+    _STATE['enabled'] = False
+    records = pd.DataFrame(_STATE['records'])
+    if print_summary:
+        print(summarize_stages(records).to_string())
+    return records
+
+def _peak_rss_mb():
+    """
+    Largest resident set size of this process so far, in MB.
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return max_rss / 1e6 if sys.platform == 'darwin' else max_rss / 1e3
+
+def start_stage(name):
+    """
+    Marks the start of a stage. Returns a token for `end_stage`, or None when instrumentation is disabled.
+    Use `stage` instead when the stage is a single block of code.
+    """
+    if not _STATE['enabled']:
+        return None
+    token = {'stage': name, 'parent': _STATE['stack'][-1] if _STATE['stack'] else None, 'start': time.time(),
+             'wall_start': time.perf_counter(), 'cpu_start': time.process_time()}
+    _STATE['stack'].append(name)
+    return token
+
+def end_stage(token, **counts):
+    """
+    Marks the end of a stage started with `start_stage` and records it, with any item counts given as keyword
+    arguments (e.g. stars=1200, fits=25000, files=1). Does nothing if `token` is None.
+    """
+    if token is None:
+        return None
+
+    record = {'run_id': _STATE['run_id'], 'stage': token['stage'], 'parent': token['parent'],
+              'start': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(token['start'])),
+              'wall_s': time.perf_counter() - token['wall_start'], 'cpu_s': time.process_time() - token['cpu_start'],
+              'peak_rss_mb': _peak_rss_mb(), 'pid': os.getpid()}
+    record.update({key: int(value) for key, value in counts.items()})
+
+    if _STATE['stack'] and _STATE['stack'][-1] == token['stage']:
+        _STATE['stack'].pop()
+    _STATE['records'].append(record)
+    if _STATE['log_file'] is not None:
+        with open(_STATE['log_file'], 'a') as log_file:
+            log_file.write(json.dumps(record) + '\n')
+
+    return record
+
+@contextlib.contextmanager
+def stage(name, **counts):
+    """
+    Context manager recording one stage. Counts can be given up front, or added to the yielded dictionary
+    inside the block once they are known:
+
+        with stage('make_region_file', files=1) as counts:
+            ...
+            counts['stars'] = len(df)
+    """
+    token = start_stage(name)
+    try:
+        yield counts
+    finally:
+        end_stage(token, **counts)
+
+def table_counts(df):
+    """
+    Item counts of a DataFrame of stars: the number of stars and, for pars file tables, the number of fits.
+    """
+    counts = {'stars': len(df)}
+    if 'n_fits' in df:
+        counts['fits'] = df['n_fits'].sum()
+    return counts
+
+def instrumented(name=None, counts=None):
+    """
+    Decorator recording every call of a function as a stage named after it (or `name`).
+
+    Args:
+        name (str or None): Stage name. Defaults to the function name.
+        counts (callable or None): Called with the return value to get the item counts, e.g. `table_counts`.
+    """
+    def decorator(function):
+        stage_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _STATE['enabled']:
+                return function(*args, **kwargs)
+
+            token = start_stage(stage_name)
+            result = None
+            try:
+                result = function(*args, **kwargs)
+                return result
+            finally:
+                end_stage(token, **(counts(result) if counts is not None and result is not None else {}))
+
+        return wrapper
+    return decorator
+
+def read_run_log(log_file, run_id=None):
+    """
+    Reads a JSON-lines log written while instrumentation was enabled, optionally keeping one run only.
+    """
+    records = pd.read_json(log_file, lines=True, dtype=False)
+    if run_id is not None:
+        records = records[records['run_id'] == run_id].reset_index(drop=True)
+    return records
+
+def summarize_stages(records):
+    """
+    Summary table of stage records (from `disable_instrumentation` or `read_run_log`): number of calls, total
+    and maximum wall time, total CPU time, peak RSS and total item counts of every stage, slowest first.
+    """
+    if len(records) == 0:
+        return pd.DataFrame(columns=['stage', 'calls', 'wall_s', 'max_wall_s', 'cpu_s', 'peak_rss_mb'])
+
+    count_cols = [col for col in ['stars', 'fits', 'files'] if col in records]
+    summary = records.groupby('stage').agg(calls=('wall_s', 'size'), wall_s=('wall_s', 'sum'),
+                                           max_wall_s=('wall_s', 'max'), cpu_s=('cpu_s', 'sum'),
+                                           peak_rss_mb=('peak_rss_mb', 'max'))
+    for col in count_cols:
+        summary[col] = records.groupby('stage')[col].sum(min_count=1)
+
+    return summary.sort_values('wall_s', ascending=False).reset_index()
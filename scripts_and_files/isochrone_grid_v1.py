@@ -0,0 +1,90 @@
+import functools
+import numpy as np
+import pandas as pd
+from extractor_pipeline_v6 import flat_fit_table, chi2_weights
+from isochrones_v1 import available_ages, load_isochrone
+
+@functools.lru_cache(maxsize=8)
+def build_isochrone_grid(ages=None, isochrone_dir=None):
+    """
+    Builds an interpolant from the HR diagram position (log T_eff, log L/L_sun) to the age and initial mass,
+    using the Haemmerlé et al. (2019) isochrones. All isochrone points are triangulated (Delaunay) and the
+    age and mass are linearly interpolated inside each triangle. Positions outside the grid return NaN.
+
+    Note that the accuracy depends on how many isochrones are used, so download as many ages as you can
+    into the isochrone directory.
+
+    Args:
+        ages (tuple of float or None): log(age/yr) of the isochrones to use. None uses every isochrone
+                                       file found in the isochrone directory (at least two are needed).
+        isochrone_dir (str or None): Directory of the isochrone files. Defaults to the scripts directory.
+
+    Returns:
+        scipy.interpolate.LinearNDInterpolator: Called as `grid(log_temp, log_lum)`, it returns an array of
+                                                shape (N, 2) with log(age/yr) and the initial mass (M_sun).
+    """
+    from scipy.interpolate import LinearNDInterpolator
+    if ages is None:
+        ages = tuple(available_ages(isochrone_dir))
+    if len(ages) < 2:
+        raise ValueError('At least two isochrones are needed for the grid, found {}'.format(len(ages)))
+
+    points = []
+    values = []
+    for log_age in ages:
+        isochrone = load_isochrone(float(log_age), isochrone_dir)
+        points.append(np.column_stack((isochrone['log_temp'], isochrone['log_lum'])))
+        values.append(np.column_stack((np.full(len(isochrone['m_ini']), float(log_age)), isochrone['m_ini'])))
+
+    return LinearNDInterpolator(np.concatenate(points), np.concatenate(values))
+
+def age_mass_estimates(df, ages=None, isochrone_dir=None):
+    """
+    Estimates the age and initial mass of every star from all of its model fits at once.
+
+    Every fit of every star is placed on the isochrone grid (`build_isochrone_grid`) in one batch, then the
+    chi-squared weighted and unweighted means are computed per star with the same weights as `weight_mean`.
+    Fits that fall outside the grid are left out, and the weights are renormalized over the remaining fits.
+
+    Args:
+        df (pandas.DataFrame):  
+            DataFrame from `read_extracted_file` (or `calc_p_dm_df`), with at least the 'MIR_NAME', 'n_data', 
+            'n_fits', 'chi_2_arr', 'star_temp_arr' and 'lum_arr' columns.  
+        ages (tuple of float or None):  
+            log(age/yr) of the isochrones to use. None uses every isochrone file available.  
+        isochrone_dir (str or None):  
+            Directory of the isochrone files.  
+
+    Returns:
+        pandas.DataFrame:  
+            One row per star with the columns 'MIR_NAME', 'n_data', 'n_fits' (the same first three columns 
+            as `multi_param_weight_avg`, so the two can be concatenated side by side), and:  
+                - log_age_avg, log_age_w_avg: Unweighted and weighted mean of log(age/yr).  
+                - m_ini_avg, m_ini_w_avg: Unweighted and weighted mean of the initial mass (M_sun).  
+                - n_in_grid: Number of fits inside the isochrone grid. The means are NaN when this is 0.  
+    """
+    df = df.reset_index(drop=True)
+    n_stars = len(df)
+
+    star_index, flat = flat_fit_table(df, ['chi_2_arr', 'star_temp_arr', 'lum_arr'])
+    weights = chi2_weights(flat['chi_2_arr'], star_index, n_stars)
+
+    grid = build_isochrone_grid(None if ages is None else tuple(ages), isochrone_dir)
+    log_age, m_ini = grid(np.log10(flat['star_temp_arr']), np.log10(flat['lum_arr'])).T
+
+    in_grid = np.isfinite(log_age)
+    weights = np.where(in_grid, weights, 0.)
+    log_age = np.where(in_grid, log_age, 0.)
+    m_ini = np.where(in_grid, m_ini, 0.)
+
+    n_in_grid = np.bincount(star_index, weights=in_grid, minlength=n_stars)
+    weight_sum = np.bincount(star_index, weights=weights, minlength=n_stars)
+
+    result = {'MIR_NAME': df['MIR_NAME'], 'n_data': df['n_data'], 'n_fits': df['n_fits']}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for col_name, values in [('log_age', log_age), ('m_ini', m_ini)]:
+            result[col_name + '_avg'] = np.bincount(star_index, weights=values, minlength=n_stars) / n_in_grid
+            result[col_name + '_w_avg'] = np.bincount(star_index, weights=weights * values, minlength=n_stars) / weight_sum
+    result['n_in_grid'] = n_in_grid.astype(int)
+
+    return pd.DataFrame(result)
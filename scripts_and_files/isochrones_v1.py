@@ -0,0 +1,109 @@
+import os
+import sys
+import glob
+import functools
+import numpy as np
+
+#The isochrone files from Haemmerlé et al. (2019) are kept next to the scripts, so they are found
+#no matter what the current working directory is
+ISOCHRONE_DIR = os.path.dirname(os.path.abspath(__file__))
+if not glob.glob(os.path.join(ISOCHRONE_DIR, 'Isochr_*.dat')):
+    #Non-editable installs put them in <prefix>/share instead (see `data-files` in pyproject.toml)
+    ISOCHRONE_DIR = os.path.join(sys.prefix, 'share', 'yso-pipeline', 'isochrones')
+
+#log(age/yr) of the isochrones overplotted on the HR diagrams: 0.5, 1, 2, 5 and 31.6 Myr
+DEFAULT_AGES = (5.7, 6.0, 6.3, 6.7, 7.5)
+
+#Columns kept from the .dat files: initial mass, log(L/L_sun) and log(T_eff)
+ISOCHRONE_COLUMNS = {'m_ini': 0, 'log_lum': 4, 'log_temp': 5}
+
+#Missing isochrone files are only reported once per session
+_REPORTED_MISSING = set()
+
+def isochrone_file_name(log_age, isochrone_dir=None):
+    """
+    Returns the path of the Haemmerlé et al. (2019) isochrone file for a given log(age/yr),
+    e.g. 6.7 -> 'Isochr_Z0.0140_Vini0.00_t06.700.dat'. Without `isochrone_dir`, the scripts directory
+    is searched first and then the current working directory (where older versions read them from).
+    """
+    base_name = 'Isochr_Z0.0140_Vini0.00_t{:06.3f}.dat'.format(log_age)
+    if isochrone_dir is not None:
+        return os.path.join(isochrone_dir, base_name)
+
+    for search_dir in [ISOCHRONE_DIR, os.getcwd()]:
+        if os.path.exists(os.path.join(search_dir, base_name)):
+            return os.path.join(search_dir, base_name)
+    return os.path.join(ISOCHRONE_DIR, base_name)
+
+def available_ages(isochrone_dir=None):
+    """
+    Returns the sorted log(age/yr) of every isochrone file found in `isochrone_dir`.
+    """
+    if isochrone_dir is None:
+        isochrone_dir = ISOCHRONE_DIR
+    file_names = glob.glob(os.path.join(isochrone_dir, 'Isochr_Z0.0140_Vini0.00_t*.dat'))
+    return sorted(float(os.path.basename(name)[len('Isochr_Z0.0140_Vini0.00_t'):-len('.dat')]) for name in file_names)
+
+def age_label(log_age):
+    """
+    Legend label of an isochrone, e.g. 5.7 -> '0.5 Myr', 7.5 -> '31.6 Myr'.
+    """
+    return '{:g} Myr'.format(round(10**log_age / 1e6, 1))
+
+@functools.lru_cache(maxsize=None)
+def load_isochrone(log_age, isochrone_dir=None):
+    """
+    Loads one isochrone on first use and keeps it in memory afterwards.
+
+    The first time a .dat file is read, its three needed columns are also saved as a binary .npy file next
+    to it, which is what later sessions load. The .npy cache is refreshed whenever the .dat file is newer,
+    and is simply skipped if the directory is not writable.
+
+    Args:
+        log_age (float): log(age/yr) of the isochrone, e.g. 6.7 for 5 Myr.
+        isochrone_dir (str or None): Directory of the isochrone files. Defaults to the scripts directory.
+
+    Returns:
+        dict: Read-only arrays 'm_ini' (initial mass, M_sun), 'log_lum' (log(L/L_sun)) and
+              'log_temp' (log(T_eff/K)), ordered as in the file.
+    """
+    dat_name = isochrone_file_name(log_age, isochrone_dir)
+    cache_name = os.path.splitext(dat_name)[0] + '.npy'
+
+    if os.path.exists(cache_name) and os.path.getmtime(cache_name) >= os.path.getmtime(dat_name):
+        columns = np.load(cache_name)
+    else:
+        #The first line holds the column names, and loadtxt skips the blank line after it
+        columns = np.loadtxt(dat_name, skiprows=1, usecols=tuple(ISOCHRONE_COLUMNS.values()), unpack=True)
+        try:
+            np.save(cache_name, columns)
+        except OSError:
+            pass
+
+    columns.setflags(write=False) #Arrays are shared by every caller through the cache
+    return {name: columns[i] for i, name in enumerate(ISOCHRONE_COLUMNS)}
+
+def isochrone_tracks(ages=DEFAULT_AGES, isochrone_dir=None):
+    """
+    Returns the isochrones to overplot on an HR diagram.
+
+    Args:
+        ages (tuple of float): log(age/yr) of the isochrones. Defaults to 0.5, 1, 2, 5 and 31.6 Myr.
+        isochrone_dir (str or None): Directory of the isochrone files. Defaults to the scripts directory.
+
+    Returns:
+        list of tuple: One (log_temp, log_lum, label) tuple per age. Ages without an isochrone file are
+                       skipped with a message.
+    """
+    tracks = []
+    for log_age in ages:
+        dat_name = isochrone_file_name(log_age, isochrone_dir)
+        if not os.path.exists(dat_name):
+            if dat_name not in _REPORTED_MISSING:
+                print('Isochrone file for {} not found, skipping it: {}'.format(age_label(log_age), dat_name))
+                _REPORTED_MISSING.add(dat_name)
+            continue
+        isochrone = load_isochrone(float(log_age), isochrone_dir)
+        tracks.append((isochrone['log_temp'], isochrone['log_lum'], age_label(log_age)))
+
+    return tracks
@@ -0,0 +1,134 @@
+import numpy as np
+from astropy.io import fits
+from astropy.wcs import WCS
+from astropy.wcs.utils import proj_plane_pixel_area
+from astropy.coordinates import SkyCoord
+import astropy.units as u
+from data_pipeline_v3 import read_data_file, format_data_lines
+from instrumentation_v1 import instrumented
+
+def aperture_photometry_24um(mosaic_file_name, l, b, aperture_arcsec=7.0, annulus_arcsec=(7.0, 13.0),
+                             aperture_correction=2.05, hdu=0):
+    """
+    Measures MIPS 24 μm aperture fluxes and uncertainties at many positions in one vectorized call.
+
+    The mosaic is opened memory-mapped, so only the pixels in the cutouts around the sources are read. All
+    cutouts are gathered into one (N, size, size) stack, the sky is the median of the annulus and the sky
+    noise its robust (MAD) standard deviation.
+
+    Args:
+        mosaic_file_name (str): Path to the MIPS 24 μm FITS mosaic (surface brightness in MJy/sr).
+        l, b (array-like): Galactic coordinates of the sources in degrees.
+        aperture_arcsec (float): Radius of the source aperture in arcseconds.
+        annulus_arcsec (tuple of float): Inner and outer radii of the sky annulus in arcseconds.
+        aperture_correction (float): Multiplicative aperture correction. The default is the MIPS 24 μm
+                                     correction for a 7" aperture and a 7"-13" sky annulus.
+        hdu (int): Index of the FITS extension holding the image.
+
+    Returns:
+        tuple:
+            flux (np.ndarray): Aperture corrected fluxes in mJy. NaN where the source is off the mosaic.
+            flux_err (np.ndarray): Flux uncertainties in mJy from the sky noise. NaN where off the mosaic.
+    """
+    l = np.atleast_1d(np.asarray(l, dtype=float))
+    b = np.atleast_1d(np.asarray(b, dtype=float))
+
+    mosaic = fits.open(mosaic_file_name, memmap=True)
+    try:
+        image = mosaic[hdu].data
+        wcs = WCS(mosaic[hdu].header).celestial
+
+        #Pixel scale in arcsec and pixel solid angle in steradians (for MJy/sr -> mJy)
+        pix_area_deg2 = proj_plane_pixel_area(wcs)
+        pix_scale = np.sqrt(pix_area_deg2) * 3600.
+        pix_sr = pix_area_deg2 * (np.pi / 180.)**2
+
+        x, y = wcs.world_to_pixel(SkyCoord(l * u.deg, b * u.deg, frame='galactic'))
+
+        #One square cutout per source, large enough to hold the outer annulus
+        half = int(np.ceil(annulus_arcsec[1] / pix_scale)) + 1
+        offsets = np.arange(-half, half + 1)
+        x_center = np.rint(x).astype(int)
+        y_center = np.rint(y).astype(int)
+
+        rows = y_center[:, None, None] + offsets[None, :, None]
+        cols = x_center[:, None, None] + offsets[None, None, :]
+        inside = (rows >= 0) & (rows < image.shape[0]) & (cols >= 0) & (cols < image.shape[1])
+
+        #Gather every cutout from the memory-mapped image with a single fancy index
+        stack = np.asarray(image[np.clip(rows, 0, image.shape[0] - 1), np.clip(cols, 0, image.shape[1] - 1)],
+                           dtype=float)
+        stack[~inside] = np.nan
+    finally:
+        mosaic.close()
+
+    #Distances of every cutout pixel center to the (sub-pixel) source position, in arcsec
+    radius = np.hypot(rows - y[:, None, None], cols - x[:, None, None]) * pix_scale
+
+    in_aperture = radius <= aperture_arcsec
+    in_annulus = (radius > annulus_arcsec[0]) & (radius <= annulus_arcsec[1])
+
+    sky_pixels = np.where(in_annulus, stack, np.nan).reshape(len(l), -1)
+    sky = np.nanmedian(sky_pixels, axis=1)
+    sky_sigma = 1.4826 * np.nanmedian(np.abs(sky_pixels - sky[:, None]), axis=1)
+    n_sky = np.sum(np.isfinite(sky_pixels), axis=1)
+
+    aperture_pixels = np.where(in_aperture, stack - sky[:, None, None], np.nan).reshape(len(l), -1)
+    n_aperture = np.sum(in_aperture.reshape(len(l), -1), axis=1)
+    #Sources with any missing pixel in the aperture (edge of the mosaic or blanked data) are not measured
+    complete = np.sum(np.isfinite(aperture_pixels), axis=1) == n_aperture
+
+    flux_sum = np.nansum(aperture_pixels, axis=1)
+    err_sum = sky_sigma * np.sqrt(n_aperture + n_aperture**2 / np.maximum(n_sky, 1))
+
+    #MJy/sr * sr = MJy, then to mJy
+    flux = flux_sum * pix_sr * 1e9 * aperture_correction
+    flux_err = err_sum * pix_sr * 1e9 * aperture_correction
+
+    flux[~complete] = np.nan
+    flux_err[~complete] = np.nan
+
+    return flux, flux_err
+
+@instrumented(counts=lambda result: {'stars': len(result[0]), 'files': 1})
+def flag_txt_file_24um(mosaic_file_name, IR_data_file_name, ugos_24um_file_name, snr_min=3.0, **phot_kwargs):
+    """
+    Adds MIPS 24 μm photometry to an IR data file and writes the `_ugos_24um` file read by
+    `flag_txt_file_Gaia`. This replaces the aperture photometry step in Povich's repository.
+
+    The 24 μm band is added after the Spitzer/IRAC bands, so the output has the flags and fluxes in the
+    order 2MASS JHK, IRAC I1-I4, MIPS M1. Sources below `snr_min`, or off the mosaic, get a flag of 0 and
+    a flux and error of 0 for the 24 μm band.
+
+    Args:
+        mosaic_file_name (str): Path to the MIPS 24 μm FITS mosaic (MJy/sr).
+        IR_data_file_name (str): Path to the data file written by `flag_txt_file_IR`. Its l and b
+                                 columns (from SPICY) are used as the source positions.
+        ugos_24um_file_name (str): Name of the output text file.
+        snr_min (float): Minimum signal-to-noise ratio for a valid 24 μm measurement.
+        **phot_kwargs: Passed to `aperture_photometry_24um` (aperture, annulus, aperture correction).
+
+    Returns:
+        tuple:
+            flux_24 (np.ndarray): 24 μm fluxes in mJy (0 where not valid).
+            flux_24_err (np.ndarray): 24 μm flux errors in mJy (0 where not valid).
+            flag_24 (np.ndarray): 24 μm flags (1 if valid, 0 if not).
+    """
+    names, l, b, flags, fluxes, flux_errs = read_data_file(IR_data_file_name)
+
+    flux_24, flux_24_err = aperture_photometry_24um(mosaic_file_name, l, b, **phot_kwargs)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        valid = np.isfinite(flux_24) & (flux_24 > 0) & (flux_24 / flux_24_err >= snr_min)
+    flag_24 = valid.astype(int)
+    flux_24 = np.where(valid, flux_24, 0.)
+    flux_24_err = np.where(valid, flux_24_err, 0.)
+
+    lines = format_data_lines(names, l, b, np.column_stack((flags, flag_24)),
+                              np.column_stack((fluxes, flux_24)), np.column_stack((flux_errs, flux_24_err)))
+
+    data_file = open(str(ugos_24um_file_name), 'w') #write your file name in the open function
+    data_file.write(''.join(lines))
+    data_file.close()
+
+    return flux_24, flux_24_err, flag_24
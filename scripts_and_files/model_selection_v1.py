@@ -1,19 +1,16 @@
+import os
 import numpy as np
 import pandas as pd
 from analysis_functions_v2 import *
+from analysis_functions_v2 import _density_layer, _density_points
 from extractor_pipeline_v6 import *
+from extractor_pipeline_v6 import _decoded
+from isochrones_v1 import isochrone_tracks
+from region_export_v1 import write_ds9_regions
+from instrumentation_v1 import instrumented, table_counts
 
-log_lum_1,log_temp_1 = np.genfromtxt('Isochr_Z0.0140_Vini0.00_t05.700.dat',unpack=True,usecols=[4,5])
-
-log_lum_2,log_temp_2 = np.genfromtxt('Isochr_Z0.0140_Vini0.00_t06.000.dat',unpack=True,usecols=[4,5])
-
-log_lum_3,log_temp_3 = np.genfromtxt('Isochr_Z0.0140_Vini0.00_t06.300.dat',unpack=True,usecols=[4,5])
-
-log_lum_4,log_temp_4 = np.genfromtxt('Isochr_Z0.0140_Vini0.00_t06.700.dat',unpack=True,usecols=[4,5])
-
-log_lum_5,log_temp_5 = np.genfromtxt('Isochr_Z0.0140_Vini0.00_t07.500.dat',unpack=True,usecols=[4,5])
-
-def final_model_select(master_list_IR, master_list_gaia, user_cdp):
+@instrumented(counts=table_counts)
+def final_model_select(master_list_IR, master_list_gaia, user_cdp, pars_dir='.', region_file_name='whole_region_circles.reg'):
     """
     Select the final best-fit YSO model for each source across IR-only and Gaia datasets.
     
@@ -35,6 +32,10 @@ def final_model_select(master_list_IR, master_list_gaia, user_cdp):
         user_cdp : float
             Critical delta probability threshold used in the model likelihood calculation 
             (Eq. 21 in Robitaille, T. P. 2017).
+        pars_dir : str
+            Directory containing the pars files.
+        region_file_name : str
+            Name of the DS9 region file written by `make_region_file()`.
     
     Returns
     -------
@@ -44,25 +45,20 @@ def final_model_select(master_list_IR, master_list_gaia, user_cdp):
     """
 
     #Read in master lists from SPICY catalog cutouts
-    #### MUST STILL CONTAIN 'SPITZER' COLUMN ####
-    master_df_IR = pd.read_csv(master_list_IR) #IR master list
-    master_df_gaia = pd.read_csv(master_list_gaia) #gaia master list
-    
-    #Drops unnecessary parts of SPITZER name
-    master_df_IR['Spitzer'] = master_df_IR['Spitzer'].str.replace(r'SSTGLMC ', '')
-    master_df_gaia['Spitzer'] = master_df_gaia['Spitzer'].str.replace(r'SSTGLMC ', '')
+    master_df_IR = read_master_list(master_list_IR) #IR master list
+    master_df_gaia = read_master_list(master_list_gaia) #gaia master list
 
     #Use read_extracted_file from analysis_functions_v2 to read in pars files for each region
     #Must follow the same naming convention to read the files in
-    df_IR_01 = read_extracted_file('pars_01g04_IR.txt')
-    df_IR_02 = read_extracted_file('pars_02g04_IR.txt')
-    df_IR_16 = read_extracted_file('pars_16g04_IR.txt')
-    df_IR_17 = read_extracted_file('pars_17g04_IR.txt')
+    df_IR_01 = read_extracted_file(os.path.join(pars_dir, 'pars_01g04_IR.txt'))
+    df_IR_02 = read_extracted_file(os.path.join(pars_dir, 'pars_02g04_IR.txt'))
+    df_IR_16 = read_extracted_file(os.path.join(pars_dir, 'pars_16g04_IR.txt'))
+    df_IR_17 = read_extracted_file(os.path.join(pars_dir, 'pars_17g04_IR.txt'))
 
-    df_gaia_01 = read_extracted_file('pars_01g04_Gaia.txt')
-    df_gaia_02 = read_extracted_file('pars_02g04_Gaia.txt')
-    df_gaia_16 = read_extracted_file('pars_16g04_Gaia.txt')
-    df_gaia_17 = read_extracted_file('pars_17g04_Gaia.txt') 
+    df_gaia_01 = read_extracted_file(os.path.join(pars_dir, 'pars_01g04_Gaia.txt'))
+    df_gaia_02 = read_extracted_file(os.path.join(pars_dir, 'pars_02g04_Gaia.txt'))
+    df_gaia_16 = read_extracted_file(os.path.join(pars_dir, 'pars_16g04_Gaia.txt'))
+    df_gaia_17 = read_extracted_file(os.path.join(pars_dir, 'pars_17g04_Gaia.txt')) 
 
     #Calculate probability ffrom Eq. 21 using function below
     df_pdm_IR_01 = calc_p_dm_df(df_IR_01, user_cdp, 1)
@@ -93,6 +89,39 @@ def final_model_select(master_list_IR, master_list_gaia, user_cdp):
     gaia_tree_df = model_tree(df_pdm_gaia_01, df_pdm_gaia_02, df_pdm_gaia_16, df_pdm_gaia_17, master_df_gaia) #Gaia
 
     #Now we prioritze Gaia available stars. This is because even if they have a worse chi-squared, more data points are available
+    final_df = prioritize_gaia(IR_tree_df, gaia_tree_df, master_df_IR)
+
+    #Make a region file based on the 'Type_Flag' columns
+    make_region_file(final_df, region_file_name)
+
+    return final_df
+
+def read_master_list(file_name):
+    """
+    Reads a SPICY catalog cutout (CSV) for `model_tree`, dropping the 'SSTGLMC ' prefix of the 'Spitzer'
+    names so they match the pars files.
+    """
+    #### MUST STILL CONTAIN 'SPITZER' COLUMN ####
+    master_df = pd.read_csv(file_name)
+    master_df['Spitzer'] = master_df['Spitzer'].str.replace(r'SSTGLMC ', '')
+    return master_df
+
+def prioritize_gaia(IR_tree_df, gaia_tree_df, master_df_IR):
+    """
+    Combine the IR and Gaia model trees into one final selection, in the order of the IR master list.
+    Stars with Gaia data always keep their Gaia model, even with a higher chi-squared, since more data
+    points were fitted; the others keep their best IR model.
+
+    Args:
+    IR_tree_df, gaia_tree_df : pandas.DataFrame
+        Outputs of `model_tree()` for the IR and Gaia pars files.
+    master_df_IR : pandas.DataFrame
+        IR master list from `read_master_list()`.
+
+    Returns:
+    pandas.DataFrame
+        The final selection, with a 'Type_Flag' column of 'gaia' or 'ir'.
+    """
     #We always chose Gaia if available, otherwise, we pick the best IR model
 
     #Make a new flag for the star based on data points used
@@ -120,11 +149,9 @@ def final_model_select(master_list_IR, master_list_gaia, user_cdp):
             saved_row_2 = IR_tree_df[IR_tree_df['MIR_NAME'] == name_check_2].iloc[[0]]
         final_df = pd.concat([final_df, saved_row_2], ignore_index=True)
 
-    #Make a region file based on the 'Type_Flag' columns
-    make_region_file(final_df)
-
     return final_df
 
+@instrumented(counts=table_counts)
 def calc_p_dm_df(pars_file_df, cdp_choice, par_type):
     """
     Compute the model probability (P_DM) for each YSO based on chi-squared filtering criteria.
@@ -203,6 +230,7 @@ def calc_p_dm_df(pars_file_df, cdp_choice, par_type):
         
     return pars_file_df
 
+@instrumented(counts=table_counts)
 def model_tree(model_01_df, model_02_df, model_16_df, model_17_df, master_list):
     """
     Select the best-fitting model for each source across all model grids.
@@ -251,7 +279,8 @@ def model_tree(model_01_df, model_02_df, model_16_df, model_17_df, master_list):
         overall_df = pd.concat([overall_df, saved_row], ignore_index=True)
     return overall_df
 
-def make_region_file(final_tree_df):
+@instrumented()
+def make_region_file(final_tree_df, file_name='whole_region_circles.reg'):
     """
     Generate a DS9 region file marking sources from the final model selection.
     
@@ -270,51 +299,24 @@ def make_region_file(final_tree_df):
             - 'Type_Flag' : str
                 Classification flag, either 'gaia' or 'ir', used to set region 
                 color and circle size.
+    file_name : str
+        Path of the region file to write.
     
     Outputs:
     whole_region_circles.reg : file
-        A DS9 region file saved in the current working directory, where:
+        A DS9 region file (by default saved in the current working directory), where:
             - Gaia sources are shown as large yellow circles (10″ radius).
             - IR-only sources are shown as smaller red circles (6″ radius).
     
     Notes: 
         - The galactic coordinates are parsed directly from the `MIR_NAME` string
         by slicing its numeric substrings corresponding to longitude and latitude.
+        - The file is written by `write_ds9_regions()` from `region_export_v1.py`,
+        which also takes catalog l/b columns, and `write_moc()` there exports the
+        same sources as a HEALPix MOC.
     """
     
-    # Header for DS9 region file
-    header = '''# Region file format: DS9 version 4.1
-    global color=green dashlist=8 3 width=1 font="helvetica 10 normal roman" select=1 highlite=1 dash=0 fixed=0 edit=1 move=1 delete=1 include=1 source=1
-    galactic
-    '''
-    #Initialize txt string
-    txt_string = ''
-    
-    for i in range(len(final_tree_df)):
-        name_star_Spitzer = final_tree_df['MIR_NAME'][i]
-        flag = final_tree_df['Type_Flag'][i] # either 'ir' or 'gaia'
-    
-        #Remove the 0th character (the 'G')
-        name_star_trim = name_star_Spitzer[1:]
-        
-        #Slice characters 1–8 and 9–16 from the trimmed string
-        l_str = name_star_trim[0:8]   # Characters 1 to 8 (from original string)
-        b_str = name_star_trim[8:16]  # Characters 9 to 16 (from original string)
-        
-        l = float(l_str)
-        b = float(b_str)
-    
-        # Format the values
-        if flag == 'gaia':
-            txt_string += f'circle({l:.4f},{b:.4f},10.000") # color=yellow width=4 tag={{Gaia}}\n'
-        elif flag == 'ir':
-            txt_string += f'circle({l:.4f},{b:.4f},6.000") # color=red width=3 tag={{IRonly}}\n'
-    
-    full_text = header + txt_string
-    
-    data_file = open('whole_region_circles' + '.reg', 'w') #write your file name in the open function
-    n = data_file.write(full_text)
-    data_file.close()
+    write_ds9_regions(final_tree_df, file_name)
 
 def weight_mean_tree(df, col_name):
     """
@@ -323,7 +325,8 @@ def weight_mean_tree(df, col_name):
     parameter column (e.g., temperature, luminosity, or extinction) for each star
     in the input DataFrame. The weighting is based on the chi-squared values
     associated with each model fit, using the probability weights defined by 
-    exp(-chi-squared/2). If only one model exists for a star, the simple mean is used 
+    exp(-chi-squared/2), relative to the best chi-squared of the star so they do not
+    underflow. If only one model exists for a star, the simple mean is used 
     for both the regular and weighted mean.
     
     Args
@@ -358,16 +361,20 @@ def weight_mean_tree(df, col_name):
     
     for i in range(0, len(df)):
         star_name = df['MIR_NAME'][i]
-        chi_sq_arr = df['chi_2_arr'][i]
+        chi_sq_arr = np.asarray(df['chi_2_arr'][i], dtype=np.float64) #Sums in float64 for float32 tables too
 
         #Have to make sure the actual column has many model. If not, don't do a weighted mean,
         if np.size(df['chi_2_arr'][i]) == 1:
             new_row = {'MIR_NAME': star_name, 'n_data': df['n_data'][i], 'n_good': df['n_good'][i], \
                        'Model_Flag': df['Model_Flag'][i], 'Type_Flag': df['Type_Flag'][i], \
-                       col_name.replace('arr', 'avg'): float(df[col_name][i]), col_name.replace('arr', 'w_avg'): float(df[col_name][i])}
+                       col_name.replace('arr', 'avg'): float(_decoded(np.asarray(df[col_name][i]), col_name)), \
+                       col_name.replace('arr', 'w_avg'): float(_decoded(np.asarray(df[col_name][i]), col_name))}
         else:
-            param_mean = df[col_name][i].mean() #parameter mean for that star
+            param_arr = _decoded(np.asarray(df[col_name][i]), col_name).astype(np.float64)
+            param_mean = param_arr.mean() #parameter mean for that star
             #weighted means
+            #Relative to the best fit, so the exponentials below do not underflow to 0
+            chi_sq_arr = chi_sq_arr - chi_sq_arr.min()
             #Here we produce the normalization constants P_n for each star
             p_n = 1 / sum(np.exp((-1*(chi_sq_arr))/2))
             #print(p_n)
@@ -375,7 +382,7 @@ def weight_mean_tree(df, col_name):
             p_i = p_n * np.exp((-1*(chi_sq_arr))/2)
             #print(p_i)
             
-            param_weighted_mean = sum(p_i * df[col_name][i])
+            param_weighted_mean = sum(p_i * param_arr)
             
             # Create a new row and then append it to our rows list
             new_row = {'MIR_NAME': star_name, 'n_data': df['n_data'][i], 'n_good': df['n_good'][i], \
@@ -429,7 +436,8 @@ def multi_param_weight_avg_tree(df, param_list):
             
     return big_df
 
-def hr_diagram_and_dust_ext_region_tree(df_pars):
+@instrumented()
+def hr_diagram_and_dust_ext_region_tree(df_pars, density=False, weighted=False, bins=200):
     """
     Plot HR diagram and dust extinction trends for combined model tree results.
     This function generates a two-panel figure summarizing the stellar properties
@@ -448,6 +456,16 @@ def hr_diagram_and_dust_ext_region_tree(df_pars):
             - 'av_arr'
             - 'Model_Flag' (1, 2, 16, 17)
             - plus all fields required by `multi_param_weight_avg_tree`.
+    density : bool
+        If True, all sources are binned into one 2D histogram image per panel
+        instead of a scatter plot per model type. The drawing time and file
+        size then no longer depend on the number of sources.
+    weighted : bool
+        Only used with `density`. If True, every model fit of every source is
+        binned with its normalized chi-squared weight instead of only the
+        weighted mean of each source.
+    bins : int
+        Number of histogram bins along each axis when `density` is True.
     
     Returns:
     None
@@ -457,57 +475,63 @@ def hr_diagram_and_dust_ext_region_tree(df_pars):
             2. Dust extinction A_V vs. log T_eff for the same sources.
     
     Notes:
-        - Isochrones (e.g., 0.5, 1, 2, 5, 31.6 Myr) must be preloaded as arrays:
-              `log_temp_1`, `log_lum_1`, ..., `log_temp_5`, `log_lum_5`.
+        - Isochrones (0.5, 1, 2, 5, 31.6 Myr) are loaded on first use with
+              `isochrone_tracks()` from `isochrones_v1.py`.
         - The function automatically saves the figure as 'full_region.png'
           and displays it using matplotlib.
     """
+    import matplotlib.pyplot as plt
+    from matplotlib.ticker import AutoMinorLocator
     
     df_complete_tree = multi_param_weight_avg_tree(df_pars, ['star_temp_arr', 'lum_arr', 'av_arr'])
 
     fig, axs = plt.subplots(2,1,figsize=(14,18))
 
-    axs[0].scatter(np.log10(df_complete_tree['star_temp_w_avg'][df_complete_tree['Model_Flag'] == 1]), \
-                   np.log10(df_complete_tree['lum_w_avg'][df_complete_tree['Model_Flag'] == 1]), \
-                   c='blue', marker='+', label='sp_s_i', alpha=0.5)
+    if density:
+        log_temp, log_lum, av, weights = _density_points(df_pars, df_complete_tree, weighted)
+        image_hr = _density_layer(axs[0], log_temp, log_lum, (4.3,3.5), (-0.5,4), weights, bins)
+        image_av = _density_layer(axs[1], log_temp, av, (4.3,3.5), (-0.5,20), weights, bins)
+        fig.colorbar(image_hr, ax=axs[0], label='YSOs per bin')
+        fig.colorbar(image_av, ax=axs[1], label='YSOs per bin')
+    else:
+        axs[0].scatter(np.log10(df_complete_tree['star_temp_w_avg'][df_complete_tree['Model_Flag'] == 1]), \
+                       np.log10(df_complete_tree['lum_w_avg'][df_complete_tree['Model_Flag'] == 1]), \
+                       c='blue', marker='+', label='sp_s_i', alpha=0.5)
 
-    axs[0].scatter(np.log10(df_complete_tree['star_temp_w_avg'][df_complete_tree['Model_Flag'] == 2]), \
-                   np.log10(df_complete_tree['lum_w_avg'][df_complete_tree['Model_Flag'] == 2]), \
-                   c='blue', marker='x', label='sp_h_i', alpha=0.5)
+        axs[0].scatter(np.log10(df_complete_tree['star_temp_w_avg'][df_complete_tree['Model_Flag'] == 2]), \
+                       np.log10(df_complete_tree['lum_w_avg'][df_complete_tree['Model_Flag'] == 2]), \
+                       c='blue', marker='x', label='sp_h_i', alpha=0.5)
 
-    axs[0].scatter(np.log10(df_complete_tree['star_temp_w_avg'][df_complete_tree['Model_Flag'] == 16]), \
-                   np.log10(df_complete_tree['lum_w_avg'][df_complete_tree['Model_Flag'] == 16]), \
-                   c='blue', marker='s', label='spubsmi', alpha=0.5)
+        axs[0].scatter(np.log10(df_complete_tree['star_temp_w_avg'][df_complete_tree['Model_Flag'] == 16]), \
+                       np.log10(df_complete_tree['lum_w_avg'][df_complete_tree['Model_Flag'] == 16]), \
+                       c='blue', marker='s', label='spubsmi', alpha=0.5)
 
-    axs[0].scatter(np.log10(df_complete_tree['star_temp_w_avg'][df_complete_tree['Model_Flag'] == 17]), \
-                   np.log10(df_complete_tree['lum_w_avg'][df_complete_tree['Model_Flag'] == 17]), \
-                   c='blue', marker='D', label='spubhmi', alpha=0.5)
+        axs[0].scatter(np.log10(df_complete_tree['star_temp_w_avg'][df_complete_tree['Model_Flag'] == 17]), \
+                       np.log10(df_complete_tree['lum_w_avg'][df_complete_tree['Model_Flag'] == 17]), \
+                       c='blue', marker='D', label='spubhmi', alpha=0.5)
     
-    #Plot isochrones
-    axs[0].plot(log_temp_1, log_lum_1,'-',color='red',lw=2, label = '0.5 Myr')
-    axs[0].plot(log_temp_2, log_lum_2,'-',color='red',lw=2, label = '1 Myr')
-    axs[0].plot(log_temp_3, log_lum_3,'-',color='red',lw=2, label = '2 Myr')
-    axs[0].plot(log_temp_4, log_lum_4,'-',color='red',lw=2, label = '5 Myr')
-    axs[0].plot(log_temp_5, log_lum_5,'-',color='red',lw=2, label = '31.6 Myr')
-    
-    ###### Plot dust extinction plots now
-    # axs[1].scatter(np.log10(df_complete_tree['star_temp_w_avg']), df_complete_tree['av_w_avg'], alpha=0.5)
+        ###### Plot dust extinction plots now
+        # axs[1].scatter(np.log10(df_complete_tree['star_temp_w_avg']), df_complete_tree['av_w_avg'], alpha=0.5)
 
-    axs[1].scatter(np.log10(df_complete_tree['star_temp_w_avg'][df_complete_tree['Model_Flag'] == 1]), \
-                   df_complete_tree['av_w_avg'][df_complete_tree['Model_Flag'] == 1], \
-                   c='blue', marker='+', label='sp_s_i', alpha=0.5)
+        axs[1].scatter(np.log10(df_complete_tree['star_temp_w_avg'][df_complete_tree['Model_Flag'] == 1]), \
+                       df_complete_tree['av_w_avg'][df_complete_tree['Model_Flag'] == 1], \
+                       c='blue', marker='+', label='sp_s_i', alpha=0.5)
     
-    axs[1].scatter(np.log10(df_complete_tree['star_temp_w_avg'][df_complete_tree['Model_Flag'] == 2]), \
-                   df_complete_tree['av_w_avg'][df_complete_tree['Model_Flag'] == 2], \
-                   c='blue', marker='x', label='sp_h_i', alpha=0.5)
+        axs[1].scatter(np.log10(df_complete_tree['star_temp_w_avg'][df_complete_tree['Model_Flag'] == 2]), \
+                       df_complete_tree['av_w_avg'][df_complete_tree['Model_Flag'] == 2], \
+                       c='blue', marker='x', label='sp_h_i', alpha=0.5)
 
-    axs[1].scatter(np.log10(df_complete_tree['star_temp_w_avg'][df_complete_tree['Model_Flag'] == 16]), \
-                   df_complete_tree['av_w_avg'][df_complete_tree['Model_Flag'] == 16], \
-                   c='blue', marker='s', label='spubsmi', alpha=0.5)
+        axs[1].scatter(np.log10(df_complete_tree['star_temp_w_avg'][df_complete_tree['Model_Flag'] == 16]), \
+                       df_complete_tree['av_w_avg'][df_complete_tree['Model_Flag'] == 16], \
+                       c='blue', marker='s', label='spubsmi', alpha=0.5)
 
-    axs[1].scatter(np.log10(df_complete_tree['star_temp_w_avg'][df_complete_tree['Model_Flag'] == 17]), \
-                   df_complete_tree['av_w_avg'][df_complete_tree['Model_Flag'] == 17], \
-                   c='blue', marker='D', label='spubhmi', alpha=0.5)
+        axs[1].scatter(np.log10(df_complete_tree['star_temp_w_avg'][df_complete_tree['Model_Flag'] == 17]), \
+                       df_complete_tree['av_w_avg'][df_complete_tree['Model_Flag'] == 17], \
+                       c='blue', marker='D', label='spubhmi', alpha=0.5)
+    
+    #Plot isochrones
+    for log_temp, log_lum, age_label in isochrone_tracks():
+        axs[0].plot(log_temp, log_lum,'-',color='red',lw=2, label = age_label)
     
     #Titles
     # fig.suptitle('Disk Only YSO Models (sp-s-i)')
@@ -545,7 +569,8 @@ def hr_diagram_and_dust_ext_region_tree(df_pars):
     
     axs[1].set_xlim(4.3,3.5)
     axs[1].set_ylim(-0.5, 20)
-    axs[1].legend(loc="upper left")
+    if not density:
+        axs[1].legend(loc="upper left")
     
     fig.tight_layout()
     filename = 'full_region' + '.png'
@@ -0,0 +1,283 @@
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+#Stages of a region run, in the order they are run
+PIPELINE_STAGES = ('data_files', 'region_plots', 'single_star_plots', 'statistics', 'model_selection', 'exports')
+
+#Settings of the [pipeline] table of the config file, with their defaults. Every one can also be set per region
+DEFAULT_SETTINGS = {'output_dir': 'pipeline_output', 'workers': None, 'model_types': [1, 2, 16, 17], 'dpi': 150,
+                    'density': False, 'weighted': False, 'bins': 200, 'pairs': [[1, 16], [2, 17]], 'n_permutations': 0,
+                    'seed': 0, 'incremental': False, 'moc_order': 10, 'moc_format': 'fits'}
+
+#Region keys holding paths, resolved against the region's 'dir' (or the config file directory)
+_PATH_KEYS = ('pars_dir', 'spicy_csv', 'data_file_name', 'ugos_24um_file_name', 'spicy_gaia_match_csv_name',
+              'gaia_data_file_name', 'master_list_IR', 'master_list_gaia')
+
+def load_config(file_name):
+    """
+    Reads a pipeline config file. The format follows the extension: TOML ('.toml'), YAML ('.yaml' or '.yml',
+    needs PyYAML) or JSON.
+
+    The config has a `pipeline` table of settings (see `DEFAULT_SETTINGS`) and a `regions` list. Each region
+    is a table with a 'name' and any of:
+        - 'dir': Directory the other paths of the region are relative to. Defaults to the config file directory.
+        - 'spicy_csv', 'data_file_name': Arguments of `flag_txt_file_IR` (recipe 2).
+        - 'ugos_24um_file_name', 'spicy_gaia_match_csv_name', 'gaia_data_file_name': Arguments of
+          `flag_txt_file_Gaia` (recipe 2).
+        - 'pars_dir': Directory of the eight pars files. Defaults to 'dir'.
+        - 'master_list_IR', 'master_list_gaia', 'cdp': Arguments of `final_model_select` (recipe 3).
+        - 'stars': Stars (`MIR_NAME`) to draw single-star figures of.
+        - Any setting of the `pipeline` table, to override it for this region.
+
+    Returns:
+        dict: 'settings' (dict) and 'regions' (list of dict), with defaults filled in and absolute paths.
+    """
+    extension = os.path.splitext(str(file_name))[1].lower()
+    if extension == '.toml':
+        try:
+            import tomllib
+        except ImportError: #Python < 3.11
+            import tomli as tomllib
+        with open(file_name, 'rb') as config_file:
+            config = tomllib.load(config_file)
+    elif extension in ('.yaml', '.yml'):
+        import yaml
+        with open(file_name) as config_file:
+            config = yaml.safe_load(config_file)
+    else:
+        with open(file_name) as config_file:
+            config = json.load(config_file)
+
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(config.get('pipeline', {}))
+    config_dir = os.path.dirname(os.path.abspath(file_name))
+    settings['output_dir'] = os.path.join(config_dir, settings['output_dir'])
+
+    regions = []
+    for i, region in enumerate(config.get('regions', [])):
+        region = dict(region)
+        region.setdefault('name', 'region_{}'.format(i + 1))
+        region['dir'] = os.path.join(config_dir, region.get('dir', '.'))
+        if region.get('output_dir') is not None:
+            region['output_dir'] = os.path.join(config_dir, region['output_dir'])
+        region.setdefault('pars_dir', '.')
+        region.setdefault('stars', [])
+        for key in _PATH_KEYS:
+            if region.get(key) is not None:
+                region[key] = os.path.normpath(os.path.join(region['dir'], region[key]))
+        regions.append(region)
+
+    names = [region['name'] for region in regions]
+    if len(set(names)) < len(names):
+        raise ValueError('Region names must be unique, found {}'.format(names))
+
+    return {'settings': settings, 'regions': regions}
+
+def write_final_models_csv(final_df, file_name):
+    """
+    Writes the scalar columns of the `final_model_select` output (the per-fit arrays do not fit in a csv file).
+    """
+    scalar_cols = [col for col in final_df.columns if len(final_df) == 0 or not isinstance(final_df[col].iloc[0], np.ndarray)]
+    final_df[scalar_cols].to_csv(file_name, index=False)
+
+def _run_stage(stage_name, region, settings, workers, region_dir):
+    """
+    Runs one stage of one region. Returns a short description of what was done, or None if the region
+    config does not have the inputs of the stage.
+    """
+    model_types = tuple(settings['model_types'])
+
+    if stage_name == 'data_files':
+        from data_pipeline_v3 import flag_txt_file_IR, flag_txt_file_Gaia
+
+        done = []
+        if region.get('spicy_csv') and region.get('data_file_name'):
+            flag_txt_file_IR(region['spicy_csv'], region['data_file_name'], incremental=settings['incremental'])
+            done.append(os.path.basename(region['data_file_name']))
+        if region.get('ugos_24um_file_name') and region.get('spicy_gaia_match_csv_name') and region.get('gaia_data_file_name'):
+            flag_txt_file_Gaia(region['ugos_24um_file_name'], region['spicy_gaia_match_csv_name'],
+                               region['gaia_data_file_name'], incremental=settings['incremental'])
+            done.append(os.path.basename(region['gaia_data_file_name']))
+        return ', '.join(done) or None
+
+    if stage_name == 'region_plots':
+        from analysis_functions_v2 import render_region_plots
+
+        filenames, timings = render_region_plots(model_types, workers=workers, output_dir=region_dir,
+                                                 pars_dir=region['pars_dir'], dpi=settings['dpi'],
+                                                 density=settings['density'], weighted=settings['weighted'],
+                                                 bins=settings['bins'])
+        return '{} figures'.format(len(filenames))
+
+    if stage_name == 'single_star_plots':
+        if not region['stars']:
+            return None
+        from analysis_functions_v2 import render_all_single_star_plots
+
+        filenames = render_all_single_star_plots(region['stars'], model_types, workers=workers,
+                                                 output_dir=os.path.join(region_dir, 'stars'),
+                                                 pars_dir=region['pars_dir'], dpi=settings['dpi'])
+        return '{} figures'.format(len(filenames))
+
+    if stage_name == 'statistics':
+        from ecdf_stats_v1 import load_samples, compare_samples
+
+        pairs = [tuple(pair) for pair in settings['pairs'] if all(model_type in model_types for model_type in pair)]
+        ks_df = compare_samples(load_samples(model_types, pars_dir=region['pars_dir']), pairs=pairs,
+                                n_permutations=settings['n_permutations'], workers=workers, seed=settings['seed'])
+        ks_df.to_csv(os.path.join(region_dir, 'ks_tests.csv'), index=False)
+        return '{} tests'.format(len(ks_df))
+
+    if stage_name == 'model_selection':
+        if not (region.get('master_list_IR') and region.get('master_list_gaia') and region.get('cdp') is not None):
+            return None
+        from model_selection_v1 import final_model_select
+
+        final_df = final_model_select(region['master_list_IR'], region['master_list_gaia'], region['cdp'],
+                                      pars_dir=region['pars_dir'],
+                                      region_file_name=os.path.join(region_dir, 'whole_region_circles.reg'))
+        write_final_models_csv(final_df, os.path.join(region_dir, 'final_models.csv'))
+        return '{} sources'.format(len(final_df))
+
+    if stage_name == 'exports':
+        final_name = os.path.join(region_dir, 'final_models.csv')
+        if not os.path.exists(final_name):
+            return None
+        from region_export_v1 import write_ds9_regions, write_moc
+
+        final_df = pd.read_csv(final_name)
+        n_regions = write_ds9_regions(final_df, os.path.join(region_dir, 'whole_region_circles.reg'))
+        extension = '.json' if settings['moc_format'] == 'json' else '.fits'
+        write_moc(final_df, os.path.join(region_dir, 'coverage_moc' + extension), order=settings['moc_order'])
+        return '{} DS9 regions and a MOC'.format(n_regions)
+
+    raise ValueError('Unknown stage {}, expected one of {}'.format(stage_name, PIPELINE_STAGES))
+
+def run_region(region, stages, settings, workers=None):
+    """
+    Runs the selected stages of one region, in `PIPELINE_STAGES` order. Outputs are written to
+    `<output_dir>/<region name>`. The data file writers are run in the region's 'dir', as in recipe 2.
+
+    Returns:
+        list of dict: One record per stage with 'region', 'stage', 'status' ('done', 'skipped' when the
+                      region has no inputs for it, or 'failed'), 'seconds' and 'message'.
+    """
+    region_settings = dict(settings)
+    region_settings.update({key: region[key] for key in DEFAULT_SETTINGS if key in region})
+    region_dir = os.path.join(region_settings['output_dir'], region['name'])
+    os.makedirs(region_dir, exist_ok=True)
+
+    records = []
+    for stage_name in [name for name in PIPELINE_STAGES if name in stages]:
+        start = time.perf_counter()
+        cwd = os.getcwd()
+        try:
+            os.chdir(region['dir'])
+            message = _run_stage(stage_name, region, region_settings, workers, region_dir)
+            status = 'skipped' if message is None else 'done'
+        except Exception as error:
+            message = '{}: {}'.format(type(error).__name__, error)
+            status = 'failed'
+            traceback.print_exc()
+        finally:
+            os.chdir(cwd)
+        records.append({'region': region['name'], 'stage': stage_name, 'status': status,
+                        'seconds': round(time.perf_counter() - start, 3), 'message': message or ''})
+        print('[{}] {}: {} {}'.format(region['name'], stage_name, status, message or ''))
+        if status == 'failed':
+            break #Later stages depend on the earlier ones
+
+    return records
+
+def _run_region_task(task):
+    region, stages, settings = task
+    return run_region(region, stages, settings, workers=1)
+
+def run_pipeline(config, stages=PIPELINE_STAGES, workers=None, regions=None):
+    """
+    Runs the pipeline for every region of a config from `load_config`.
+
+    With several regions and more than one worker, regions are processed in parallel, one worker process
+    per region at a time. With a single region, the worker processes are used inside the stages instead
+    (figure rendering and permutation tests).
+
+    Args:
+        config (dict): Config from `load_config`.
+        stages (tuple of str): Stages to run, from `PIPELINE_STAGES`.
+        workers (int or None): Number of worker processes. None uses the config setting, or every core.
+        regions (list of str or None): Names of the regions to run. None runs every region.
+
+    Returns:
+        pd.DataFrame: One row per region and stage with 'region', 'stage', 'status', 'seconds' and 'message'.
+                      Also written to `run_summary.csv` in the output directory.
+    """
+    settings = config['settings']
+    workers = workers or settings['workers'] or os.cpu_count()
+    region_list = [region for region in config['regions'] if regions is None or region['name'] in regions]
+    os.makedirs(settings['output_dir'], exist_ok=True)
+
+    if len(region_list) > 1 and workers > 1:
+        tasks = [(region, tuple(stages), settings) for region in region_list]
+        with multiprocessing.Pool(min(workers, len(region_list))) as pool:
+            results = pool.map(_run_region_task, tasks, chunksize=1)
+    else:
+        results = [run_region(region, stages, settings, workers) for region in region_list]
+
+    summary = pd.DataFrame([record for records in results for record in records],
+                           columns=['region', 'stage', 'status', 'seconds', 'message'])
+    summary.to_csv(os.path.join(settings['output_dir'], 'run_summary.csv'), index=False)
+    return summary
+
+def _stage_list(text):
+    stages = [name.strip() for name in text.split(',') if name.strip()]
+    unknown = [name for name in stages if name not in PIPELINE_STAGES]
+    if unknown:
+        raise argparse.ArgumentTypeError('unknown stage(s) {}, choose from {}'.format(', '.join(unknown), ', '.join(PIPELINE_STAGES)))
+    return stages
+
+def main(argv=None):
+    """
+    Command line entry point: `python pipeline_cli_v1.py config.toml [--workers N] [--only ...] [--skip ...]`.
+    Returns the exit status (1 if any stage failed).
+    """
+    parser = argparse.ArgumentParser(prog='yso-pipeline',
+                                     description='Run the YSO SED fitting data and analysis pipeline for the regions of a config file.')
+    parser.add_argument('config', nargs='?', help='TOML, YAML or JSON config file')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: config setting, or every core)')
+    parser.add_argument('--only', type=_stage_list, default=None, help='comma separated stages to run')
+    parser.add_argument('--skip', type=_stage_list, default=[], help='comma separated stages to skip')
+    parser.add_argument('--regions', default=None, help='comma separated names of the regions to run')
+    parser.add_argument('--log', default=None, help='JSON-lines file for the per-stage timing and memory records')
+    parser.add_argument('--list-stages', action='store_true', help='print the stages and exit')
+    args = parser.parse_args(argv)
+
+    if args.list_stages:
+        print('\n'.join(PIPELINE_STAGES))
+        return 0
+    if args.config is None:
+        parser.error('the config file is required')
+
+    stages = [name for name in (args.only or PIPELINE_STAGES) if name not in args.skip]
+    config = load_config(args.config)
+    regions = args.regions.split(',') if args.regions else None
+
+    if args.log:
+        from instrumentation_v1 import enable_instrumentation, disable_instrumentation
+        enable_instrumentation(os.path.abspath(args.log))
+
+    summary = run_pipeline(config, stages, workers=args.workers, regions=regions)
+
+    if args.log:
+        disable_instrumentation()
+    print(summary.to_string(index=False))
+    return int((summary['status'] == 'failed').any())
+
+if __name__ == '__main__':
+    sys.exit(main())
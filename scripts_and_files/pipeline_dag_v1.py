@@ -0,0 +1,399 @@
+import os
+import sys
+import json
+import time
+import shutil
+import inspect
+import argparse
+import pandas as pd
+from extractor_pipeline_v6 import read_extracted_file
+from analysis_functions_v2 import MODEL_SET_NAMES, render_region_figure, save_region_figure, draw_region
+from model_selection_v1 import calc_p_dm_df, model_tree, read_master_list, prioritize_gaia
+from data_pipeline_v3 import flag_txt_file_IR, flag_txt_file_Gaia
+from region_export_v1 import write_ds9_regions, write_moc
+from report_builder_v1 import content_digest, file_digest
+from instrumentation_v1 import stage
+from pipeline_cli_v1 import load_config, write_final_models_csv
+from fit_tables_v1 import HAVE_PYARROW, write_fit_table, read_fit_table
+
+#File written in every cache entry once its node has run, and in every node directory for its latest entry
+ENTRY_FILE = 'node.json'
+LAST_FILE = 'last.json'
+
+#Format of the cached tables: Arrow files (memory mapped when read) if pyarrow is installed, pickles otherwise
+TABLE_EXT = '.arrow' if HAVE_PYARROW else '.pkl'
+
+def make_node(name, function, inputs=(), files=(), params=None, outputs=(), code=(), publish=()):
+    """
+    Declares one node of a pipeline DAG for `run_dag`.
+
+    Args:
+        name (str): Unique name of the node.
+        function (callable): Called as `function(inputs, files, params, out_dir)` and must write every file of
+                             `outputs` into `out_dir`. `inputs` maps the name of each input node to a dict of
+                             its output file paths, see `load_input`.
+        inputs (tuple of str): Names of the nodes whose outputs this node reads.
+        files (tuple of str): External files this node reads (raw catalogs, pars files, ...). They are hashed
+                              by content.
+        params (dict or None): Parameters of the node. Must have a stable repr (numbers, strings, lists).
+        outputs (tuple of str): Names of the files the node writes.
+        code (tuple of callable): Library functions the node relies on. Their source is hashed together with
+                                  `function`, so editing them reruns the node.
+        publish (tuple of str): Outputs copied to the `output_dir` of `run_dag`.
+
+    Returns:
+        dict: The node.
+    """
+    return {'name': name, 'function': function, 'inputs': tuple(inputs), 'files': tuple(files),
+            'params': dict(params or {}), 'outputs': tuple(outputs), 'code': tuple(code), 'publish': tuple(publish)}
+
+def _code_digest(functions):
+    """
+    SHA-256 of the source code of functions (decorated functions are hashed through the function they wrap).
+    """
+    sources = []
+    for function in functions:
+        try:
+            sources.append(inspect.getsource(inspect.unwrap(function)))
+        except (OSError, TypeError): #Built-in or defined interactively
+            sources.append(getattr(function, '__qualname__', repr(function)))
+    return content_digest(*sources)
+
+def _topological_order(nodes):
+    """
+    Node names ordered so every node comes after its inputs. Raises ValueError for unknown inputs and cycles.
+    """
+    order = []
+    state = {} #1 while visiting, 2 once done
+
+    def visit(name, path):
+        if state.get(name) == 2:
+            return
+        if state.get(name) == 1:
+            raise ValueError('Cycle in the pipeline: {}'.format(' -> '.join(path + [name])))
+        state[name] = 1
+        for input_name in nodes[name]['inputs']:
+            if input_name not in nodes:
+                raise ValueError('Node {} reads unknown node {}'.format(name, input_name))
+            visit(input_name, path + [name])
+        state[name] = 2
+        order.append(name)
+
+    for name in nodes:
+        visit(name, [])
+    return order
+
+def load_input(inputs, node_name, output=None):
+    """
+    Reads one output of an input node inside a node function: '.arrow' and '.parquet' files as fit tables,
+    '.pkl' files as pickled DataFrames, '.csv' files as DataFrames, anything else is returned as its path.
+    `output` can be left out for nodes with one output.
+    """
+    paths = inputs[node_name]
+    path = paths[output] if output is not None else next(iter(paths.values()))
+    if path.endswith(('.arrow', '.parquet')):
+        return read_fit_table(path)
+    if path.endswith('.pkl'):
+        return pd.read_pickle(path)
+    if path.endswith('.csv'):
+        return pd.read_csv(path)
+    return path
+
+def run_dag(nodes, cache_dir='pipeline_cache', output_dir=None, targets=None, dry_run=False, force=False):
+    """
+    Runs a pipeline DAG, only executing the nodes whose inputs, parameters or code changed since they last ran.
+
+    Every node gets a key: the hash of its code (`function` and `code`), parameters, external file contents and
+    the keys of its input nodes, so a change anywhere upstream changes the keys of everything downstream. The
+    outputs of a node are cached in `<cache_dir>/<node name>/<key>/`, and a node whose entry already exists is
+    not run again. Old entries stay in the cache, so going back to earlier parameters is free too (use
+    `prune_cache` to delete them).
+
+    Args:
+        nodes (list of dict): Nodes from `make_node`, in any order.
+        cache_dir (str): Directory of the cached outputs.
+        output_dir (str or None): Directory the `publish` outputs of the nodes are copied to. None copies nothing.
+        targets (list of str or None): Nodes to bring up to date, with everything they depend on. None runs
+                                       every node.
+        dry_run (bool): Only report what would run, and why, without running anything.
+        force (bool or list of str): Rerun every node (True), or the named nodes, even if cached.
+
+    Returns:
+        pandas.DataFrame: One row per node in run order, with 'node', 'key' (first 12 characters), 'status'
+                          ('cached', 'run', 'would run' or 'failed'), 'reason' (what changed since the last
+                          run of the node: 'code', 'params', 'files', 'inputs', 'new' or 'forced') and 'seconds'.
+    """
+    nodes = {node['name']: node for node in nodes}
+    order = _topological_order(nodes)
+
+    if targets is not None:
+        needed = set()
+        stack = list(targets)
+        while stack:
+            name = stack.pop()
+            if name not in nodes:
+                raise ValueError('Unknown target node {}'.format(name))
+            if name not in needed:
+                needed.add(name)
+                stack.extend(nodes[name]['inputs'])
+        order = [name for name in order if name in needed]
+
+    keys = {}
+    records = []
+    for name in order:
+        node = nodes[name]
+        parts = {'code': _code_digest((node['function'],) + node['code']),
+                 'params': content_digest(sorted(node['params'].items())),
+                 'files': content_digest(*[file_digest(file_name) for file_name in node['files']]),
+                 'inputs': content_digest(*[keys[input_name] for input_name in node['inputs']])}
+        keys[name] = content_digest(name, node['outputs'], *[parts[part] for part in sorted(parts)])
+
+        node_dir = os.path.join(cache_dir, name)
+        entry_dir = os.path.join(node_dir, keys[name])
+        cached = os.path.exists(os.path.join(entry_dir, ENTRY_FILE)) and \
+            all(os.path.exists(os.path.join(entry_dir, output)) for output in node['outputs'])
+        forced = force is True or name in (force or ())
+
+        #Explain a rerun by comparing with the last entry of the node
+        reason = ''
+        if forced:
+            reason = 'forced'
+        elif not cached:
+            last = {}
+            if os.path.exists(os.path.join(node_dir, LAST_FILE)):
+                with open(os.path.join(node_dir, LAST_FILE)) as last_file:
+                    last = json.load(last_file)
+            changed = [part for part in ('code', 'params', 'files', 'inputs') if last.get('digests', {}).get(part) != parts[part]]
+            reason = ', '.join(changed) if last and changed else 'new'
+
+        record = {'node': name, 'key': keys[name][:12], 'status': 'cached', 'reason': reason, 'seconds': 0.}
+        records.append(record)
+        if not cached or forced:
+            if dry_run:
+                record['status'] = 'would run'
+                print('would run  {} ({})'.format(name, reason))
+                continue
+
+            #Written to a temporary directory first, so an interrupted node never looks cached
+            tmp_dir = entry_dir + '.tmp{}'.format(os.getpid())
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            inputs = {input_name: {output: os.path.join(cache_dir, input_name, keys[input_name], output)
+                                   for output in nodes[input_name]['outputs']} for input_name in node['inputs']}
+            start = time.perf_counter()
+            try:
+                with stage('dag.' + name, files=len(node['outputs'])):
+                    node['function'](inputs, list(node['files']), dict(node['params']), tmp_dir)
+                missing = [output for output in node['outputs'] if not os.path.exists(os.path.join(tmp_dir, output))]
+                if missing:
+                    raise RuntimeError('Node {} did not write {}'.format(name, ', '.join(missing)))
+            except Exception:
+                record['status'] = 'failed'
+                record['seconds'] = round(time.perf_counter() - start, 3)
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                print('failed     {}'.format(name))
+                raise
+            record['status'] = 'run'
+            record['seconds'] = round(time.perf_counter() - start, 3)
+
+            entry = {'node': name, 'key': keys[name], 'digests': parts, 'params': node['params'], 'inputs': list(node['inputs']),
+                     'files': list(node['files']), 'seconds': record['seconds'], 'date': time.strftime('%Y-%m-%dT%H:%M:%S')}
+            with open(os.path.join(tmp_dir, ENTRY_FILE), 'w') as entry_file:
+                json.dump(entry, entry_file, indent=1, default=str)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(tmp_dir, entry_dir)
+            with open(os.path.join(node_dir, LAST_FILE), 'w') as last_file:
+                json.dump(entry, last_file, indent=1, default=str)
+            print('ran        {} ({}, {:.2f} s)'.format(name, reason, record['seconds']))
+
+        if output_dir is not None and not dry_run:
+            os.makedirs(output_dir, exist_ok=True)
+            for output in node['publish']:
+                shutil.copy2(os.path.join(entry_dir, output), os.path.join(output_dir, output))
+
+    records = pd.DataFrame(records, columns=['node', 'key', 'status', 'reason', 'seconds'])
+    print('{} of {} nodes {}, the others cached'.format((records['status'] != 'cached').sum(), len(records),
+                                                         'would run' if dry_run else 'run'))
+    return records
+
+def prune_cache(cache_dir='pipeline_cache'):
+    """
+    Deletes every cache entry except the latest one of each node.
+
+    Returns:
+        int: Number of entries deleted.
+    """
+    n_deleted = 0
+    for name in sorted(os.listdir(cache_dir)) if os.path.isdir(cache_dir) else []:
+        node_dir = os.path.join(cache_dir, name)
+        if not os.path.exists(os.path.join(node_dir, LAST_FILE)):
+            continue
+        with open(os.path.join(node_dir, LAST_FILE)) as last_file:
+            last_key = json.load(last_file)['key']
+        for key in os.listdir(node_dir):
+            if key != last_key and os.path.isdir(os.path.join(node_dir, key)):
+                shutil.rmtree(os.path.join(node_dir, key))
+                n_deleted += 1
+    return n_deleted
+
+def _save_table(df, out_dir, name):
+    """
+    Writes a table output of a node in the `TABLE_EXT` format.
+    """
+    if TABLE_EXT == '.pkl':
+        df.to_pickle(os.path.join(out_dir, name + TABLE_EXT))
+    else:
+        write_fit_table(df, os.path.join(out_dir, name + TABLE_EXT))
+
+#Node functions of `region_dag`, all called as function(inputs, files, params, out_dir)
+
+def _node_data_file_IR(inputs, files, params, out_dir):
+    flag_txt_file_IR(files[0], os.path.join(out_dir, params['data_file_name']))
+
+def _node_data_file_Gaia(inputs, files, params, out_dir):
+    flag_txt_file_Gaia(files[0], files[1], os.path.join(out_dir, params['data_file_name']))
+
+def _node_parse(inputs, files, params, out_dir):
+    _save_table(read_extracted_file(files[0]), out_dir, 'parsed')
+
+def _node_p_dm(inputs, files, params, out_dir):
+    (parsed_name,) = inputs
+    df_pdm = calc_p_dm_df(load_input(inputs, parsed_name), params['cdp'], params['model_type'])
+    df_pdm['Model_Flag'] = params['model_type']
+    _save_table(df_pdm, out_dir, 'p_dm')
+
+def _node_tree(inputs, files, params, out_dir):
+    _save_table(model_tree(*[load_input(inputs, name) for name in inputs], read_master_list(files[0])), out_dir, 'tree')
+
+def _node_final(inputs, files, params, out_dir):
+    final_df = prioritize_gaia(load_input(inputs, 'tree_IR'), load_input(inputs, 'tree_Gaia'), read_master_list(files[0]))
+    _save_table(final_df, out_dir, 'final_models')
+    write_final_models_csv(final_df, os.path.join(out_dir, 'final_models.csv'))
+
+def _node_sky_regions(inputs, files, params, out_dir):
+    final_df = load_input(inputs, 'final', 'final_models' + TABLE_EXT)
+    write_ds9_regions(final_df, os.path.join(out_dir, 'whole_region_circles.reg'))
+    write_moc(final_df, os.path.join(out_dir, 'coverage_moc.fits'), order=params['moc_order'])
+
+def _node_region_figure(inputs, files, params, out_dir):
+    ir_name, gaia_name = inputs
+    render_region_figure(params['model_type'], load_input(inputs, ir_name), load_input(inputs, gaia_name), out_dir,
+                         dpi=params['dpi'], density=params['density'], weighted=params['weighted'], bins=params['bins'])
+
+def region_dag(region, model_types=(1, 2, 16, 17), dpi=150, density=False, weighted=False, bins=200, moc_order=10):
+    """
+    Nodes of the pipeline of one region for `run_dag`:
+
+        catalog CSVs -> data files -> (SED fitter, run outside) -> parsed pars files -> P_DM -> model trees
+        -> final selection -> DS9 regions and MOC
+        parsed pars files -> region figures
+
+    The fitter is not part of the DAG: the pars files are external inputs hashed by content, so refitting a
+    region reruns everything downstream of the changed files only. Changing `cdp` reruns P_DM and below
+    without parsing again, and changing the figure options or plotting code only redraws the figures.
+
+    Args:
+        region (dict): Region with the keys of a `pipeline_cli_v1.py` config region ('pars_dir', 'spicy_csv',
+                       'data_file_name', 'ugos_24um_file_name', 'spicy_gaia_match_csv_name',
+                       'gaia_data_file_name', 'master_list_IR', 'master_list_gaia', 'cdp'). Nodes whose inputs
+                       are not given are left out.
+        model_types (tuple of int): Model sets to parse and draw. The selection needs all four.
+        dpi, density, weighted, bins: Figure options, see `render_region_plots`.
+        moc_order (int): HEALPix order of the MOC, see `write_moc`.
+
+    Returns:
+        list of dict: The nodes.
+    """
+    nodes = []
+    pars_dir = region.get('pars_dir', '.')
+
+    if region.get('spicy_csv') and region.get('data_file_name'):
+        data_file_name = os.path.basename(region['data_file_name'])
+        nodes.append(make_node('data_file_IR', _node_data_file_IR, files=[region['spicy_csv']],
+                               params={'data_file_name': data_file_name}, outputs=[data_file_name],
+                               code=[flag_txt_file_IR], publish=[data_file_name]))
+    if region.get('ugos_24um_file_name') and region.get('spicy_gaia_match_csv_name') and region.get('gaia_data_file_name'):
+        data_file_name = os.path.basename(region['gaia_data_file_name'])
+        nodes.append(make_node('data_file_Gaia', _node_data_file_Gaia,
+                               files=[region['ugos_24um_file_name'], region['spicy_gaia_match_csv_name']],
+                               params={'data_file_name': data_file_name}, outputs=[data_file_name],
+                               code=[flag_txt_file_Gaia], publish=[data_file_name]))
+
+    for model_type in model_types:
+        for data_type in ['IR', 'Gaia']:
+            pars_name = os.path.join(pars_dir, 'pars_{:02d}g04_{}.txt'.format(model_type, data_type))
+            nodes.append(make_node('parsed_{:02d}_{}'.format(model_type, data_type), _node_parse, files=[pars_name],
+                                   outputs=['parsed' + TABLE_EXT], code=[read_extracted_file]))
+
+        figure_name = MODEL_SET_NAMES[model_type] + '_region.png'
+        nodes.append(make_node('figure_{:02d}'.format(model_type), _node_region_figure,
+                               inputs=['parsed_{:02d}_IR'.format(model_type), 'parsed_{:02d}_Gaia'.format(model_type)],
+                               params={'model_type': model_type, 'dpi': dpi, 'density': density, 'weighted': weighted,
+                                       'bins': bins},
+                               outputs=[figure_name], code=[render_region_figure, save_region_figure, draw_region],
+                               publish=[figure_name]))
+
+    selection = region.get('master_list_IR') and region.get('master_list_gaia') and region.get('cdp') is not None
+    if selection and sorted(model_types) == [1, 2, 16, 17]:
+        for data_type, master_list in [('IR', region['master_list_IR']), ('Gaia', region['master_list_gaia'])]:
+            for model_type in [1, 2, 16, 17]:
+                nodes.append(make_node('p_dm_{:02d}_{}'.format(model_type, data_type), _node_p_dm,
+                                       inputs=['parsed_{:02d}_{}'.format(model_type, data_type)],
+                                       params={'cdp': region['cdp'], 'model_type': model_type},
+                                       outputs=['p_dm' + TABLE_EXT], code=[calc_p_dm_df]))
+            nodes.append(make_node('tree_' + data_type, _node_tree,
+                                   inputs=['p_dm_{:02d}_{}'.format(model_type, data_type) for model_type in [1, 2, 16, 17]],
+                                   files=[master_list], outputs=['tree' + TABLE_EXT], code=[model_tree, read_master_list]))
+
+        nodes.append(make_node('final', _node_final, inputs=['tree_IR', 'tree_Gaia'], files=[region['master_list_IR']],
+                               outputs=['final_models' + TABLE_EXT, 'final_models.csv'],
+                               code=[prioritize_gaia, read_master_list], publish=['final_models.csv']))
+        nodes.append(make_node('sky_regions', _node_sky_regions, inputs=['final'], params={'moc_order': moc_order},
+                               outputs=['whole_region_circles.reg', 'coverage_moc.fits'],
+                               code=[write_ds9_regions, write_moc], publish=['whole_region_circles.reg', 'coverage_moc.fits']))
+
+    return nodes
+
+def main(argv=None):
+    """
+    Command line entry point: `python pipeline_dag_v1.py config.toml [--dry-run] [--force] [--targets ...]`, with
+    the config file of `pipeline_cli_v1.py`. Each region is cached in `<cache_dir>/<region name>`.
+    """
+    parser = argparse.ArgumentParser(description='Run the cached pipeline DAG of the regions of a config file.')
+    parser.add_argument('config', help='TOML, YAML or JSON config file')
+    parser.add_argument('--cache-dir', default=None, help='cache directory (default: <output_dir>/cache)')
+    parser.add_argument('--dry-run', action='store_true', help='show what would run, and why, without running it')
+    parser.add_argument('--force', default=None, help='comma separated nodes to rerun, or "all"')
+    parser.add_argument('--targets', default=None, help='comma separated nodes to bring up to date (default: all)')
+    parser.add_argument('--regions', default=None, help='comma separated names of the regions to run')
+    parser.add_argument('--prune', action='store_true', help='delete all but the latest cache entry of every node')
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    settings = config['settings']
+    cache_dir = os.path.abspath(args.cache_dir or os.path.join(settings['output_dir'], 'cache')) #The regions are run in their own 'dir'
+    force = args.force == 'all' or (args.force.split(',') if args.force else False)
+    targets = args.targets.split(',') if args.targets else None
+
+    for region in config['regions']:
+        if args.regions and region['name'] not in args.regions.split(','):
+            continue
+        options = dict(settings)
+        options.update(region)
+        print('Region {}:'.format(region['name']))
+        nodes = region_dag(region, tuple(options['model_types']), dpi=options['dpi'], density=options['density'],
+                           weighted=options['weighted'], bins=options['bins'], moc_order=options['moc_order'])
+        cwd = os.getcwd()
+        try:
+            os.chdir(region['dir'])
+            run_dag(nodes, os.path.join(cache_dir, region['name']), os.path.join(options['output_dir'], region['name']),
+                    targets=targets, dry_run=args.dry_run, force=force)
+        finally:
+            os.chdir(cwd)
+        if args.prune:
+            print('Deleted {} old cache entries'.format(prune_cache(os.path.join(cache_dir, region['name']))))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,203 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from numpy.lib.format import open_memmap
+from extractor_pipeline_v6 import flat_fit_table, chi2_weights
+from analysis_functions_v2 import MODEL_SET_NAMES, load_model_set
+
+#Planes of the maps, with the same axis limits as the single-star figures. Values are the pars file column
+#and whether its log10 is binned
+MAP_GRIDS = {'hr': {'x': ('star_temp_arr', True), 'y': ('lum_arr', True), 'x_range': (3.5, 4.3), 'y_range': (-0.5, 4.)},
+             'av': {'x': ('star_temp_arr', True), 'y': ('av_arr', False), 'x_range': (3.5, 4.3), 'y_range': (-0.5, 20.)}}
+
+#Number of (x, y) bins of every map
+DEFAULT_BINS = (64, 64)
+
+#File names used inside the maps directory
+GRID_FILE = 'grid.json'
+INDEX_FILE = 'index.csv'
+
+#Maximum number of histogram cells held in memory at once while computing the maps
+_CHUNK_CELLS = 2**23
+
+def map_edges(grid_name, bins=DEFAULT_BINS):
+    """
+    Bin edges of one map plane, e.g. map_edges('hr') -> (log T_eff edges, log L edges).
+    """
+    grid = MAP_GRIDS[grid_name]
+    return np.linspace(*grid['x_range'], bins[0] + 1), np.linspace(*grid['y_range'], bins[1] + 1)
+
+def map_file_name(model_type, data_type):
+    """
+    Name of the maps file of one pars file, e.g. (1, 'IR') -> 'maps_01g04_IR.npy'.
+    """
+    return 'maps_{:02d}g04_{}.npy'.format(model_type, data_type)
+
+def _bin_index(values, value_range, n_bins):
+    """
+    Bin of every value on a uniform grid, -1 outside of it. The upper edge belongs to the last bin, as in
+    `np.histogram2d`.
+    """
+    low, high = value_range
+    with np.errstate(invalid='ignore'):
+        index = np.floor((values - low) * (n_bins / (high - low)))
+    index = np.where(values == high, n_bins - 1, index)
+    inside = (index >= 0) & (index < n_bins)
+    return np.where(inside, index, -1).astype(np.int64)
+
+def compute_posterior_maps(df, maps=tuple(MAP_GRIDS), bins=DEFAULT_BINS, out=None):
+    """
+    Chi-squared weighted 2D histograms of the model fits of every star, for all stars in one pass.
+
+    The fits of all stars are flattened with `flat_fit_table` and weighted with `chi2_weights` (the same
+    weights as `weight_mean`). Every fit is then given one cell number, star * n_cells + cell, so a single
+    `np.bincount` fills the maps of a whole block of stars at once. Fits outside a map's limits are left out,
+    so the maps of a star sum to the fraction of its weight inside the grid.
+
+    Args:
+        df (pandas.DataFrame): DataFrame from `read_extracted_file`, with at least the 'chi_2_arr' column and
+                               the columns used by `maps`.
+        maps (tuple of str): Planes to compute, keys of `MAP_GRIDS`.
+        bins (tuple of int): Number of (x, y) bins.
+        out (np.ndarray or None): Array of shape (n_stars, n_maps, y bins, x bins) to fill, e.g. a memory
+                                  mapped file. None creates a new float32 array.
+
+    Returns:
+        np.ndarray: The maps, indexed as [star, map, y bin, x bin] (the layout `imshow` expects).
+    """
+    df = df.reset_index(drop=True)
+    n_stars = len(df)
+    n_x, n_y = bins
+    n_cells = n_x * n_y
+
+    if out is None:
+        out = np.zeros((n_stars, len(maps), n_y, n_x), dtype=np.float32)
+
+    columns = list(dict.fromkeys(['chi_2_arr'] + [MAP_GRIDS[name][axis][0] for name in maps for axis in ('x', 'y')]))
+    star_index, flat = flat_fit_table(df, columns)
+    weights = chi2_weights(flat['chi_2_arr'], star_index, n_stars)
+
+    #Fits are grouped by star, so every block of stars is a contiguous slice of the flat arrays
+    stars_per_chunk = max(1, _CHUNK_CELLS // n_cells)
+    starts = np.searchsorted(star_index, np.arange(0, n_stars + stars_per_chunk, stars_per_chunk))
+
+    for i, name in enumerate(maps):
+        grid = MAP_GRIDS[name]
+        xy = {}
+        for axis in ('x', 'y'):
+            col_name, log_scale = grid[axis]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                values = np.log10(flat[col_name]) if log_scale else flat[col_name]
+            xy[axis] = _bin_index(values, grid[axis + '_range'], bins[axis == 'y'])
+
+        inside = (xy['x'] >= 0) & (xy['y'] >= 0)
+        cell = np.where(inside, star_index * n_cells + xy['y'] * n_x + xy['x'], -1)
+
+        for chunk, first_star in enumerate(range(0, n_stars, stars_per_chunk)):
+            n_chunk = min(stars_per_chunk, n_stars - first_star)
+            fits = slice(starts[chunk], starts[chunk + 1])
+            keep = inside[fits]
+            hist = np.bincount(cell[fits][keep] - first_star * n_cells, weights=weights[fits][keep],
+                               minlength=n_chunk * n_cells)
+            out[first_star:first_star + n_chunk, i] = hist.reshape(n_chunk, n_y, n_x)
+
+    return out
+
+def build_posterior_maps(model_types=(1, 2, 16, 17), output_dir='posterior_maps', pars_dir='.', maps=tuple(MAP_GRIDS),
+                         bins=DEFAULT_BINS, data_types=('IR', 'Gaia')):
+    """
+    Computes the posterior maps of every star of every model set and saves them, so that later plots,
+    stacks and comparisons can load them instead of parsing the pars files again.
+
+    Each pars file gets one float32 `.npy` file of shape (n_stars, n_maps, y bins, x bins), written in blocks
+    through a memory map so the full array is never held in memory. The stars of every file are listed in
+    `index.csv`, and the planes and bin edges in `grid.json`.
+
+    Args:
+        model_types (tuple of int): Model sets to process (any of 1, 2, 16, 17).
+        output_dir (str): Directory the maps are written to. Created if it does not exist.
+        pars_dir (str): Directory containing the pars files.
+        maps (tuple of str): Planes to compute, keys of `MAP_GRIDS`.
+        bins (tuple of int): Number of (x, y) bins.
+        data_types (tuple of str): 'IR' and/or 'Gaia'.
+
+    Returns:
+        pandas.DataFrame: The index, with one row per star and pars file and the columns 'model_set',
+                          'data_type', 'row' (position in that file's maps), 'MIR_NAME', 'n_data', 'n_fits'
+                          and 'in_grid_<map>' (weight of the star inside each map).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    index = []
+    for model_type in model_types:
+        ir_df, gaia_df = load_model_set(model_type, pars_dir)
+        for data_type, df in [('IR', ir_df), ('Gaia', gaia_df)]:
+            if data_type not in data_types:
+                continue
+            out = open_memmap(os.path.join(output_dir, map_file_name(model_type, data_type)), mode='w+',
+                              dtype=np.float32, shape=(len(df), len(maps), bins[1], bins[0]))
+            compute_posterior_maps(df, maps, bins, out=out)
+
+            df_index = pd.DataFrame({'model_set': MODEL_SET_NAMES[model_type], 'data_type': data_type,
+                                     'row': np.arange(len(df)), 'MIR_NAME': df['MIR_NAME'].to_numpy(),
+                                     'n_data': df['n_data'].to_numpy(), 'n_fits': df['n_fits'].to_numpy()})
+            for i, name in enumerate(maps):
+                df_index['in_grid_' + name] = out[:, i].sum(axis=(1, 2), dtype=np.float64)
+            out.flush()
+            del out
+            index.append(df_index)
+
+    index = pd.concat(index, ignore_index=True)
+    index.to_csv(os.path.join(output_dir, INDEX_FILE), index=False)
+
+    grid = {'maps': list(maps), 'bins': list(bins),
+            'edges': {name: [edges.tolist() for edges in map_edges(name, bins)] for name in maps}}
+    with open(os.path.join(output_dir, GRID_FILE), 'w') as grid_file:
+        json.dump(grid, grid_file)
+
+    return index
+
+def load_posterior_maps(maps_dir, model_type, data_type):
+    """
+    Opens the maps of one pars file written by `build_posterior_maps`, without reading them into memory.
+
+    Returns:
+        tuple:
+            maps (np.memmap): Read-only maps indexed as [star, map, y bin, x bin].
+            index (pandas.DataFrame): The rows of `index.csv` for this file, in the same order as `maps`.
+            grid (dict): Planes ('maps'), numbers of bins ('bins') and bin edges ('edges') of the maps.
+    """
+    with open(os.path.join(maps_dir, GRID_FILE)) as grid_file:
+        grid = json.load(grid_file)
+
+    index = pd.read_csv(os.path.join(maps_dir, INDEX_FILE))
+    index = index[(index['model_set'] == MODEL_SET_NAMES[model_type]) & (index['data_type'] == data_type)]
+
+    maps = np.load(os.path.join(maps_dir, map_file_name(model_type, data_type)), mmap_mode='r')
+    return maps, index.reset_index(drop=True), grid
+
+def similar_stars(maps, k, map_name='hr', grid=None, n=10):
+    """
+    Stars whose posterior maps overlap the most with the map of star `k`, ranked by the Bhattacharyya
+    coefficient sum(sqrt(p * q)) (1 for identical maps, 0 for maps that do not overlap).
+
+    Args:
+        maps (np.ndarray): Maps from `load_posterior_maps` or `compute_posterior_maps`.
+        k (int): Row of the reference star.
+        map_name (str): Plane to compare.
+        grid (dict or None): Grid from `load_posterior_maps`. None assumes the planes are in `MAP_GRIDS` order.
+        n (int): Number of stars returned, not counting star `k` itself.
+
+    Returns:
+        tuple:
+            rows (np.ndarray of int): Rows of the most similar stars, best first.
+            coefficients (np.ndarray): Their Bhattacharyya coefficients.
+    """
+    i = (grid['maps'] if grid is not None else list(MAP_GRIDS)).index(map_name)
+    plane = np.sqrt(np.asarray(maps[:, i], dtype=np.float64).reshape(len(maps), -1))
+    coefficients = plane @ plane[k]
+    coefficients[k] = -np.inf
+
+    rows = np.argsort(-coefficients, kind='stable')[:n]
+    return rows, coefficients[rows]
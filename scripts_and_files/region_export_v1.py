@@ -0,0 +1,205 @@
+import json
+import numpy as np
+import pandas as pd
+
+#Header of the DS9 region files, exactly as written by earlier versions of `make_region_file`
+DS9_HEADER = '''# Region file format: DS9 version 4.1
+    global color=green dashlist=8 3 width=1 font="helvetica 10 normal roman" select=1 highlite=1 dash=0 fixed=0 edit=1 move=1 delete=1 include=1 source=1
+    galactic
+    '''
+
+#Circle shape written after the coordinates for each 'Type_Flag'. Sources with any other flag are not written
+DS9_STYLES = {'gaia': '10.000") # color=yellow width=4 tag={Gaia}\n',
+              'ir': '6.000") # color=red width=3 tag={IRonly}\n'}
+
+def lb_from_names(names):
+    """
+    Galactic coordinates of sources from their GLIMPSE names (e.g. 'G351.1234+00.5678'), for all names at once.
+    Longitude is taken from characters 1-8 and latitude from characters 9-16, the same as `make_region_file`
+    always did one name at a time.
+
+    Args:
+        names (array-like of str): Source names (`MIR_NAME`, without the 'SSTGLMC ' prefix).
+
+    Returns:
+        tuple:
+            l (np.ndarray): Galactic longitudes in degrees.
+            b (np.ndarray): Galactic latitudes in degrees.
+    """
+    names = pd.Series(np.asarray(names, dtype=str))
+    l = names.str.slice(1, 9).astype(float).to_numpy()
+    b = names.str.slice(9, 17).astype(float).to_numpy()
+    return l, b
+
+def _source_coordinates(df, l_col, b_col, name_col):
+    """
+    l and b of every row, read from the `l_col`/`b_col` columns if given, or parsed from the names otherwise.
+    """
+    if l_col is not None and b_col is not None:
+        return df[l_col].to_numpy(dtype=float), df[b_col].to_numpy(dtype=float)
+    return lb_from_names(df[name_col])
+
+def write_ds9_regions(df, file_name, flag_col='Type_Flag', l_col=None, b_col=None, name_col='MIR_NAME'):
+    """
+    Writes a DS9 region file with one circle per source: yellow 10" circles for sources fitted with Gaia data
+    and red 6" circles for IR-only sources. Every line is formatted in one pass over the coordinate arrays.
+
+    Args:
+        df (pd.DataFrame): Sources, e.g. the output of `final_model_select`.
+        file_name (str): Path of the region file to write.
+        flag_col (str): Column holding 'gaia' or 'ir' for each source.
+        l_col, b_col (str or None): Columns with galactic coordinates in degrees (e.g. 'l' and 'b' from the
+                                    SPICY catalog). If None, the coordinates are parsed from the names.
+        name_col (str): Column with the source names, used when `l_col` and `b_col` are not given.
+
+    Returns:
+        n_regions (int): Number of circles written.
+    """
+    l, b = _source_coordinates(df, l_col, b_col, name_col)
+    flags = df[flag_col].to_numpy()
+
+    keep = np.isin(flags, list(DS9_STYLES))
+    styles = [DS9_STYLES[flag] for flag in flags[keep]]
+    lines = [f'circle({l_i:.4f},{b_i:.4f},{style}' for l_i, b_i, style in zip(l[keep].tolist(), b[keep].tolist(), styles)]
+
+    with open(str(file_name), 'w') as region_file:
+        region_file.write(DS9_HEADER + ''.join(lines))
+
+    return len(lines)
+
+def _spread_bits(values):
+    """
+    Moves bit k of each integer to bit 2k, for interleaving HEALPix x/y pixel indices.
+    """
+    spread = values.astype(np.int64)
+    for shift, mask in [(16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)]:
+        spread = (spread | (spread << shift)) & mask
+    return spread
+
+def _healpix_nested(lon, lat, order):
+    """
+    NESTED HEALPix pixel index of positions given in degrees (Gorski et al. 2005). Used when astropy_healpix
+    is not installed.
+    """
+    nside = 2**order
+    z = np.sin(np.radians(lat))
+    za = np.abs(z)
+    tt = np.mod(np.radians(lon), 2 * np.pi) * (2 / np.pi) #in [0, 4)
+    tt = np.where(tt >= 4, 0., tt)
+
+    face = np.empty(len(z), dtype=np.int64)
+    ix = np.empty(len(z), dtype=np.int64)
+    iy = np.empty(len(z), dtype=np.int64)
+
+    #Equatorial region
+    eq = za <= 2. / 3.
+    temp1 = nside * (0.5 + tt[eq])
+    temp2 = nside * z[eq] * 0.75
+    jp = (temp1 - temp2).astype(np.int64) #index of ascending edge line
+    jm = (temp1 + temp2).astype(np.int64) #index of descending edge line
+    ifp = jp // nside
+    ifm = jm // nside
+    face[eq] = np.where(ifp == ifm, ifp | 4, np.where(ifp < ifm, ifp, ifm + 8))
+    ix[eq] = jm & (nside - 1)
+    iy[eq] = nside - (jp & (nside - 1)) - 1
+
+    #Polar caps
+    pol = ~eq
+    ntt = np.minimum(3, tt[pol].astype(np.int64))
+    tp = tt[pol] - ntt
+    tmp = nside * np.sqrt(3 * (1 - za[pol]))
+    jp = np.minimum((tp * tmp).astype(np.int64), nside - 1)
+    jm = np.minimum(((1 - tp) * tmp).astype(np.int64), nside - 1)
+    north = z[pol] >= 0
+    face[pol] = np.where(north, ntt, ntt + 8)
+    ix[pol] = np.where(north, nside - jm - 1, jp)
+    iy[pol] = np.where(north, nside - jp - 1, jm)
+
+    return face * nside**2 + _spread_bits(ix) + (_spread_bits(iy) << 1)
+
+def healpix_cells(l, b, order=10):
+    """
+    NESTED HEALPix cells (in ICRS, as MOCs require) that contain the given galactic positions.
+
+    Args:
+        l, b (array-like): Galactic coordinates in degrees.
+        order (int): HEALPix order (nside = 2**order). Order 10 cells are about 3.4' across, order 13 about 26".
+
+    Returns:
+        np.ndarray: Sorted unique cell indices at `order`.
+    """
+    from astropy.coordinates import SkyCoord
+    import astropy.units as u
+
+    icrs = SkyCoord(np.asarray(l, dtype=float) * u.deg, np.asarray(b, dtype=float) * u.deg, frame='galactic').icrs
+    ra = icrs.ra.deg
+    dec = icrs.dec.deg
+
+    try:
+        #astropy_healpix is optional, the numpy version above gives the same cells
+        from astropy_healpix import lonlat_to_healpix
+        cells = lonlat_to_healpix(ra * u.deg, dec * u.deg, 2**order, order='nested')
+    except ImportError:
+        cells = _healpix_nested(ra, dec, order)
+
+    return np.unique(np.asarray(cells, dtype=np.int64))
+
+def moc_from_cells(cells, order):
+    """
+    Normalizes a set of cells at one order into a MOC: every complete group of four sibling cells is replaced
+    by its parent, from `order` down to order 0.
+
+    Returns:
+        dict: Sorted cell indices keyed by order, only for orders that have cells.
+    """
+    moc = {}
+    cells = np.unique(np.asarray(cells, dtype=np.int64))
+    for current_order in range(order, 0, -1):
+        parents, counts = np.unique(cells // 4, return_counts=True)
+        full = parents[counts == 4]
+        remaining = cells[~np.isin(cells // 4, full)]
+        if len(remaining) > 0:
+            moc[current_order] = remaining
+        cells = full
+    if len(cells) > 0:
+        moc[0] = cells
+    return dict(sorted(moc.items()))
+
+def write_moc(df, file_name, order=10, l_col=None, b_col=None, name_col='MIR_NAME'):
+    """
+    Writes the sky coverage of a set of sources as a HEALPix Multi-Order Coverage map (IVOA MOC), e.g. to
+    overlay the fitted sources in Aladin. The format follows the file extension: '.json' for the JSON
+    serialization, anything else for the FITS one (NUNIQ ordering).
+
+    Args:
+        df (pd.DataFrame): Sources, e.g. the output of `final_model_select`.
+        file_name (str): Path of the MOC file to write.
+        order (int): Finest HEALPix order, the resolution of the coverage. See `healpix_cells`.
+        l_col, b_col (str or None): Columns with galactic coordinates in degrees. If None, the coordinates
+                                    are parsed from the names.
+        name_col (str): Column with the source names, used when `l_col` and `b_col` are not given.
+
+    Returns:
+        moc (dict): Cell indices keyed by order, as written to the file.
+    """
+    l, b = _source_coordinates(df, l_col, b_col, name_col)
+    moc = moc_from_cells(healpix_cells(l, b, order), order)
+
+    if str(file_name).lower().endswith('.json'):
+        with open(str(file_name), 'w') as moc_file:
+            json.dump({str(cell_order): cells.tolist() for cell_order, cells in moc.items()}, moc_file)
+    else:
+        from astropy.io import fits
+
+        uniq = np.sort(np.concatenate([4 * 4**cell_order + cells for cell_order, cells in moc.items()])) \
+            if moc else np.zeros(0, dtype=np.int64)
+        table = fits.BinTableHDU.from_columns([fits.Column(name='UNIQ', format='K', array=uniq)])
+        table.header['PIXTYPE'] = 'HEALPIX'
+        table.header['ORDERING'] = 'NUNIQ'
+        table.header['COORDSYS'] = 'C'
+        table.header['MOCORDER'] = order
+        table.header['MOCTOOL'] = 'region_export_v1'
+        fits.HDUList([fits.PrimaryHDU(), table]).writeto(str(file_name), overwrite=True)
+
+    return moc
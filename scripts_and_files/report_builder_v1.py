@@ -0,0 +1,295 @@
+import os
+import json
+import html
+import hashlib
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+from matplotlib.image import imread
+from matplotlib.backends.backend_pdf import PdfPages
+from analysis_functions_v2 import MODEL_SET_NAMES, render_region_plots, render_all_single_star_plots
+from model_selection_v1 import final_model_select
+from ecdf_stats_v1 import DEFAULT_PAIRS, load_samples, compare_samples
+from data_pipeline_v3 import read_pars_blocks
+
+#Hashes of the inputs of every figure and table written so far, kept in the report directory
+MANIFEST_FILE = 'report_hashes.json'
+
+#Parameters summarized in log10 in the summary table
+_LOG_PARAMS = ('lum', 'temp', 'disk_mass')
+
+def content_digest(*parts):
+    """
+    SHA-256 of a sequence of byte strings and/or plain values (hashed through their repr).
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else repr(part).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def file_digest(file_name):
+    """
+    SHA-256 of a file's contents, or of a marker if the file does not exist.
+    """
+    if not os.path.exists(file_name):
+        return content_digest('missing', file_name)
+
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as input_file:
+        for chunk in iter(lambda: input_file.read(2**20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _is_stale(manifest, output_dir, file_name, key, force):
+    """
+    True if `file_name` must be (re)made: forced, missing, or made from different inputs.
+    """
+    return force or not os.path.exists(file_name) or manifest.get(os.path.relpath(file_name, output_dir)) != key
+
+def _region_spec(region):
+    """
+    Accepts a region as a pars directory path or as a dict with at least 'pars_dir', and fills in the defaults.
+    """
+    if isinstance(region, str):
+        region = {'pars_dir': region}
+    spec = {'name': os.path.basename(os.path.normpath(region['pars_dir'])), 'stars': [],
+            'master_list_IR': None, 'master_list_gaia': None, 'cdp': None}
+    spec.update(region)
+    return spec
+
+def _summary_table(samples):
+    """
+    Number of stars and 16th, 50th and 84th percentiles of every sorted sample from `load_samples`.
+    """
+    rows = []
+    for (model_type, data_type, param), values in samples.items():
+        if param in _LOG_PARAMS:
+            values = np.log10(values[values > 0])
+            param = 'log_' + param
+        p16, p50, p84 = np.percentile(values, [16, 50, 84]) if len(values) > 0 else (np.nan,) * 3
+        rows.append({'model_set': MODEL_SET_NAMES[model_type], 'data_type': data_type, 'param': param,
+                     'n_stars': len(values), 'p16': p16, 'median': p50, 'p84': p84})
+    return pd.DataFrame(rows)
+
+def _html_page(title, sections):
+    """
+    Static HTML page from a list of (heading, html_body) sections.
+    """
+    body = ''.join('<h2>{}</h2>\n{}\n'.format(html.escape(heading), content) for heading, content in sections)
+    return ('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>{0}</title>\n'
+            '<style>body {{font-family: sans-serif; margin: 2em;}} img {{max-width: 100%;}} '
+            'table {{border-collapse: collapse; font-size: 0.85em;}} td, th {{border: 1px solid #999; padding: 2px 6px;}}'
+            '</style>\n</head>\n<body>\n<h1>{0}</h1>\n{1}</body>\n</html>\n').format(html.escape(title), body)
+
+def _write_pdf(pdf_name, title, figure_names, tables):
+    """
+    Writes one page per figure (the saved PNG) and one text page per table.
+    """
+    with PdfPages(pdf_name) as pdf:
+        for figure_name in figure_names:
+            fig = Figure(figsize=(11, 8.5))
+            ax = fig.add_axes([0, 0, 1, 0.95])
+            ax.imshow(imread(figure_name))
+            ax.axis('off')
+            fig.suptitle('{}: {}'.format(title, os.path.basename(figure_name)), fontsize=10)
+            pdf.savefig(fig)
+
+        for table_title, df in tables:
+            fig = Figure(figsize=(11, 8.5))
+            fig.text(0.02, 0.97, '{}: {}\n\n{}'.format(title, table_title, df.to_string()), family='monospace',
+                     fontsize=6, va='top')
+            pdf.savefig(fig)
+
+def build_report(regions, output_dir='report', model_types=(1, 2, 16, 17), formats=('html', 'pdf'), workers=None,
+                 dpi=150, density=False, weighted=False, bins=200, pairs=DEFAULT_PAIRS, n_permutations=0, seed=0,
+                 force=False):
+    """
+    Builds a static report of many regions without a display: the region HR/A_V figures, selected single-star
+    figures, the final model table and summary statistics of every region, as HTML pages and/or PDF files.
+
+    Every figure and table is keyed by a hash of its inputs (the pars file contents, or for single stars only
+    that star's lines, and the plotting options). The hashes are kept in `report_hashes.json` in `output_dir`,
+    so a rerun only remakes what changed.
+
+    Args:
+        regions (list):
+            One entry per region, either the path of the directory holding its eight pars files, or a dict with:
+                - 'pars_dir' (str): Directory holding the pars files (`pars_XXg04_IR.txt` and `pars_XXg04_Gaia.txt`).
+                - 'name' (str, optional): Name used for the output directory. Defaults to the name of `pars_dir`.
+                - 'stars' (list of str, optional): Stars (`MIR_NAME`) to draw single-star figures of.
+                - 'master_list_IR', 'master_list_gaia', 'cdp' (optional): Arguments of `final_model_select`.
+                  The final model table is only made when all three are given.
+
+        output_dir (str):
+            Directory of the report. Each region gets its own subdirectory.
+
+        model_types (tuple of int):
+            Model sets to include.
+
+        formats (tuple of str):
+            'html' and/or 'pdf'.
+
+        workers (int or None):
+            Number of worker processes for rendering and permutations. None uses every core.
+
+        dpi, density, weighted, bins:
+            Figure options, see `render_region_plots`.
+
+        pairs, n_permutations, seed:
+            Kolmogorov-Smirnov comparisons of the summary, see `compare_samples`.
+
+        force (bool):
+            Remake everything, ignoring the stored hashes.
+
+    Returns:
+        list of str:
+            Paths of the written report files (the index page first).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_name = os.path.join(output_dir, MANIFEST_FILE)
+    manifest = {}
+    if os.path.exists(manifest_name) and not force:
+        with open(manifest_name) as manifest_file:
+            manifest = json.load(manifest_file)
+
+    model_types = list(model_types)
+    pairs = [pair for pair in pairs if pair[0] in model_types and pair[1] in model_types]
+    report_files = []
+    index_links = []
+    n_made = 0
+    n_reused = 0
+
+    for region in regions:
+        spec = _region_spec(region)
+        pars_dir = spec['pars_dir']
+        region_dir = os.path.join(output_dir, spec['name'])
+        star_dir = os.path.join(region_dir, 'stars')
+        os.makedirs(star_dir, exist_ok=True)
+        print('Working on report for region {}:'.format(spec['name']))
+
+        pars_names = {(model_type, data_type): os.path.join(pars_dir, 'pars_{:02d}g04_{}.txt'.format(model_type, data_type))
+                      for model_type in model_types for data_type in ['IR', 'Gaia']}
+        pars_digests = {key: file_digest(name) for key, name in pars_names.items()}
+        all_pars_digest = content_digest(*[pars_digests[key] for key in sorted(pars_digests)])
+        new_keys = {}
+
+        #Region figures
+        region_figures = []
+        stale_types = []
+        for model_type in model_types:
+            figure_name = os.path.join(region_dir, MODEL_SET_NAMES[model_type] + '_region.png')
+            key = content_digest('region', pars_digests[(model_type, 'IR')], pars_digests[(model_type, 'Gaia')], dpi,
+                                 density, weighted, bins)
+            region_figures.append(figure_name)
+            new_keys[figure_name] = key
+            if _is_stale(manifest, output_dir, figure_name, key, force):
+                stale_types.append(model_type)
+        if stale_types:
+            render_region_plots(stale_types, workers=workers, output_dir=region_dir, pars_dir=pars_dir, dpi=dpi,
+                                density=density, weighted=weighted, bins=bins)
+        n_made += len(stale_types)
+        n_reused += len(model_types) - len(stale_types)
+
+        #Single-star figures, keyed by the lines of that star only
+        star_figures = []
+        if spec['stars']:
+            for model_type in model_types:
+                header_ir, blocks_ir = read_pars_blocks(pars_names[(model_type, 'IR')])
+                header_gaia, blocks_gaia = read_pars_blocks(pars_names[(model_type, 'Gaia')])
+                stale_stars = []
+                for star in spec['stars']:
+                    if star not in blocks_ir or star not in blocks_gaia:
+                        continue
+                    figure_name = os.path.join(star_dir, star + '_' + MODEL_SET_NAMES[model_type] + '.png')
+                    key = content_digest('star', ''.join(header_ir + blocks_ir[star]), ''.join(header_gaia + blocks_gaia[star]), dpi)
+                    star_figures.append(figure_name)
+                    new_keys[figure_name] = key
+                    if _is_stale(manifest, output_dir, figure_name, key, force):
+                        stale_stars.append(star)
+                    else:
+                        n_reused += 1
+                if stale_stars:
+                    render_all_single_star_plots(stale_stars, model_types=(model_type,), workers=workers,
+                                                 output_dir=star_dir, pars_dir=pars_dir, dpi=dpi)
+                n_made += len(stale_stars)
+
+        #Summary statistics and KS tests
+        summary_name = os.path.join(region_dir, 'summary.csv')
+        ks_name = os.path.join(region_dir, 'ks_tests.csv')
+        key = content_digest('summary', all_pars_digest, pairs, n_permutations, seed)
+        new_keys[summary_name] = key
+        new_keys[ks_name] = key
+        if _is_stale(manifest, output_dir, summary_name, key, force) or _is_stale(manifest, output_dir, ks_name, key, force):
+            samples = load_samples(model_types, pars_dir=pars_dir)
+            summary_df = _summary_table(samples)
+            ks_df = compare_samples(samples, pairs=pairs, n_permutations=n_permutations, workers=workers, seed=seed)
+            summary_df.to_csv(summary_name, index=False)
+            ks_df.to_csv(ks_name, index=False)
+        else:
+            summary_df = pd.read_csv(summary_name)
+            ks_df = pd.read_csv(ks_name)
+
+        #Final model table
+        tables = [('Summary of weighted means', summary_df), ('Kolmogorov-Smirnov tests', ks_df)]
+        final_name = os.path.join(region_dir, 'final_models.csv')
+        if spec['master_list_IR'] and spec['master_list_gaia'] and spec['cdp'] is not None:
+            key = content_digest('final', all_pars_digest, file_digest(spec['master_list_IR']),
+                                 file_digest(spec['master_list_gaia']), spec['cdp'])
+            new_keys[final_name] = key
+            if _is_stale(manifest, output_dir, final_name, key, force):
+                final_df = final_model_select(spec['master_list_IR'], spec['master_list_gaia'], spec['cdp'],
+                                              pars_dir=pars_dir,
+                                              region_file_name=os.path.join(region_dir, 'whole_region_circles.reg'))
+                #Only the per-star values, the per-fit arrays do not fit in a csv file
+                scalar_cols = [col for col in final_df.columns
+                               if len(final_df) == 0 or not isinstance(final_df[col].iloc[0], np.ndarray)]
+                final_df[scalar_cols].to_csv(final_name, index=False)
+            final_df = pd.read_csv(final_name)
+            tables.append(('Final model selection (number of YSOs)',
+                           final_df.groupby(['Model_Flag', 'Type_Flag']).size().unstack(fill_value=0)))
+
+        #Only figures that were actually written are recorded, so missing ones are retried next time
+        for file_name, key in new_keys.items():
+            if os.path.exists(file_name):
+                manifest[os.path.relpath(file_name, output_dir)] = key
+        with open(manifest_name, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+
+        figures = [name for name in region_figures + star_figures if os.path.exists(name)]
+        if 'html' in formats:
+            sections = [('Region figures', ''.join('<p><img src="{}"></p>\n'.format(os.path.relpath(name, region_dir))
+                                                   for name in region_figures if os.path.exists(name)))]
+            if star_figures:
+                sections.append(('Single-star figures', ''.join('<p><img src="{}"></p>\n'.format(os.path.relpath(name, region_dir))
+                                                                 for name in star_figures if os.path.exists(name))))
+            sections += [(table_title, df.to_html(float_format=lambda value: '{:.4g}'.format(value)))
+                         for table_title, df in tables]
+            if os.path.exists(final_name):
+                sections.append(('Files', '<p><a href="final_models.csv">final_models.csv</a></p>'))
+
+            html_name = os.path.join(region_dir, 'report.html')
+            with open(html_name, 'w') as html_file:
+                html_file.write(_html_page('Region ' + spec['name'], sections))
+            report_files.append(html_name)
+            index_links.append('<li><a href="{}">{}</a></li>'.format(os.path.relpath(html_name, output_dir),
+                                                                    html.escape(spec['name'])))
+
+        if 'pdf' in formats:
+            pdf_name = os.path.join(region_dir, 'report.pdf')
+            key = content_digest('pdf', [new_keys[name] for name in figures], [df.to_csv() for table_title, df in tables])
+            if _is_stale(manifest, output_dir, pdf_name, key, force):
+                _write_pdf(pdf_name, 'Region ' + spec['name'], figures, tables)
+                manifest[os.path.relpath(pdf_name, output_dir)] = key
+                with open(manifest_name, 'w') as manifest_file:
+                    json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+            report_files.append(pdf_name)
+
+    if 'html' in formats:
+        index_name = os.path.join(output_dir, 'index.html')
+        with open(index_name, 'w') as index_file:
+            index_file.write(_html_page('YSO SED fitting report', [('Regions', '<ul>\n' + '\n'.join(index_links) + '\n</ul>')]))
+        report_files.insert(0, index_name)
+
+    print('Report done: {} figures made, {} reused'.format(n_made, n_reused))
+    return report_files
@@ -0,0 +1,248 @@
+import os
+import time
+import sqlite3
+import numpy as np
+import pandas as pd
+from extractor_pipeline_v6 import multi_param_weight_avg
+from analysis_functions_v2 import MODEL_SET_NAMES, load_model_set
+from model_selection_v1 import calc_p_dm_df, model_tree, read_master_list, prioritize_gaia
+from region_export_v1 import lb_from_names
+from instrumentation_v1 import instrumented
+
+#Parameters averaged for the star summaries and the final selection
+SUMMARY_PARAMS = ['star_temp_arr', 'lum_arr', 'av_arr', 'star_rad_arr', 'd_mass_arr']
+
+_MEAN_COLUMNS = [param.replace('arr', suffix) for param in SUMMARY_PARAMS for suffix in ('avg', 'w_avg')]
+
+#Columns of every table after the region, source and model set, which all tables share
+RESULT_TABLES = {
+    'star_summaries': ['data_type', 'l', 'b', 'n_data', 'n_fits'] + _MEAN_COLUMNS,
+    'p_dm': ['data_type', 'l', 'b', 'n_data', 'n_fits', 'n_good', 'best_chi2', 'P_DM'],
+    'final_models': ['Type_Flag', 'l', 'b', 'n_data', 'n_fits', 'n_good', 'best_chi2', 'P_DM'] + _MEAN_COLUMNS,
+}
+
+_TEXT_COLUMNS = ('region', 'MIR_NAME', 'data_type', 'Type_Flag')
+
+def open_results_store(db_file):
+    """
+    Opens (and creates if needed) the SQLite results database of many regions.
+
+    The database has one row per region in `regions`, and three tables with one row per source:
+        - `star_summaries`: Unweighted and chi-squared weighted means of `SUMMARY_PARAMS` of every star in
+          every pars file (all fits, before the `cdp` cut).
+        - `p_dm`: Output of `calc_p_dm_df` for every pars file.
+        - `final_models`: The final selection of `final_model_select`, with the means of its accepted fits.
+    All tables have the columns 'region', 'MIR_NAME', 'Model_Flag' and the galactic 'l' and 'b' (from the
+    names), each indexed so queries over many regions do not scan the tables.
+
+    Returns:
+        sqlite3.Connection: Connection to pass to the other functions.
+    """
+    db = sqlite3.connect(str(db_file))
+    statements = ['CREATE TABLE IF NOT EXISTS regions (region TEXT PRIMARY KEY, pars_dir TEXT, cdp REAL, n_sources INTEGER, ingested TEXT)']
+    for table, columns in RESULT_TABLES.items():
+        column_defs = ['region TEXT NOT NULL', 'MIR_NAME TEXT NOT NULL', 'Model_Flag INTEGER']
+        column_defs += ['{} {}'.format(col, 'TEXT' if col in _TEXT_COLUMNS else 'REAL') for col in columns]
+        statements.append('CREATE TABLE IF NOT EXISTS {} ({})'.format(table, ', '.join(column_defs)))
+        for name, index_cols in [('name', 'MIR_NAME'), ('region', 'region'), ('model', 'Model_Flag'), ('lb', 'l, b')]:
+            statements.append('CREATE INDEX IF NOT EXISTS {0}_{1} ON {0} ({2})'.format(table, name, index_cols))
+    db.executescript(';\n'.join(statements))
+    return db
+
+def _insert(db, table, region_name, df):
+    """
+    Appends the rows of a DataFrame to one result table, keeping only the table's columns (missing ones are
+    stored as NULL) and adding the region and the l/b of every source.
+    """
+    if len(df) == 0:
+        return 0
+    df = df.reset_index(drop=True)
+    rows = pd.DataFrame({'region': region_name, 'MIR_NAME': df['MIR_NAME'].to_numpy(dtype=str),
+                         'Model_Flag': df['Model_Flag'].to_numpy(dtype=int)})
+    rows['l'], rows['b'] = lb_from_names(rows['MIR_NAME'])
+    for col in RESULT_TABLES[table]:
+        if col not in rows:
+            rows[col] = df[col].to_numpy() if col in df else None
+
+    #Plain Python values, since sqlite3 does not take numpy scalars
+    values = rows.astype(object).where(rows.notna(), None).to_numpy().tolist()
+    db.executemany('INSERT INTO {} ({}) VALUES ({})'.format(table, ', '.join(rows.columns), ', '.join('?' * rows.shape[1])), values)
+    return len(rows)
+
+@instrumented(counts=lambda result: {'stars': result})
+def ingest_region(db, region_name, pars_dir='.', master_list_IR=None, master_list_gaia=None, cdp=None, final_df=None,
+                  model_types=(1, 2, 16, 17)):
+    """
+    Stores the results of one region, replacing any earlier results of a region with the same name.
+
+    Each pars file is parsed once for its star summaries and, if `cdp` is given, its P_DM table. With the two
+    master lists as well, the final selection is made from those same tables (as in `final_model_select`,
+    without parsing again), unless it is passed as `final_df`.
+
+    Args:
+        db (sqlite3.Connection): Database from `open_results_store`.
+        region_name (str): Name of the region in the database.
+        pars_dir (str): Directory containing the pars files.
+        master_list_IR, master_list_gaia (str or None): Master lists of `final_model_select`.
+        cdp (float or None): Critical delta chi-squared of `calc_p_dm_df`. None skips the P_DM tables and the
+                             final selection.
+        final_df (pandas.DataFrame or None): Final selection already made with `final_model_select`. The means of
+                                             the final table are only stored if it still has the per-fit arrays.
+        model_types (tuple of int): Model sets to store. The final selection needs all four.
+
+    Returns:
+        int: Number of rows written.
+    """
+    p_dm = {}
+    n_rows = 0
+    with db: #One transaction, so a failed ingest leaves the previous results of the region in place
+        for table in ['regions'] + list(RESULT_TABLES):
+            db.execute('DELETE FROM {} WHERE region = ?'.format(table), (region_name,))
+
+        for model_type in model_types:
+            for data_type, df in zip(['IR', 'Gaia'], load_model_set(model_type, pars_dir)):
+                summary_df = multi_param_weight_avg(df, SUMMARY_PARAMS)
+                summary_df['Model_Flag'] = model_type
+                summary_df['data_type'] = data_type
+                n_rows += _insert(db, 'star_summaries', region_name, summary_df)
+
+                if cdp is not None:
+                    df_pdm = calc_p_dm_df(df, cdp, model_type)
+                    df_pdm['Model_Flag'] = model_type
+                    df_pdm['data_type'] = data_type
+                    p_dm[(model_type, data_type)] = df_pdm
+                    n_rows += _insert(db, 'p_dm', region_name, df_pdm)
+
+        if final_df is None and master_list_IR and master_list_gaia and len(p_dm) == 8:
+            trees = {data_type: model_tree(*[p_dm[(model_type, data_type)] for model_type in [1, 2, 16, 17]],
+                                           read_master_list(master_list))
+                     for data_type, master_list in [('IR', master_list_IR), ('Gaia', master_list_gaia)]}
+            final_df = prioritize_gaia(trees['IR'], trees['Gaia'], read_master_list(master_list_IR))
+
+        n_sources = None
+        if final_df is not None:
+            final_df = final_df.reset_index(drop=True)
+            if 'chi_2_arr' in final_df:
+                final_df = final_df.join(multi_param_weight_avg(final_df, SUMMARY_PARAMS)[_MEAN_COLUMNS])
+            n_sources = _insert(db, 'final_models', region_name, final_df)
+            n_rows += n_sources
+
+        db.execute('INSERT INTO regions VALUES (?, ?, ?, ?, ?)',
+                   (region_name, os.path.abspath(pars_dir), cdp, n_sources, time.strftime('%Y-%m-%dT%H:%M:%S')))
+
+    return n_rows
+
+def _model_flag(model):
+    """
+    Model set as its flag, from either the flag (17) or the name ('spubhmi').
+    """
+    names = {name: model_type for model_type, name in MODEL_SET_NAMES.items()}
+    return names[model] if isinstance(model, str) else int(model)
+
+def query_results(db, table='final_models', regions=None, models=None, type_flag=None, data_type=None, l_range=None,
+                  b_range=None, where=None, params=(), columns='*', order_by=None, limit=None):
+    """
+    Selects sources of one result table across regions, e.g. all YSOs whose final model is spubhmi and whose
+    weighted luminosity is above 100 L_sun:
+
+        query_results(db, models=['spubhmi'], where='lum_w_avg > ?', params=(100,))
+
+    Args:
+        db (sqlite3.Connection): Database from `open_results_store`.
+        table (str): 'final_models', 'star_summaries' or 'p_dm'.
+        regions (list of str or None): Regions to include. None includes all.
+        models (list or None): Model sets, as flags (1, 2, 16, 17) or names ('sp_s_i', ...). None includes all.
+        type_flag (str or None): 'gaia' or 'ir' (final_models only).
+        data_type (str or None): 'IR' or 'Gaia' (star_summaries and p_dm only).
+        l_range, b_range (tuple or None): (min, max) galactic longitude and latitude in degrees.
+        where (str or None): Extra SQL condition, with ? placeholders for `params`.
+        params (tuple): Values of the placeholders of `where`.
+        columns (str or list of str): Columns to return.
+        order_by (str or None): SQL ORDER BY clause, e.g. 'lum_w_avg DESC'.
+        limit (int or None): Maximum number of rows.
+
+    Returns:
+        pandas.DataFrame: The matching rows.
+    """
+    if table not in RESULT_TABLES:
+        raise ValueError('Unknown table {}, expected one of {}'.format(table, list(RESULT_TABLES)))
+
+    conditions = []
+    values = []
+    for col, allowed in [('region', regions), ('Model_Flag', None if models is None else [_model_flag(model) for model in models])]:
+        if allowed is not None:
+            conditions.append('{} IN ({})'.format(col, ', '.join('?' * len(allowed))))
+            values += list(allowed)
+    for col, value in [('Type_Flag', type_flag), ('data_type', data_type)]:
+        if value is not None:
+            conditions.append('{} = ?'.format(col))
+            values.append(value)
+    for col, value_range in [('l', l_range), ('b', b_range)]:
+        if value_range is not None:
+            conditions.append('{} BETWEEN ? AND ?'.format(col))
+            values += [float(value_range[0]), float(value_range[1])]
+    if where:
+        conditions.append('({})'.format(where))
+        values += list(params)
+
+    sql = 'SELECT {} FROM {}'.format(columns if isinstance(columns, str) else ', '.join(columns), table)
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    if order_by:
+        sql += ' ORDER BY ' + order_by
+    if limit is not None:
+        sql += ' LIMIT {:d}'.format(limit)
+
+    return pd.read_sql_query(sql, db, params=values)
+
+def cone_query(db, l, b, radius_deg, table='final_models', **filters):
+    """
+    Sources of one result table within `radius_deg` of (l, b), across regions. The l/b index selects a box
+    around the cone first, then the exact angular separation is applied.
+
+    Args:
+        db (sqlite3.Connection): Database from `open_results_store`.
+        l, b (float): Center of the cone in galactic degrees.
+        radius_deg (float): Radius of the cone in degrees.
+        table (str): 'final_models', 'star_summaries' or 'p_dm'.
+        **filters: Any other argument of `query_results` (regions, models, where, ...).
+
+    Returns:
+        pandas.DataFrame: The matching rows, with their separation in degrees ('sep_deg'), closest first.
+    """
+    b_range = (b - radius_deg, b + radius_deg)
+    #Longitude box widened towards the poles, and split in two where it crosses l = 0
+    dl = radius_deg / max(np.cos(np.radians(min(abs(b) + radius_deg, 89.9))), 1e-6)
+    if dl >= 180:
+        where, params = None, ()
+    else:
+        low, high = (l - dl) % 360, (l + dl) % 360
+        if low <= high:
+            where, params = 'l BETWEEN ? AND ?', (low, high)
+        else:
+            where, params = '(l >= ? OR l <= ?)', (low, high)
+    if filters.get('where'):
+        where = '({}) AND ({})'.format(filters.pop('where'), where) if where else filters.pop('where')
+        params = tuple(filters.pop('params', ())) + tuple(params)
+
+    #l and b are needed for the separation even if the caller did not ask for them
+    columns = filters.pop('columns', '*')
+    if isinstance(columns, str):
+        columns = None if columns.strip() == '*' else [col.strip() for col in columns.split(',')]
+    extra = [col for col in ['l', 'b'] if columns is not None and col not in columns]
+    if columns is not None:
+        filters['columns'] = columns + extra
+    df = query_results(db, table, b_range=b_range, where=where, params=params, **filters)
+
+    #Haversine separation
+    l_rad, b_rad, l0, b0 = np.radians(df['l'].to_numpy(dtype=float)), np.radians(df['b'].to_numpy(dtype=float)), np.radians(l), np.radians(b)
+    hav = np.sin((b_rad - b0) / 2)**2 + np.cos(b_rad) * np.cos(b0) * np.sin((l_rad - l0) / 2)**2
+    df['sep_deg'] = np.degrees(2 * np.arcsin(np.sqrt(np.clip(hav, 0, 1))))
+    df = df.drop(columns=extra)
+    return df[df['sep_deg'] <= radius_deg].sort_values('sep_deg').reset_index(drop=True)
+
+def list_regions(db):
+    """
+    Regions in the database, with their pars directory, cdp, number of final sources and ingestion date.
+    """
+    return pd.read_sql_query('SELECT * FROM regions ORDER BY region', db)
@@ -0,0 +1,300 @@
+import os
+import multiprocessing
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from extractor_pipeline_v6 import flat_fit_table, chi2_weights, _object_array
+from instrumentation_v1 import instrumented, table_counts
+
+#Stars are split into chunks of about this many fits for the workers, independently of the number of workers,
+#so the bootstrap results only depend on the seed
+_CHUNK_FITS = 2**18
+
+#Tables attached in this process (a worker) by `_init_shared_worker`, by shared memory block name
+_SHARED_TABLES = {}
+
+def _column_starts(n_stars, n_fits, dtypes):
+    """
+    Byte offsets of the columns in a shared block, after the offsets of the stars, plus the size of the block.
+    """
+    starts = [8 * (n_stars + 1)]
+    for col_dtype in dtypes:
+        starts.append(starts[-1] + -(-n_fits * np.dtype(col_dtype).itemsize // 8) * 8)
+    return starts
+
+def share_fit_table(df, col_names=None):
+    """
+    Copies a table of fits (e.g. from `read_extracted_file` or `calc_p_dm_df`) into one shared memory block,
+    as the flat values of every fit (`flat_fit_table`) plus the offset of the first fit of every star, so other
+    processes can attach to it with `attach_fit_table` instead of receiving a pickled copy.
+
+    The block is owned by the caller, which must `close()` and `unlink()` it once the workers are done (or use
+    `shared_fit_table`).
+
+    Args:
+        df (pandas.DataFrame): Table with one array per star in every column of `col_names`.
+        col_names (list of str or None): Array columns to share. None shares every array column. The
+                                         'MIR_NAME', 'n_data' and 'n_fits' columns are sent with the handle.
+
+    Returns:
+        tuple:
+            shm (multiprocessing.shared_memory.SharedMemory): The block.
+            handle (dict): Small picklable description of the block, passed to the workers.
+    """
+    if col_names is None:
+        col_names = [col for col in df.columns if df[col].dtype == object and len(df) > 0
+                     and isinstance(df[col].iloc[0], np.ndarray)]
+    col_names = list(col_names)
+    star_index, flat = flat_fit_table(df.reset_index(drop=True), col_names)
+    n_stars = len(df)
+    offsets = np.zeros(n_stars + 1, dtype=np.int64)
+    np.cumsum(np.bincount(star_index, minlength=n_stars), out=offsets[1:])
+    n_fits = int(offsets[-1])
+
+    #Layout of the block: the offsets, then the n_fits values of every column in its own dtype (float64, or
+    #float32 for `reduce_precision` tables), each starting on a multiple of 8 bytes
+    dtypes = [flat[col_name].dtype.str for col_name in col_names]
+    starts = _column_starts(n_stars, n_fits, dtypes)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, starts[-1]))
+    np.ndarray(n_stars + 1, dtype=np.int64, buffer=shm.buf)[:] = offsets
+    for col_name, col_dtype, start in zip(col_names, dtypes, starts):
+        np.ndarray(n_fits, dtype=col_dtype, buffer=shm.buf, offset=start)[:] = flat[col_name]
+
+    handle = {'shm_name': shm.name, 'n_stars': n_stars, 'total_fits': n_fits, 'columns': col_names, 'dtypes': dtypes,
+              'scalars': {col: df[col].to_numpy() for col in ['MIR_NAME', 'n_data', 'n_fits'] if col in df}}
+    return shm, handle
+
+def attach_fit_table(handle):
+    """
+    Attaches to a table shared by `share_fit_table`, without copying it.
+
+    Returns:
+        dict: 'shm' (keep it referenced while the arrays are used, see `close_fit_table`), 'offsets'
+              (first fit of every star, plus the total), 'flat' (one flat array per column, views of the block),
+              'n_stars' and the scalar columns of the handle.
+    """
+    try:
+        shm = shared_memory.SharedMemory(name=handle['shm_name'], track=False) #Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=handle['shm_name'])
+    n_stars, n_fits = handle['n_stars'], handle['total_fits']
+
+    starts = _column_starts(n_stars, n_fits, handle['dtypes'])
+    table = {'shm': shm, 'n_stars': n_stars,
+             'offsets': np.ndarray(n_stars + 1, dtype=np.int64, buffer=shm.buf),
+             'flat': {col_name: np.ndarray(n_fits, dtype=col_dtype, buffer=shm.buf, offset=start)
+                      for col_name, col_dtype, start in zip(handle['columns'], handle['dtypes'], starts)}}
+    table.update(handle['scalars'])
+    return table
+
+@contextmanager
+def shared_fit_table(df, col_names=None):
+    """
+    Context manager sharing a table for the duration of the block, and freeing the block afterwards:
+
+        with shared_fit_table(IR_df, ['chi_2_arr', 'lum_arr']) as handle:
+            means = parallel_weight_avg(handle, ['lum_arr'], workers=8)
+    """
+    shm, handle = share_fit_table(df, col_names)
+    try:
+        yield handle
+    finally:
+        shm.close()
+        shm.unlink()
+
+def fit_table_slice(table, start, stop, col_names=None):
+    """
+    Fits of the stars `start` to `stop` of an attached table, in the layout of `flat_fit_table` (star index
+    counted from `start`), so `chi2_weights` and `np.bincount` can be used on them. The arrays are views.
+    """
+    offsets = table['offsets'][start:stop + 1]
+    star_index = np.repeat(np.arange(stop - start), np.diff(offsets))
+    flat = {col_name: table['flat'][col_name][offsets[0]:offsets[-1]] for col_name in (col_names or table['flat'])}
+    return star_index, flat
+
+def fit_table_frame(table, start=0, stop=None):
+    """
+    DataFrame of the stars `start` to `stop` of an attached table with one array per star, like the table it
+    was shared from, for functions written for `read_extracted_file` tables (e.g. per-star plotting). The
+    arrays are views of the shared block.
+    """
+    stop = table['n_stars'] if stop is None else stop
+    offsets = table['offsets'][start:stop + 1] - table['offsets'][start]
+    d = {col: table[col][start:stop] for col in ['MIR_NAME', 'n_data', 'n_fits'] if col in table}
+    for col_name, values in fit_table_slice(table, start, stop)[1].items():
+        d[col_name] = _object_array(np.split(values, offsets[1:-1])) if stop > start else np.empty(0, dtype=object)
+    return pd.DataFrame(d)
+
+def close_fit_table(table):
+    """
+    Detaches from a table attached by `attach_fit_table`. Views of it made by the caller must be deleted first.
+    """
+    table['flat'].clear()
+    table.pop('offsets', None)
+    table['shm'].close()
+
+def star_chunks(handle, chunk_fits=_CHUNK_FITS):
+    """
+    Splits the stars of a shared table into contiguous (start, stop) chunks of about `chunk_fits` fits each.
+    """
+    table = attach_fit_table(handle)
+    starts = np.searchsorted(table['offsets'], np.arange(0, handle['total_fits'], chunk_fits), side='right') - 1
+    close_fit_table(table)
+
+    bounds = np.unique(np.concatenate(([0], starts.clip(0, handle['n_stars']), [handle['n_stars']])))
+    return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+def _init_shared_worker(handles):
+    for handle in handles:
+        _SHARED_TABLES[handle['shm_name']] = attach_fit_table(handle)
+
+def _chunk_task(task):
+    function, shm_name, start, stop, args = task
+    return function(_SHARED_TABLES[shm_name], start, stop, *args)
+
+def map_star_chunks(function, handle, args=(), workers=None, chunk_fits=_CHUNK_FITS):
+    """
+    Runs `function(table, start, stop, *args)` on every chunk of stars of a shared table in worker processes
+    which attach to the table once, when they start. Only the handle, the chunk bounds, `args` and the
+    results are pickled, whatever the size of the table.
+
+    Args:
+        function (callable): Module level function (so it can be pickled), called with an attached table
+                             (see `attach_fit_table`) and the range of stars to process.
+        handle (dict): Handle from `share_fit_table`.
+        args (tuple): Extra arguments of `function`, the same for every chunk, or a list with one tuple per
+                      chunk (see `star_chunks`).
+        workers (int or None): Number of worker processes. None uses every core, 1 runs in this process.
+        chunk_fits (int): Approximate number of fits per chunk.
+
+    Returns:
+        list: Results of every chunk, in star order.
+    """
+    chunks = star_chunks(handle, chunk_fits)
+    chunk_args = args if isinstance(args, list) else [args] * len(chunks)
+    tasks = [(function, handle['shm_name'], start, stop, tuple(chunk_arg)) for (start, stop), chunk_arg in zip(chunks, chunk_args)]
+
+    if workers == 1 or len(tasks) <= 1:
+        _init_shared_worker([handle])
+        try:
+            return [_chunk_task(task) for task in tasks]
+        finally:
+            close_fit_table(_SHARED_TABLES.pop(handle['shm_name']))
+
+    with multiprocessing.Pool(min(workers or os.cpu_count(), len(tasks)), initializer=_init_shared_worker,
+                              initargs=([handle],)) as pool:
+        return pool.map(_chunk_task, tasks)
+
+def _weight_avg_chunk(table, start, stop, param_list):
+    star_index, flat = fit_table_slice(table, start, stop, ['chi_2_arr'] + list(param_list))
+    n_stars = stop - start
+    weights = chi2_weights(flat['chi_2_arr'], star_index, n_stars)
+    n_models = np.bincount(star_index, minlength=n_stars)
+
+    means = {}
+    for col_name in param_list:
+        means[col_name.replace('arr', 'avg')] = np.bincount(star_index, weights=flat[col_name], minlength=n_stars) / n_models
+        means[col_name.replace('arr', 'w_avg')] = np.bincount(star_index, weights=weights * flat[col_name], minlength=n_stars)
+    return means
+
+def _star_frame(handle, chunk_results):
+    """
+    One row per star with the scalar columns of a handle and the concatenated per-chunk results.
+    """
+    big_df = pd.DataFrame({col: values for col, values in handle['scalars'].items()})
+    for col in chunk_results[0] if chunk_results else []:
+        big_df[col] = np.concatenate([result[col] for result in chunk_results])
+    return big_df
+
+@instrumented(counts=table_counts)
+def parallel_weight_avg(handle, param_list, workers=None):
+    """
+    Same as `multi_param_weight_avg`, computed by worker processes on a shared table.
+
+    Args:
+        handle (dict): Handle from `share_fit_table`, sharing 'chi_2_arr' and the columns of `param_list`.
+        param_list (list of str): Columns to average, e.g. ['star_temp_arr', 'lum_arr'].
+        workers (int or None): Number of worker processes.
+
+    Returns:
+        pandas.DataFrame: 'MIR_NAME', 'n_data', 'n_fits' and the '<param>_avg' and '<param>_w_avg' columns.
+    """
+    return _star_frame(handle, map_star_chunks(_weight_avg_chunk, handle, (list(param_list),), workers))
+
+def _quantile_chunk(table, start, stop, col_name, quantiles):
+    star_index, flat = fit_table_slice(table, start, stop, ['chi_2_arr', col_name])
+    n_stars = stop - start
+    weights = chi2_weights(flat['chi_2_arr'], star_index, n_stars)
+
+    #Sort the fits of every star by value; the weights of a star then add up from 0 to 1 within its fits
+    order = np.lexsort((flat[col_name], star_index))
+    cum_weights = np.cumsum(weights[order])
+    offsets = table['offsets'][start:stop + 1] - table['offsets'][start]
+    before = np.concatenate(([0.], cum_weights))[offsets[:-1]]
+
+    result = {}
+    for q in quantiles:
+        position = np.searchsorted(cum_weights, before + q * (1 - 1e-12))
+        position = np.clip(position, offsets[:-1], offsets[1:] - 1) #Rounding, and stars without fits
+        values = flat[col_name][order][position] if len(order) > 0 else np.zeros(n_stars)
+        result[col_name.replace('arr', 'q{:g}'.format(100 * q))] = np.where(offsets[1:] > offsets[:-1], values, np.nan)
+    return result
+
+@instrumented(counts=table_counts)
+def parallel_weighted_quantiles(handle, col_name, quantiles=(0.16, 0.5, 0.84), workers=None):
+    """
+    Chi-squared weighted quantiles (with the weights of `weight_mean`) of one parameter for every star of a
+    shared table, computed by worker processes.
+
+    Args:
+        handle (dict): Handle from `share_fit_table`, sharing 'chi_2_arr' and `col_name`.
+        col_name (str): Parameter, e.g. 'lum_arr'.
+        quantiles (tuple of float): Quantiles between 0 and 1.
+        workers (int or None): Number of worker processes.
+
+    Returns:
+        pandas.DataFrame: 'MIR_NAME', 'n_data', 'n_fits' and one '<param>_q<percent>' column per quantile,
+                          e.g. 'lum_q16', 'lum_q50', 'lum_q84': the smallest value of the star's fits whose
+                          cumulative weight reaches the quantile.
+    """
+    return _star_frame(handle, map_star_chunks(_quantile_chunk, handle, (col_name, tuple(quantiles)), workers))
+
+def _bootstrap_chunk(table, start, stop, param_list, n_boot, seed_seq):
+    star_index, flat = fit_table_slice(table, start, stop, ['chi_2_arr'] + list(param_list))
+    n_stars = stop - start
+    offsets = table['offsets'][start:stop + 1] - table['offsets'][start]
+    counts = np.diff(offsets)
+    rng = np.random.default_rng(seed_seq)
+
+    boot_means = {col_name: np.zeros((n_boot, n_stars)) for col_name in param_list}
+    for i in range(n_boot):
+        #Resample the fits of every star with replacement, keeping the number of fits of each star
+        sample = offsets[star_index] + (rng.random(len(star_index)) * counts[star_index]).astype(np.int64)
+        weights = chi2_weights(flat['chi_2_arr'][sample], star_index, n_stars)
+        for col_name in param_list:
+            boot_means[col_name][i] = np.bincount(star_index, weights=weights * flat[col_name][sample], minlength=n_stars)
+
+    return {col_name.replace('arr', 'w_avg_err'): boot_means[col_name].std(axis=0, ddof=1) for col_name in param_list}
+
+@instrumented(counts=table_counts)
+def parallel_bootstrap_errors(handle, param_list, n_boot=200, seed=0, workers=None):
+    """
+    Bootstrap errors of the chi-squared weighted means of `multi_param_weight_avg`, computed by worker
+    processes on a shared table: the fits of every star are resampled with replacement `n_boot` times, and
+    the error is the standard deviation of the resampled weighted means. The result only depends on `seed`,
+    not on the number of workers.
+
+    Args:
+        handle (dict): Handle from `share_fit_table`, sharing 'chi_2_arr' and the columns of `param_list`.
+        param_list (list of str): Parameters, e.g. ['star_temp_arr', 'lum_arr'].
+        n_boot (int): Number of bootstrap samples.
+        seed (int or None): Seed of the random resampling.
+        workers (int or None): Number of worker processes.
+
+    Returns:
+        pandas.DataFrame: 'MIR_NAME', 'n_data', 'n_fits' and one '<param>_w_avg_err' column per parameter.
+    """
+    n_chunks = len(star_chunks(handle))
+    args = [(list(param_list), n_boot, seed_seq) for seed_seq in np.random.SeedSequence(seed).spawn(n_chunks)]
+    return _star_frame(handle, map_star_chunks(_bootstrap_chunk, handle, args, workers))
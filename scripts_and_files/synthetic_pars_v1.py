@@ -0,0 +1,209 @@
+import os
+import numpy as np
+import pandas as pd
+from analysis_functions_v2 import MODEL_SET_NAMES
+
+#Parameter columns of each model set, in the order they appear in the pars files
+PARAMETER_NAMES = {1: ['star.radius', 'star.temperature', 'disk.mass', 'disk.rmax', 'disk.beta', 'disk.p', 'disk.h100',
+                       'scattering', 'inclination'],
+                   2: ['star.radius', 'star.temperature', 'disk.mass', 'disk.rmax', 'disk.beta', 'disk.p', 'disk.h100',
+                       'disk.rmin', 'scattering', 'inclination'],
+                   16: ['star.radius', 'star.temperature', 'disk.mass', 'disk.rmax', 'disk.beta', 'disk.p', 'disk.h100',
+                        'envelope.rho_0', 'envelope.rc', 'cavity.power', 'cavity.theta_0', 'cavity.rho_0',
+                        'ambient.density', 'ambient.temperature', 'scattering', 'inclination'],
+                   17: ['star.radius', 'star.temperature', 'disk.mass', 'disk.rmax', 'disk.beta', 'disk.p', 'disk.h100',
+                        'envelope.rho_0', 'envelope.rc', 'cavity.power', 'cavity.theta_0', 'cavity.rho_0', 'disk.rmin',
+                        'envelope.rmin', 'ambient.density', 'ambient.temperature', 'scattering', 'inclination']}
+
+#Columns [start, end) every value of a fit line is read from by `read_extracted_file`. Values are right-aligned
+#to the end of their slice, and every slice is followed by at least one blank column
+_FIT_SLICES = {'chi2': (45, 52), 'av': (56, 63), 'scale': (69, 74), 'star.radius': (76, 85), 'star.temperature': (87, 96),
+               'disk.mass': (98, 108), 'disk.rmax': (109, 118), 'disk.beta': (120, 129), 'disk.p': (130, 140),
+               'disk.h100': (141, 151)}
+_EXTRA_SLICES = {1: [(152, 162), (163, 173)], 2: [(152, 162), (163, 173), (174, 184)],
+                 16: [(153, 163), (164, 174), (175, 184), (185, 195), (196, 206), (207, 217), (218, 229), (230, 240),
+                      (241, 251)],
+                 17: [(153, 163), (164, 174), (175, 184), (185, 195), (196, 206), (207, 217), (218, 229), (230, 240),
+                      (241, 251), (252, 261), (262, 273)]}
+
+#Ranges each parameter is drawn from (uniform, or log-uniform when the last value is True)
+PARAMETER_RANGES = {'star.radius': (0.1, 30., True), 'disk.mass': (1e-8, 1e-1, True), 'disk.rmax': (50., 5000., True),
+                    'disk.beta': (1., 1.3, False), 'disk.p': (-2., 0., False), 'disk.h100': (1., 20., False),
+                    'disk.rmin': (1., 100., False), 'envelope.rho_0': (1e-24, 1e-16, True),
+                    'envelope.rc': (50., 5000., True), 'envelope.rmin': (1., 100., False), 'cavity.power': (1., 2., False),
+                    'cavity.theta_0': (0., 60., False), 'cavity.rho_0': (1e-23, 1e-20, True),
+                    'ambient.density': (1e-23, 1e-23, False), 'ambient.temperature': (10., 10., False),
+                    'scattering': (1., 1., False), 'inclination': (0., 90., False)}
+
+#log(T_eff) of the birthline temperature cut applied by `read_extracted_file`
+_LOG_TEMP_CUT = 3.6
+
+def _fit_slices(model_type):
+    """
+    Slice of every value of a fit line of one model set, in the order they are written.
+    """
+    slices = dict(_FIT_SLICES)
+    for name, value_slice in zip(PARAMETER_NAMES[model_type][7:], _EXTRA_SLICES[model_type]):
+        slices[name] = value_slice
+    return slices
+
+def _format_fit_lines(model_type, values):
+    """
+    Fit lines of the pars files, '%7i %30s' (fit number and model name) followed by every value right-aligned
+    in its column. All lines are formatted at once, one column at a time.
+    """
+    n_fits = len(values['chi2'])
+    columns = [np.char.add(np.char.rjust(np.arange(1, n_fits + 1).astype(str), 7), ' '),
+               np.char.rjust(values['model_name'], 30)]
+    line_end = 38
+    for name, (start, end) in _fit_slices(model_type).items():
+        if name in ('chi2', 'av', 'scale'):
+            text = np.char.mod('%.3f', values[name])
+        else:
+            text = np.char.mod('%.3e', values[name])
+        if np.any(np.char.str_len(text) > end - start):
+            raise ValueError('Values of {} do not fit their column in the pars files'.format(name))
+        columns.append(np.char.rjust(text, end - line_end))
+        line_end = end
+
+    lines = columns[0]
+    for column in columns[1:]:
+        lines = np.char.add(lines, column)
+    return lines
+
+def _star_fits(rng, model_type, n_fits, dropped):
+    """
+    Random values of every fit of one star, sorted by chi-squared as the SED fitter writes them.
+
+    Kept stars have at least one fit (the best one) that passes both cuts of `read_extracted_file`. Dropped
+    stars have every fit removed by one of the cuts: either all temperatures are below the birthline, or all
+    luminosities are below the Haemmerlé et al. (2019) relation.
+    """
+    values = {'chi2': np.sort(rng.uniform(0.5, 500., n_fits) * rng.uniform(0.05, 1.)),
+              'av': rng.uniform(0., 60., n_fits), 'scale': rng.uniform(0., 2., n_fits)}
+    for name in PARAMETER_NAMES[model_type]:
+        if name == 'star.temperature':
+            continue
+        low, high, log_scale = PARAMETER_RANGES[name]
+        values[name] = 10**rng.uniform(np.log10(low), np.log10(high), n_fits) if log_scale else rng.uniform(low, high, n_fits)
+
+    log_temp = rng.uniform(3.45, 4.6, n_fits)
+    if dropped == 'temperature':
+        log_temp = rng.uniform(3.45, _LOG_TEMP_CUT - 0.01, n_fits)
+
+    #Radius at which log(L) equals the luminosity cut 5.5 log(T_eff) - 20.7, with L = R^2 (T_eff / 5772)^4
+    log_rad_cut = (5.5 * log_temp - 20.7 - 4 * (log_temp - np.log10(5772))) / 2
+    if dropped == 'luminosity':
+        log_temp = np.maximum(log_temp, _LOG_TEMP_CUT + 0.01)
+        log_rad_cut = (5.5 * log_temp - 20.7 - 4 * (log_temp - np.log10(5772))) / 2
+        values['star.radius'] = 10**(log_rad_cut - rng.uniform(0.05, 1., n_fits))
+    elif dropped is None:
+        log_temp[0] = rng.uniform(_LOG_TEMP_CUT + 0.01, 4.4)
+        log_rad_cut[0] = (5.5 * log_temp[0] - 20.7 - 4 * (log_temp[0] - np.log10(5772))) / 2
+        values['star.radius'][0] = 10**(log_rad_cut[0] + rng.uniform(0.05, 1.))
+
+    values['star.temperature'] = 10**log_temp
+    values['model_name'] = np.char.add('{}_'.format(MODEL_SET_NAMES[model_type]),
+                                       rng.integers(0, 10**7, n_fits).astype(str))
+    return values
+
+def synthetic_star_names(n_stars, seed=0):
+    """
+    Unique GLIMPSE-style source names ('G351.1234+00.5678') spread over a 2 x 2 degree field.
+    """
+    rng = np.random.default_rng(seed)
+    cells = rng.choice(20000 * 20000, size=n_stars, replace=False)
+    l = 350. + (cells // 20000) * 1e-4
+    b = -1. + (cells % 20000) * 1e-4
+    return np.array(['G{:08.4f}{:+08.4f}'.format(l_i, b_i) for l_i, b_i in zip(l, b)])
+
+def write_synthetic_pars(file_name, model_type, names, n_data=8, fits_per_star=20, fits_spread=0.5,
+                         dropped_fraction=0.05, seed=0):
+    """
+    Writes a synthetic pars file in the same fixed-width layout as the SED fitter output, so that every
+    slice of `read_extracted_file` reads the intended value.
+
+    Args:
+        file_name (str): Path of the pars file to write.
+        model_type (int): Model set (1, 2, 16 or 17). Sets the header and the columns of the fit lines.
+        names (array-like of str): Source names, at most 17 characters.
+        n_data (int): Number of data points of every source.
+        fits_per_star (int): Mean number of fits per source.
+        fits_spread (float): Relative spread of the number of fits. With 0, every source has exactly
+                             `fits_per_star` fits.
+        dropped_fraction (float): Fraction of sources whose fits are all removed by the temperature or
+                                  luminosity cuts of `read_extracted_file` (half by each).
+        seed (int): Seed of the random values, so files are reproducible.
+
+    Returns:
+        pd.DataFrame: One row per source with 'MIR_NAME', 'n_fits' and 'dropped' (None, 'temperature' or
+                      'luminosity'), the expected outcome of the cuts.
+    """
+    rng = np.random.default_rng(seed)
+    names = np.asarray(names, dtype=str)
+    n_stars = len(names)
+
+    low = max(1, int(round(fits_per_star * (1 - fits_spread))))
+    high = max(low, int(round(fits_per_star * (1 + fits_spread))))
+    n_fits = rng.integers(low, high + 1, n_stars)
+
+    dropped = np.full(n_stars, None, dtype=object)
+    n_dropped = int(round(dropped_fraction * n_stars))
+    dropped_rows = rng.choice(n_stars, size=n_dropped, replace=False)
+    dropped[dropped_rows[:n_dropped // 2]] = 'temperature'
+    dropped[dropped_rows[n_dropped // 2:]] = 'luminosity'
+
+    header = ['fit_id', 'model_name', 'chi2', 'av', 'scale'] + PARAMETER_NAMES[model_type]
+    header_line = '{:>30} {:>10} {:>10}'.format('source_name', 'n_data', 'n_fits')
+
+    with open(str(file_name), 'w') as pars_file:
+        pars_file.write(header_line + '\n')
+        pars_file.write(' '.join('{:>10}'.format(name) for name in header) + '\n')
+        pars_file.write('-' * 80 + '\n')
+        for i in range(n_stars):
+            fit_lines = _format_fit_lines(model_type, _star_fits(rng, model_type, n_fits[i], dropped[i]))
+            pars_file.write('{:>30} {:>10} {:>10}\n'.format(names[i], n_data, n_fits[i]))
+            pars_file.write('\n'.join(fit_lines) + '\n')
+
+    return pd.DataFrame({'MIR_NAME': names, 'n_fits': n_fits, 'dropped': dropped})
+
+def write_synthetic_region(output_dir, n_stars, gaia_fraction=0.5, fits_per_star=20, fits_spread=0.5,
+                           dropped_fraction=0.05, model_types=(1, 2, 16, 17), seed=0):
+    """
+    Writes a complete synthetic region: the `pars_XXg04_IR.txt` and `pars_XXg04_Gaia.txt` files of every
+    model set and the IR and Gaia master lists (with the 'Spitzer' column `final_model_select` reads).
+    The Gaia files only hold a random subset of the sources, fitted with two more data points.
+
+    Args:
+        output_dir (str): Directory the files are written to. Created if it does not exist.
+        n_stars (int): Number of IR sources.
+        gaia_fraction (float): Fraction of the sources that also have Gaia data.
+        fits_per_star, fits_spread, dropped_fraction: See `write_synthetic_pars`.
+        model_types (tuple of int): Model sets to write.
+        seed (int): Seed of the random values.
+
+    Returns:
+        dict: Paths of the written files, keyed by (model_type, data_type) for the pars files and
+              'master_IR' and 'master_Gaia' for the master lists.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    names = synthetic_star_names(n_stars, seed)
+    gaia_names = names[np.sort(rng.choice(n_stars, size=int(round(gaia_fraction * n_stars)), replace=False))]
+
+    file_names = {}
+    for model_type in model_types:
+        for data_type, data_names, n_data in [('IR', names, 8), ('Gaia', gaia_names, 10)]:
+            file_name = os.path.join(output_dir, 'pars_{:02d}g04_{}.txt'.format(model_type, data_type))
+            write_synthetic_pars(file_name, model_type, data_names, n_data=n_data, fits_per_star=fits_per_star,
+                                 fits_spread=fits_spread, dropped_fraction=dropped_fraction,
+                                 seed=int(rng.integers(2**31)))
+            file_names[(model_type, data_type)] = file_name
+
+    for data_type, data_names in [('IR', names), ('Gaia', gaia_names)]:
+        file_name = os.path.join(output_dir, 'master_{}.csv'.format(data_type))
+        pd.DataFrame({'Spitzer': np.char.add('SSTGLMC ', data_names)}).to_csv(file_name, index=False)
+        file_names['master_' + data_type] = file_name
+
+    return file_names
@@ -0,0 +1,64 @@
+"""
+Installable entry point to the YSO SED fitting scripts. The functions live in the flat scripts of
+`scripts_and_files` (so the recipes and notebooks keep importing them directly) and are grouped here into
+subpackages:
+
+    yso_pipeline.io         - data files, pars files, catalogs, crossmatches and region exports
+    yso_pipeline.selection  - P_DM, model trees and the final model selection
+    yso_pipeline.stats      - weighted means, IR/Gaia comparisons, KS tests, posterior maps and ages
+    yso_pipeline.plotting   - HR/A_V figures, isochrones and reports
+
+Every name is imported on first use, so `from yso_pipeline.io import read_extracted_file` only loads the
+parser and its dependencies (numpy and pandas), not matplotlib or scipy.
+"""
+import importlib
+
+__version__ = '0.1.0'
+
+def lazy_exports(package_name, exports):
+    """
+    Module `__getattr__` and `__dir__` (PEP 562) for a package whose names are imported from the flat scripts
+    on first use.
+
+    Args:
+        package_name (str): `__name__` of the package.
+        exports (dict): Name -> script module it is imported from, e.g. {'read_extracted_file': 'extractor_pipeline_v6'}.
+
+    Returns:
+        tuple: (`__getattr__`, `__dir__`) functions to assign in the package.
+    """
+    def __getattr__(name):
+        if name not in exports:
+            raise AttributeError('module {!r} has no attribute {!r}'.format(package_name, name))
+        value = getattr(importlib.import_module(exports[name]), name)
+        setattr(importlib.import_module(package_name), name, value) #Cached, so later lookups skip __getattr__
+        return value
+
+    def __dir__():
+        return sorted(exports)
+
+    return __getattr__, __dir__
+
+_SUBPACKAGES = ('io', 'selection', 'stats', 'plotting')
+
+_EXPORTS = {'load_config': 'pipeline_cli_v1', 'run_pipeline': 'pipeline_cli_v1', 'run_region': 'pipeline_cli_v1',
+            'PIPELINE_STAGES': 'pipeline_cli_v1', 'main': 'pipeline_cli_v1',
+            'make_node': 'pipeline_dag_v1', 'run_dag': 'pipeline_dag_v1', 'region_dag': 'pipeline_dag_v1',
+            'prune_cache': 'pipeline_dag_v1',
+            'run_pipeline_async': 'async_pipeline_v1', 'ASYNC_STAGES': 'async_pipeline_v1',
+            'enable_instrumentation': 'instrumentation_v1', 'disable_instrumentation': 'instrumentation_v1',
+            'stage': 'instrumentation_v1', 'read_run_log': 'instrumentation_v1', 'summarize_stages': 'instrumentation_v1',
+            'run_benchmarks': 'benchmark_v1', 'compare_benchmarks': 'benchmark_v1', 'cold_import_times': 'benchmark_v1',
+            'precision_report': 'benchmark_v1'}
+
+__all__ = list(_SUBPACKAGES) + list(_EXPORTS)
+
+_getattr, _dir = lazy_exports(__name__, _EXPORTS)
+
+def __getattr__(name):
+    if name in _SUBPACKAGES:
+        return importlib.import_module('.' + name, __name__)
+    return _getattr(name)
+
+def __dir__():
+    return sorted(__all__)
@@ -0,0 +1,30 @@
+"""
+Reading and writing: data files for the SED fitter, pars files, SPICY/Gaia catalogs and crossmatches,
+synthetic test files, DS9/MOC region exports, Arrow/Parquet fit tables and the SQLite results database.
+"""
+from yso_pipeline import lazy_exports
+
+_EXPORTS = {'read_extracted_file': 'extractor_pipeline_v6', 'flat_fit_table': 'extractor_pipeline_v6',
+            'reduce_precision': 'extractor_pipeline_v6', 'full_precision': 'extractor_pipeline_v6',
+            'fit_table_nbytes': 'extractor_pipeline_v6',
+            'flag_txt_file_IR': 'data_pipeline_v3', 'flag_txt_file_Gaia': 'data_pipeline_v3',
+            'read_file_and_flux_calc_IR': 'data_pipeline_v3', 'read_data_file': 'data_pipeline_v3',
+            'format_data_lines': 'data_pipeline_v3', 'split_data_file': 'data_pipeline_v3',
+            'merge_pars_files': 'data_pipeline_v3', 'update_pars_file': 'data_pipeline_v3',
+            'flag_txt_file_24um': 'mips24_photometry_v1', 'aperture_photometry_24um': 'mips24_photometry_v1',
+            'read_catalog_table': 'crossmatch_pipeline_v1', 'crossmatch_spicy_gaia': 'crossmatch_pipeline_v1',
+            'lb_to_unit_vectors': 'crossmatch_pipeline_v1',
+            'build_catalog_index': 'catalog_service_v1', 'load_catalog_index': 'catalog_service_v1',
+            'box_search': 'catalog_service_v1', 'cone_search': 'catalog_service_v1',
+            'lb_from_names': 'region_export_v1', 'write_ds9_regions': 'region_export_v1',
+            'healpix_cells': 'region_export_v1', 'moc_from_cells': 'region_export_v1', 'write_moc': 'region_export_v1',
+            'load_model_set': 'analysis_functions_v2', 'read_master_list': 'model_selection_v1',
+            'synthetic_star_names': 'synthetic_pars_v1', 'write_synthetic_pars': 'synthetic_pars_v1',
+            'write_synthetic_region': 'synthetic_pars_v1',
+            'open_results_store': 'results_store_v1', 'ingest_region': 'results_store_v1',
+            'query_results': 'results_store_v1', 'cone_query': 'results_store_v1', 'list_regions': 'results_store_v1',
+            'write_fit_table': 'fit_tables_v1', 'read_fit_table': 'fit_tables_v1', 'read_fit_arrays': 'fit_tables_v1',
+            'export_fit_tables': 'fit_tables_v1', 'load_fit_tables': 'fit_tables_v1'}
+
+__all__ = list(_EXPORTS)
+__getattr__, __dir__ = lazy_exports(__name__, _EXPORTS)
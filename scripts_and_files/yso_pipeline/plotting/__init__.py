@@ -0,0 +1,15 @@
+"""
+Figures: single-star and region HR/A_V diagrams, luminosity distributions, isochrones and reports.
+"""
+from yso_pipeline import lazy_exports
+
+_EXPORTS = {'MODEL_SET_NAMES': 'analysis_functions_v2',
+            'hr_diagram_and_dust_ext_single': 'analysis_functions_v2', 'render_all_single_star_plots': 'analysis_functions_v2',
+            'hr_diagram_and_dust_ext_region': 'analysis_functions_v2', 'render_region_plots': 'analysis_functions_v2',
+            'render_region_figure': 'analysis_functions_v2', 'lum_freq_distribution_plot': 'analysis_functions_v2',
+            'hr_diagram_and_dust_ext_region_tree': 'model_selection_v1',
+            'isochrone_tracks': 'isochrones_v1', 'load_isochrone': 'isochrones_v1', 'available_ages': 'isochrones_v1',
+            'build_report': 'report_builder_v1'}
+
+__all__ = list(_EXPORTS)
+__getattr__, __dir__ = lazy_exports(__name__, _EXPORTS)
@@ -0,0 +1,12 @@
+"""
+Model selection: P_DM of every model set, the model trees and the final IR/Gaia selection.
+"""
+from yso_pipeline import lazy_exports
+
+_EXPORTS = {'calc_p_dm_df': 'model_selection_v1', 'model_tree': 'model_selection_v1',
+            'prioritize_gaia': 'model_selection_v1', 'final_model_select': 'model_selection_v1',
+            'read_master_list': 'model_selection_v1', 'make_region_file': 'model_selection_v1',
+            'weight_mean_tree': 'model_selection_v1', 'multi_param_weight_avg_tree': 'model_selection_v1'}
+
+__all__ = list(_EXPORTS)
+__getattr__, __dir__ = lazy_exports(__name__, _EXPORTS)
@@ -0,0 +1,23 @@
+"""
+Statistics of the fits: chi-squared weighted means, IR/Gaia comparisons, Kolmogorov-Smirnov tests,
+posterior maps, isochrone ages and masses, and parallel statistics of shared memory fit tables.
+"""
+from yso_pipeline import lazy_exports
+
+_EXPORTS = {'weight_mean': 'extractor_pipeline_v6', 'multi_param_weight_avg': 'extractor_pipeline_v6',
+            'chi2_weights': 'extractor_pipeline_v6',
+            'merge_funcs': 'analysis_functions_v2', 'compare_ir_gaia': 'analysis_functions_v2',
+            'comparison_deltas': 'analysis_functions_v2', 'comparison_star': 'analysis_functions_v2',
+            'load_samples': 'ecdf_stats_v1', 'ecdf': 'ecdf_stats_v1', 'ks_statistic': 'ecdf_stats_v1',
+            'compare_samples': 'ecdf_stats_v1',
+            'compute_posterior_maps': 'posterior_maps_v1', 'build_posterior_maps': 'posterior_maps_v1',
+            'load_posterior_maps': 'posterior_maps_v1', 'similar_stars': 'posterior_maps_v1',
+            'build_isochrone_grid': 'isochrone_grid_v1', 'age_mass_estimates': 'isochrone_grid_v1',
+            'share_fit_table': 'shared_tables_v1', 'attach_fit_table': 'shared_tables_v1',
+            'close_fit_table': 'shared_tables_v1', 'shared_fit_table': 'shared_tables_v1',
+            'fit_table_frame': 'shared_tables_v1', 'map_star_chunks': 'shared_tables_v1',
+            'parallel_weight_avg': 'shared_tables_v1', 'parallel_weighted_quantiles': 'shared_tables_v1',
+            'parallel_bootstrap_errors': 'shared_tables_v1'}
+
+__all__ = list(_EXPORTS)
+__getattr__, __dir__ = lazy_exports(__name__, _EXPORTS)
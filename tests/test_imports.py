@@ -0,0 +1,18 @@
+import os
+import sys
+import subprocess
+import pytest
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts_and_files')
+
+#Modules that worker processes import before doing any work. matplotlib and scipy must only be imported by
+#the functions that use them
+COLD_IMPORT_MODULES = ['extractor_pipeline_v6', 'data_pipeline_v3', 'analysis_functions_v2', 'model_selection_v1',
+                       'ecdf_stats_v1', 'yso_pipeline']
+
+@pytest.mark.parametrize('module', COLD_IMPORT_MODULES)
+def test_cold_import_skips_heavy_dependencies(module):
+    code = 'import sys, {}; print(" ".join(name for name in ("matplotlib", "scipy") if name in sys.modules))'
+    result = subprocess.run([sys.executable, '-c', code.format(module)], cwd=SCRIPTS_DIR, capture_output=True,
+                            text=True, check=True)
+    assert result.stdout.split() == []
@@ -0,0 +1,34 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts_and_files'))
+from extractor_pipeline_v6 import weight_mean, multi_param_weight_avg
+from model_selection_v1 import weight_mean_tree
+
+#The first star only has badly fitting models: exp(-chi2/2) underflows to 0 for every one of them, which used
+#to give NaN weighted means. Relative to its best fit the weights are 1, exp(-2.5) and exp(-50)
+CHI2 = [np.array([1600., 1605., 1700.]), np.array([1., 2., 3.])]
+LUM = [np.array([10., 20., 30.]), np.array([1., 2., 4.])]
+
+def _fits_df():
+    return pd.DataFrame({'MIR_NAME': ['G000.0000+00.0000', 'G000.0001+00.0000'], 'n_data': [8, 8], 'n_fits': [3, 3],
+                         'n_good': [3, 3], 'Model_Flag': [1, 1], 'Type_Flag': [0, 0],
+                         'chi_2_arr': pd.Series(CHI2, dtype=object), 'lum_arr': pd.Series(LUM, dtype=object)})
+
+def _expected_w_avg():
+    expected = []
+    for chi2, lum in zip(CHI2, LUM):
+        weights = np.exp(-(chi2 - chi2.min()) / 2)
+        expected.append(np.sum(weights * lum) / np.sum(weights))
+    return np.array(expected)
+
+def test_weighted_means_with_large_chi2_are_finite():
+    expected = _expected_w_avg()
+    assert abs(expected[0] - 10.76) < 0.01
+
+    for means in [multi_param_weight_avg(_fits_df(), ['lum_arr']), weight_mean(_fits_df(), 'lum_arr'),
+                  weight_mean_tree(_fits_df(), 'lum_arr')]:
+        np.testing.assert_allclose(means['lum_w_avg'].to_numpy(), expected, rtol=1e-12)
+        np.testing.assert_allclose(means['lum_avg'].to_numpy(), [20., 7. / 3.], rtol=1e-12)